@@ -0,0 +1,157 @@
+"""
+Benchmark for the controller's dispatch loop.
+
+Measures the number of tasks per second the controller can push through the
+workers for a set of no-op tasks.  The event driven loop in
+``HummingbirdFramework._run_controller`` is compared against the original
+polling loop (reproduced below) that slept one second after each dispatch.
+
+Run from the ``python_simplified`` directory with:
+
+    mpirun -n 4 python3 benchmarks/bench_dispatch.py --tasks 1000 --chunk-size 16
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from mpi4py import MPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mpi.abstract_classes import AbstractTask, AbstractWorker  # noqa: E402
+from mpi.codec import BinaryCodec, CompressedCodec, PickleCodec  # noqa: E402
+from mpi.controller import Controller  # noqa: E402
+from mpi.hb_framework import HummingbirdFramework  # noqa: E402
+from mpi.message import ControllerToWorkerMessage, WorkerToControllerMessage  # noqa: E402
+
+
+class NoOpTask(AbstractTask):
+    """
+    Generates ``n_tasks`` integers and discards the results.
+    """
+    n_tasks = 0
+
+    @staticmethod
+    def task_generator():
+        for i in range(NoOpTask.n_tasks):
+            yield i
+
+    def process_results(self, worker_id, results):
+        pass
+
+
+class NoOpWorker(AbstractWorker):
+    """
+    Returns immediately without doing any work.
+    """
+    def execute_task(self, msg):
+        return {}
+
+
+CODECS = {"mpi4py": None,
+          "pickle": PickleCodec(),
+          "binary": BinaryCodec(),
+          "zlib": CompressedCodec(BinaryCodec())}
+
+
+# noinspection PyPep8Naming
+def legacy_run_controller(comm, TaskClass):
+    """
+    Original polling controller loop.  It is kept here only as a baseline and
+    always sends one task per message.
+    """
+    status = MPI.Status()
+    controller = Controller(comm)
+    solver = TaskClass()
+    all_messages_sent = False
+    while True:
+        while comm.Iprobe(source=MPI.ANY_SOURCE):
+            worker_msg = comm.recv(status=status)
+            controller.add_available_worker(status.Get_source())
+            for worker_result in WorkerToControllerMessage.extract_results(worker_msg):
+                solver.process_results(status.Get_source(), worker_result)
+
+        if all_messages_sent:
+            if controller.all_workers_completed():
+                controller.terminate_everything()
+                sys.exit(0)
+            time.sleep(1)
+            continue
+
+        while controller.have_available_workers_p():
+            try:
+                task = solver.get_next()
+            except StopIteration:
+                all_messages_sent = True
+                break
+            else:
+                worker = controller.get_available_worker()
+                message = ControllerToWorkerMessage.build(
+                    False, [task], controller.assign_task_ids(1))
+                comm.send(message, dest=worker)
+                time.sleep(1)
+
+
+def time_run(run_controller, n_tasks):
+    """
+    Runs the framework once and returns the controller's elapsed time.
+
+    :param run_controller: Controller loop to benchmark.
+    :param n_tasks: Number of no-op tasks to dispatch.
+    :type n_tasks: int
+
+    :return: Elapsed seconds on the controller (rank 0) and None elsewhere.
+    :rtype: float
+    """
+    comm = MPI.COMM_WORLD
+    NoOpTask.n_tasks = n_tasks
+    comm.Barrier()
+    start = time.perf_counter()
+    try:
+        if comm.Get_rank() == HummingbirdFramework.MASTER_RANK:
+            run_controller(comm, NoOpTask)
+        else:
+            NoOpWorker(comm, comm.Get_rank()).run()
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    comm.Barrier()
+    return elapsed if comm.Get_rank() == HummingbirdFramework.MASTER_RANK else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=1000,
+                        help="Number of tasks for the event driven loop.")
+    parser.add_argument("--legacy-tasks", type=int, default=10,
+                        help="Number of tasks for the legacy polling loop.  "
+                             "Set to 0 to skip it.")
+    parser.add_argument("--chunk-size", type=int, default=1,
+                        help="Tasks per message for the event driven loop.")
+    parser.add_argument("--prefetch-depth", type=int, default=1,
+                        help="Chunks queued per worker for the event driven loop.")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="mpi4py",
+                        help="Message codec for both loops.")
+    args = parser.parse_args()
+    HummingbirdFramework.codec = CODECS[args.codec]
+    HummingbirdFramework.chunk_size = args.chunk_size
+    HummingbirdFramework.prefetch_depth = args.prefetch_depth
+
+    # Existing handlers stop the framework from writing per-task logs
+    logging.basicConfig(level=logging.WARNING)
+
+    runs = [("event", HummingbirdFramework._run_controller, args.tasks)]
+    if args.legacy_tasks > 0:
+        runs.append(("legacy", legacy_run_controller, args.legacy_tasks))
+
+    for name, run_controller, n_tasks in runs:
+        elapsed = time_run(run_controller, n_tasks)
+        if elapsed is not None:
+            print("%-8s tasks=%-8d seconds=%-10.4f tasks/s=%.1f"
+                  % (name, n_tasks, elapsed, n_tasks / elapsed))
+
+
+if __name__ == '__main__':
+    main()
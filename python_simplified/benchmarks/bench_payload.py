@@ -0,0 +1,104 @@
+"""
+Benchmark for sending large payloads through the framework's Transport.
+
+Rank 0 sends a payload to rank 1 which sends it straight back.  The round-trip
+time is reported for mpi4py's pickled send/recv and for the zero copy path that
+ships contiguous buffers out-of-band.  NumPy arrays are used if NumPy is
+installed and bytearrays otherwise.
+
+Run from the ``python_simplified`` directory with:
+
+    mpirun -n 2 python3 benchmarks/bench_payload.py
+"""
+import argparse
+import os
+import sys
+import time
+
+from mpi4py import MPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mpi.transport import Transport  # noqa: E402
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_payload(n_bytes):
+    """
+    :param n_bytes: Size of the payload in bytes.
+    :type n_bytes: int
+
+    :return: Results dictionary holding a payload of the specified size.
+    :rtype: dict
+    """
+    if numpy is not None:
+        data = numpy.ones(n_bytes // 8, dtype=numpy.float64)
+    else:
+        data = bytearray(n_bytes)
+    return {"id": n_bytes, "data": data}
+
+
+def ping_pong(transport, payload, repeats):
+    """
+    Bounces a payload between ranks 0 and 1.
+
+    :param transport: Transport under test.
+    :type transport: Transport
+
+    :param payload: Object to transmit.
+
+    :param repeats: Number of round trips.
+    :type repeats: int
+
+    :return: Mean round-trip seconds on rank 0 and None on rank 1.
+    :rtype: float
+    """
+    comm = transport.comm
+    comm.Barrier()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        if comm.Get_rank() == 0:
+            transport.send(payload, dest=1)
+            transport.recv(source=1)
+        else:
+            transport.send(transport.recv(source=0), dest=0)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeats if comm.Get_rank() == 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[2 ** p for p in range(10, 27, 2)],
+                        help="Payload sizes in bytes.")
+    parser.add_argument("--repeats", type=int, default=10,
+                        help="Round trips per payload size.")
+    parser.add_argument("--threshold", type=int, default=64 * 1024,
+                        help="Zero copy threshold in bytes.")
+    args = parser.parse_args()
+
+    comm = MPI.COMM_WORLD
+    if comm.Get_size() != 2:
+        raise ValueError("Run the payload benchmark with exactly two ranks")
+    # Only ranks 0 and 1 take part in the ping-pong
+    transports = [("pickle", Transport(comm)),
+                  ("zero-copy", Transport(comm, args.threshold))]
+
+    if comm.Get_rank() == 0:
+        print("payload: %s" % ("numpy" if numpy is not None else "bytearray"))
+    for n_bytes in args.sizes:
+        payload = make_payload(n_bytes)
+        for name, transport in transports:
+            seconds = ping_pong(transport, payload, args.repeats)
+            if seconds is not None:
+                mb_per_s = 2 * n_bytes / seconds / 1e6
+                print("%-10s bytes=%-10d round_trip_ms=%-10.3f MB/s=%.1f"
+                      % (name, n_bytes, seconds * 1e3, mb_per_s))
+
+
+if __name__ == '__main__':
+    main()
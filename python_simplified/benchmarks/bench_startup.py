@@ -0,0 +1,133 @@
+"""
+Benchmark of the startup time of short jobs.
+
+Launches a tiny job (a few no-op tasks) with mpirun for each number of ranks
+and measures its wall time from starting mpirun to mpirun exiting, in three
+ways:
+
+  * mpi - A script that only initializes MPI and synchronizes the ranks, i.e.,
+          the floor that the framework cannot go below.
+  * script - The job started as "python script.py".
+  * launcher - The job started as "python -m mpi.launcher script.py", which
+               broadcasts the framework's modules from rank 0.
+
+Run from the ``python_simplified`` directory, without mpirun, with, e.g.:
+
+    python3 benchmarks/bench_startup.py --ranks 2 4 8 \\
+        --mpirun-args="--oversubscribe" --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("mpi", "script", "launcher")
+
+
+def child(mode, n_tasks):
+    """
+    Body of every rank of a launched job.
+    """
+    from mpi4py import MPI
+    if mode == "mpi":
+        MPI.COMM_WORLD.Barrier()
+        return
+
+    import logging
+    sys.path.insert(0, DIRECTORY)
+    from mpi.abstract_classes import AbstractTask, AbstractWorker
+    from mpi.hb_framework import HummingbirdFramework
+
+    class StartupTask(AbstractTask):
+        @staticmethod
+        def task_generator():
+            return iter(range(n_tasks))
+
+        def process_results(self, worker_id, results):
+            pass
+
+    class StartupWorker(AbstractWorker):
+        def execute_task(self, msg):
+            return msg
+
+    # Existing handlers stop the framework from writing log files
+    logging.basicConfig(level=logging.WARNING)
+    HummingbirdFramework.run(StartupTask, StartupWorker)
+
+
+def launch(mpirun, n_ranks, mode, n_tasks):
+    """
+    Runs one job.
+
+    :return: Wall time of the job in seconds.
+    :rtype: float
+    """
+    script = os.path.abspath(__file__)
+    command = mpirun + ["-n", str(n_ranks), sys.executable]
+    if mode == "launcher":
+        command += ["-m", "mpi.launcher", "--path", DIRECTORY]
+    command += [script, "--child", "mpi" if mode == "mpi" else "framework",
+                "--tasks", str(n_tasks)]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=DIRECTORY, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ranks", type=int, nargs="+", default=[2, 4],
+                        help="Numbers of ranks to launch.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each configuration.")
+    parser.add_argument("--tasks", type=int, default=10,
+                        help="Number of no-op tasks of the job.")
+    parser.add_argument("--modes", nargs="+", choices=MODES,
+                        default=list(MODES), help="Ways to launch the job.")
+    parser.add_argument("--mpirun", default="mpirun",
+                        help="Command that launches the ranks.")
+    parser.add_argument("--mpirun-args", default="",
+                        help="Extra arguments of the launch command.")
+    parser.add_argument("--output",
+                        help="JSON file the results are written to.")
+    parser.add_argument("--child", choices=("mpi", "framework"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.tasks)
+        return
+
+    mpirun = [args.mpirun] + shlex.split(args.mpirun_args)
+    results = []
+    for n_ranks in args.ranks:
+        for mode in args.modes:
+            times = [launch(mpirun, n_ranks, mode, args.tasks)
+                     for _ in range(args.repeat)]
+            result = {"ranks": n_ranks, "mode": mode,
+                      "min_seconds": min(times),
+                      "median_seconds": statistics.median(times),
+                      "seconds": times}
+            results.append(result)
+            print("ranks=%-4d %-9s min=%.3fs median=%.3fs"
+                  % (n_ranks, mode, result["min_seconds"],
+                     result["median_seconds"]), flush=True)
+
+    if args.output is not None:
+        report = {"host": platform.node(),
+                  "python": platform.python_version(),
+                  "arguments": vars(args),
+                  "results": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
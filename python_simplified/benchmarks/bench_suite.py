@@ -0,0 +1,452 @@
+"""
+Benchmark suite for the framework's overhead.
+
+Runs synthetic workloads through ``HummingbirdFramework`` and through a minimal
+dynamic dispatch loop written directly with mpi4py (the baseline):
+
+  * noop - Tasks that return immediately.
+  * sleep - Tasks that sleep for exponentially distributed durations.
+  * cpu - Tasks that spin the CPU for a fixed number of iterations.
+  * payload - Tasks that carry a large bytes payload that is sent back.
+
+Each run reports the tasks per second, the controller's CPU seconds, and the
+peak RSS of the controller and of the largest worker during the run.  Telemetry
+slows the framework down, so the framework's throughput is measured without
+it.  A second framework run with telemetry reports the percentiles of the
+dispatch latency (from the controller sending a chunk to its worker starting
+it) and of the per-chunk overhead (round trip minus execution).
+
+On Linux, each process's peak RSS is reset before every run, and the growth
+of the RSS during the run is reported too since memory kept by earlier runs
+stays resident.  Elsewhere the peak is that since the process started, so
+later runs include earlier ones ("peak_rss_scope" is then "process").
+
+Run from the ``python_simplified`` directory with, e.g.:
+
+    mpirun -n 4 --oversubscribe python3 benchmarks/bench_suite.py \\
+        --output bench_results.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mpi4py
+from mpi4py import MPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mpi.abstract_classes import AbstractTask, AbstractWorker  # noqa: E402
+from mpi.hb_framework import HummingbirdFramework  # noqa: E402
+
+WORKLOADS = ("noop", "sleep", "cpu", "payload")
+
+
+class Workload(object):
+    """
+    Settings of the workload being run.  They are set identically on every rank
+    before each run.
+    """
+    name = "noop"
+    n_tasks = 0
+    sleep_seconds = 0.
+    cpu_iterations = 0
+    payload_bytes = 0
+    seed = 0
+
+    @staticmethod
+    def tasks():
+        """
+        :return: Generator of the workload's tasks.
+        """
+        rng = random.Random(Workload.seed)
+        for i in range(Workload.n_tasks):
+            if Workload.name == "sleep":
+                yield rng.expovariate(1. / Workload.sleep_seconds)
+            elif Workload.name == "cpu":
+                yield Workload.cpu_iterations
+            elif Workload.name == "payload":
+                yield bytes(Workload.payload_bytes)
+            else:
+                yield i
+
+    @staticmethod
+    def execute(task):
+        """
+        :param task: Task yielded by tasks().
+
+        :return: Result of the task.
+        """
+        if Workload.name == "sleep":
+            time.sleep(task)
+            return task
+        if Workload.name == "cpu":
+            total = 0
+            for i in range(task):
+                total += i * i
+            return total
+        # The payload is sent back so both directions carry it
+        return task
+
+
+class BenchTask(AbstractTask):
+    """
+    Yields the workload's tasks and counts the results.
+    """
+    def __init__(self):
+        AbstractTask.__init__(self)
+        self.n_results = 0
+
+    @staticmethod
+    def task_generator():
+        return Workload.tasks()
+
+    def process_results(self, worker_id, results):
+        self.n_results += 1
+
+
+class BenchWorker(AbstractWorker):
+    """
+    Executes the workload's tasks.
+    """
+    def execute_task(self, msg):
+        return Workload.execute(msg)
+
+
+def run_framework(comm, trace_prefix):
+    """
+    Runs the workload through the framework.
+
+    :param trace_prefix: If not None, telemetry is recorded.
+    :type trace_prefix: str
+
+    :return: On the controller, the telemetry of the run.  None elsewhere.
+    :rtype: Telemetry
+    """
+    HummingbirdFramework.trace_prefix = trace_prefix
+    controller = None
+    try:
+        if comm.Get_rank() == HummingbirdFramework.MASTER_RANK:
+            controller = HummingbirdFramework._build_controller(comm)
+            HummingbirdFramework._run_controller(comm, BenchTask, controller)
+        else:
+            BenchWorker(comm, comm.Get_rank()).run()
+    except SystemExit:
+        pass
+    return controller.telemetry if controller is not None else None
+
+
+def run_baseline(comm):
+    """
+    Runs the workload with a minimal mpi4py loop: one task per message, each
+    sent to the worker that just returned a result.
+    """
+    rank = comm.Get_rank()
+    if rank != 0:
+        while True:
+            task = comm.recv(source=0)
+            if task is None:
+                return None
+            comm.send(Workload.execute(task), dest=0)
+
+    status = MPI.Status()
+    tasks = Workload.tasks()
+    n_running = 0
+    for worker in range(1, comm.Get_size()):
+        task = next(tasks, None)
+        if task is None:
+            break
+        comm.send(task, dest=worker)
+        n_running += 1
+    while n_running:
+        comm.recv(source=MPI.ANY_SOURCE, status=status)
+        task = next(tasks, None)
+        if task is None:
+            n_running -= 1
+        else:
+            comm.send(task, dest=status.Get_source())
+    for worker in range(1, comm.Get_size()):
+        comm.send(None, dest=worker)
+    return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS of this process (Linux only).
+
+    :return: True if peak_rss() now covers only what follows.
+    :rtype: bool
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss(reset):
+    """
+    :param reset: Whether reset_peak_rss() succeeded.
+    :type reset: bool
+
+    :return: Peak RSS of this process in bytes.
+    :rtype: int
+    """
+    if reset:
+        return proc_status_bytes("VmHWM:")
+    # ru_maxrss is in KiB on Linux.  It is the peak of the whole process so far.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def proc_status_bytes(field):
+    """
+    :param field: Field of /proc/self/status in kB, e.g., "VmRSS:".
+    :type field: str
+
+    :return: Value of the field in bytes.
+    :rtype: int
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    raise ValueError("No %s in /proc/self/status" % field)
+
+
+def percentiles(values):
+    """
+    :return: The 50th, 90th and 99th percentiles and the maximum in
+             milliseconds, or None if there are no values.
+    :rtype: dict
+    """
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))] * 1e3
+
+    return {"p50_ms": at(0.5), "p90_ms": at(0.9), "p99_ms": at(0.99),
+            "max_ms": values[-1] * 1e3}
+
+
+def latencies(telemetry):
+    """
+    :return: Dispatch latency and per-chunk overhead percentiles.
+    :rtype: dict
+    """
+    chunks = dict()
+    for record in telemetry.records:
+        if record.started is None:
+            continue
+        chunks.setdefault((record.worker, record.dispatch_start), []).append(record)
+    dispatch = []
+    overhead = []
+    for records in chunks.values():
+        first = records[0]
+        dispatch.append(first.started - first.dispatch_start)
+        executing = records[-1].finished - first.started
+        overhead.append(first.returned - first.dispatch_start - executing)
+    return {"dispatch_latency": percentiles(dispatch),
+            "chunk_overhead": percentiles(overhead)}
+
+
+def measure(comm, mode, trace_prefix=None):
+    """
+    Runs the current workload once.
+
+    :param mode: "framework" or "baseline".
+    :type mode: str
+
+    :param trace_prefix: If not None, the framework records telemetry and the
+                         latencies are reported.
+    :type trace_prefix: str
+
+    :return: Measurements on rank 0 and None elsewhere.
+    :rtype: dict
+    """
+    reset = reset_peak_rss()
+    start_rss = proc_status_bytes("VmRSS:") if reset else None
+    comm.Barrier()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if mode == "framework":
+        telemetry = run_framework(comm, trace_prefix)
+    else:
+        telemetry = run_baseline(comm)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    comm.Barrier()
+
+    peak = peak_rss(reset)
+    growth = peak - start_rss if reset else None
+    peaks = comm.gather((peak, growth), root=0)
+    if comm.Get_rank() != 0:
+        return None
+
+    result = {"workload": Workload.name, "mode": mode,
+              "tasks": Workload.n_tasks, "seconds": elapsed,
+              "tasks_per_second": Workload.n_tasks / elapsed,
+              "controller_cpu_seconds": cpu,
+              "controller_peak_rss_bytes": peaks[0][0],
+              "worker_peak_rss_bytes": max(p[0] for p in peaks[1:]),
+              "peak_rss_scope": "process"}
+    if all(p[1] is not None for p in peaks):
+        result["peak_rss_scope"] = "run"
+        result["controller_rss_growth_bytes"] = peaks[0][1]
+        result["worker_rss_growth_bytes"] = max(p[1] for p in peaks[1:])
+    if telemetry is not None:
+        result.update(latencies(telemetry))
+        counters = telemetry.counters()
+        result["idle_worker_seconds"] = counters["idle_worker_seconds"]
+    return result
+
+
+def compare(path, results):
+    """
+    Prints the change in tasks per second against an earlier run.
+
+    :param path: JSON file written by an earlier run.
+    :type path: str
+
+    :param results: Results of this run.
+    :type results: List[dict]
+    """
+    with open(path) as f:
+        earlier = json.load(f)
+    before = {(r["workload"], r["mode"]): r for r in earlier["results"]}
+    print("Compared with commit %s:" % earlier.get("commit"))
+    for result in results:
+        old = before.get((result["workload"], result["mode"]))
+        if old is None:
+            continue
+        change = result["tasks_per_second"] / old["tasks_per_second"] - 1.
+        print("%-8s %-9s tasks/s=%-9.1f before=%-9.1f change=%+.1f%%"
+              % (result["workload"], result["mode"], result["tasks_per_second"],
+                 old["tasks_per_second"], change * 100))
+
+
+def git_commit():
+    """
+    :return: Commit of the working tree or None if it is not known.
+    :rtype: str
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS,
+                        default=list(WORKLOADS), help="Workloads to run.")
+    parser.add_argument("--tasks", type=int, default=5000,
+                        help="Number of tasks of the noop and cpu workloads.")
+    parser.add_argument("--sleep-tasks", type=int, default=500,
+                        help="Number of tasks of the sleep workload.")
+    parser.add_argument("--sleep-ms", type=float, default=2.,
+                        help="Mean duration of the sleep tasks.")
+    parser.add_argument("--cpu-iterations", type=int, default=20000,
+                        help="Loop iterations of each cpu task.")
+    parser.add_argument("--payload-tasks", type=int, default=200,
+                        help="Number of tasks of the payload workload.")
+    parser.add_argument("--payload-bytes", type=int, default=1024 * 1024,
+                        help="Size of each task's payload.")
+    parser.add_argument("--chunk-size", type=int, default=1,
+                        help="Tasks per message.")
+    parser.add_argument("--prefetch-depth", type=int, default=1,
+                        help="Chunks queued per worker.")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="Skip the raw mpi4py runs.")
+    parser.add_argument("--no-latency", action="store_true",
+                        help="Skip the framework runs with telemetry.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the sleep durations.")
+    parser.add_argument("--output",
+                        help="JSON file the results are written to.")
+    parser.add_argument("--compare",
+                        help="JSON file of an earlier run (e.g., another commit) "
+                             "to compare the tasks per second against.")
+    args = parser.parse_args()
+
+    comm = MPI.COMM_WORLD
+    if comm.Get_size() < 2:
+        raise ValueError("Run the benchmark suite with at least two ranks")
+    HummingbirdFramework.chunk_size = args.chunk_size
+    HummingbirdFramework.prefetch_depth = args.prefetch_depth
+    # Existing handlers stop the framework from writing per-task logs
+    logging.basicConfig(level=logging.WARNING)
+
+    trace_dir = None
+    if comm.Get_rank() == 0:
+        trace_dir = tempfile.mkdtemp(prefix="hb_bench_")
+    trace_prefix = os.path.join(comm.bcast(trace_dir, root=0), "trace")
+
+    n_tasks = {"noop": args.tasks, "sleep": args.sleep_tasks, "cpu": args.tasks,
+               "payload": args.payload_tasks}
+    modes = ["framework"] if args.no_baseline else ["framework", "baseline"]
+    results = []
+    for name in args.workloads:
+        Workload.name = name
+        Workload.n_tasks = n_tasks[name]
+        Workload.sleep_seconds = args.sleep_ms / 1e3
+        Workload.cpu_iterations = args.cpu_iterations
+        Workload.payload_bytes = args.payload_bytes
+        Workload.seed = args.seed
+        for mode in modes:
+            result = measure(comm, mode)
+            if mode == "framework" and not args.no_latency:
+                traced = measure(comm, mode, trace_prefix)
+                if result is not None:
+                    result["traced_tasks_per_second"] = traced["tasks_per_second"]
+                    for field in ("dispatch_latency", "chunk_overhead",
+                                  "idle_worker_seconds"):
+                        result[field] = traced[field]
+            if result is None:
+                continue
+            results.append(result)
+            latency = result.get("dispatch_latency")
+            growth = result.get("controller_rss_growth_bytes")
+            print("%-8s %-9s tasks=%-7d seconds=%-8.3f tasks/s=%-9.1f "
+                  "cpu_s=%-7.3f rss_mb=%-6.1f rss_growth_mb=%-6s latency_p50_ms=%s"
+                  % (name, mode, result["tasks"], result["seconds"],
+                     result["tasks_per_second"], result["controller_cpu_seconds"],
+                     result["controller_peak_rss_bytes"] / 2. ** 20,
+                     "%.1f" % (growth / 2. ** 20) if growth is not None else "-",
+                     "%.3f" % latency["p50_ms"] if latency else "-"), flush=True)
+
+    if comm.Get_rank() != 0:
+        return
+    shutil.rmtree(trace_dir, ignore_errors=True)
+    if args.compare is not None:
+        compare(args.compare, results)
+    if args.output is not None:
+        report = {"commit": git_commit(),
+                  "date": datetime.datetime.now().isoformat(),
+                  "host": platform.node(),
+                  "python": platform.python_version(),
+                  "mpi4py": mpi4py.__version__,
+                  "mpi": MPI.Get_library_version().strip().rstrip("\0"),
+                  "ranks": comm.Get_size(),
+                  "arguments": vars(args),
+                  "results": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+import codecs
+import logging
 import os
+import selectors
 import shlex
 import subprocess
 import time
@@ -13,6 +16,16 @@ class RunStatus(Enum):
 
 class CommandLine(object):
 
+    """
+    Bytes read from a pipe at a time.
+    """
+    READ_SIZE = 64 * 1024
+    """
+    Seconds a timed out process group has to exit after SIGTERM before it is
+    sent SIGKILL.
+    """
+    KILL_GRACE_SECONDS = 1.
+
     @staticmethod
     def _wait_timeout(proc, seconds):
         """
@@ -29,27 +42,18 @@ class CommandLine(object):
         :return: Test status result
         :rtype: Test.Result
         """
-
-        """Wait for a process to finish, or raise exception after timeout"""
-        start = time.time()
-        end = start + seconds
-        interval = 0.01
-
-        while True:
-            result = proc.poll()
-            if result is not None:
-                return RunStatus.PASSED
-            if time.time() >= end:
-                os.killpg(proc.pid, signal.SIGTERM)
-                # raise RuntimeError("Process timed out")
-                return RunStatus.TIMEOUT
-            time.sleep(interval)
+        return CommandLine._communicate(proc, time.monotonic() + seconds, dict())
 
     @staticmethod
-    def run(command_line_str, timeout_sec, **kwargs):
+    def run(command_line_str, timeout_sec, line_callback=None, output_file=None,
+            stderr_callback=None, **kwargs):
         """
         Execute the command line command.
 
+        The process's exit and its output pipes are waited on together (no
+        polling) and stdout and stderr are drained concurrently so a command
+        with a large output can never block on a full pipe.
+
         :param command_line_str: Instruction with command line.  The string
                                  should have all parameters and be self
                                  contained.  Processing the string will be
@@ -57,22 +61,169 @@ class CommandLine(object):
         :type command_line_str: str
         :param timeout_sec: Timeout for the command line instruction.
         :type timeout_sec: int
-        :param kwargs:
-        :return: Result from the run and the command line instruction.
+        :param line_callback: If not None, called with each line of stdout
+                              (without its newline) as soon as it is read.
+                              The output is then not kept in memory.
+        :type line_callback: callable
+        :param output_file: If not None, path or binary file object that stdout
+                            is written straight to.  The output is then not kept
+                            in memory.
+        :type output_file: str
+        :param stderr_callback: Only used if "stderr=subprocess.PIPE" is passed.
+                                Called with each line of stderr.  By default,
+                                the lines are logged at the DEBUG level.
+        :type stderr_callback: callable
+        :param kwargs: Passed to subprocess.Popen.
+        :return: Result from the run and the command line instruction.  The
+                 output is None if the command timed out or was streamed to a
+                 callback or file.
         :rtype: Tuple(RunStatus, str)
         """
         if 'stdout' in kwargs:
             raise ValueError('stdout argument not allowed.')
+        if line_callback is not None and output_file is not None:
+            raise ValueError('line_callback and output_file are exclusive.')
         inputs_args = shlex.split(command_line_str)
-        process = subprocess.Popen(inputs_args, stdout=subprocess.PIPE,
-                                   preexec_fn=os.setsid, **kwargs)
-        result = CommandLine._wait_timeout(process, timeout_sec)
 
-        if result == RunStatus.TIMEOUT:
+        opened_file = None
+        if output_file is None:
+            stdout = subprocess.PIPE
+        elif isinstance(output_file, str):
+            stdout = opened_file = open(output_file, "wb")
+        else:
+            stdout = output_file
+        try:
+            process = subprocess.Popen(inputs_args, stdout=stdout,
+                                       preexec_fn=os.setsid, **kwargs)
+        finally:
+            if opened_file is not None:
+                # The child has its own copy of the descriptor
+                opened_file.close()
+
+        chunks = []
+        handlers = dict()
+        if process.stdout is not None:
+            if line_callback is not None:
+                handlers[process.stdout] = CommandLine._line_splitter(line_callback)
+            else:
+                handlers[process.stdout] = chunks.append
+        if process.stderr is not None:
+            if stderr_callback is None:
+                def stderr_callback(line):
+                    logging.debug("%s (stderr): %s" % (inputs_args[0], line))
+            handlers[process.stderr] = CommandLine._line_splitter(stderr_callback)
+
+        result = CommandLine._communicate(process, time.monotonic() + timeout_sec,
+                                          handlers)
+        if result == RunStatus.TIMEOUT or process.stdout is None \
+                or line_callback is not None:
             return result, None
 
-        # Read the output of the process
-        output, unused_err = process.communicate()
-        if output is not None and type(output) != str:
-            output = output.decode()  # For python3 compatibility in bash
+        # For python3 compatibility in bash
+        output = b"".join(chunks).decode()
         return result, output
+
+    @staticmethod
+    def _communicate(proc, deadline, handlers):
+        """
+        Drains the process's pipes until they close and the process exits.  If
+        the deadline passes first, the process group is killed.
+
+        :param proc: Process information
+
+        :param deadline: time.monotonic() by which the process must complete.
+        :type deadline: float
+
+        :param handlers: Maps each pipe of the process to the function that
+                         receives the bytes read from it (and b"" at the end).
+        :type handlers: dict
+
+        :return: PASSED if the process exited before the deadline.
+        :rtype: RunStatus
+        """
+        selector = selectors.DefaultSelector()
+        for pipe in handlers:
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe.fileno(), selectors.EVENT_READ, pipe)
+
+        # A pidfd becomes readable when the process exits (Linux 5.3 and later)
+        pidfd = None
+        if hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(proc.pid)
+                selector.register(pidfd, selectors.EVENT_READ, None)
+            except OSError:
+                pidfd = None
+
+        try:
+            # The pidfd and pipes leave the selector as they finish
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    if key.data is None:
+                        selector.unregister(key.fd)
+                        continue
+                    data = os.read(key.fd, CommandLine.READ_SIZE)
+                    handlers[key.data](data)
+                    if not data:
+                        selector.unregister(key.fd)
+
+            if not selector.get_map():
+                remaining = deadline - time.monotonic()
+                try:
+                    # Returns at once if the pidfd already reported the exit
+                    proc.wait(timeout=max(remaining, 0))
+                    return RunStatus.PASSED
+                except subprocess.TimeoutExpired:
+                    pass
+            CommandLine._kill_group(proc)
+            return RunStatus.TIMEOUT
+        finally:
+            selector.close()
+            if pidfd is not None:
+                os.close(pidfd)
+            for pipe in handlers:
+                pipe.close()
+
+    @staticmethod
+    def _kill_group(proc):
+        """
+        Terminates the process's group, escalating to SIGKILL if it does not exit
+        within KILL_GRACE_SECONDS.
+
+        :param proc: Process information
+        """
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=CommandLine.KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _line_splitter(callback):
+        """
+        :param callback: Called with each complete line (without its newline).
+        :type callback: callable
+
+        :return: Function that accepts raw bytes and calls \\p callback per line.
+                 Passing b"" flushes the last line.
+        :rtype: callable
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial = [""]
+
+        def feed(data):
+            text = partial[0] + decoder.decode(data, final=not data)
+            lines = text.split("\n")
+            partial[0] = lines.pop()
+            for line in lines:
+                callback(line)
+            if not data and partial[0]:
+                callback(partial[0])
+                partial[0] = ""
+        return feed
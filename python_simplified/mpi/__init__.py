@@ -0,0 +1,20 @@
+import os
+
+"""
+Environment variable that selects the backend of HummingbirdFramework.run(),
+and its value that selects the local backend (see mpi.local_backend).
+"""
+BACKEND_ENV_VAR = "HB_BACKEND"
+LOCAL_BACKEND = "local"
+
+# The framework itself only imports mpi4py on the MPI path.  The processes that
+# the local backend spawns also keep mpi4py from initializing MPI in case the
+# script imports it.
+if os.environ.get(BACKEND_ENV_VAR) == LOCAL_BACKEND:
+    try:
+        import mpi4py
+    except ImportError:
+        pass
+    else:
+        mpi4py.rc.initialize = False
+        mpi4py.rc.finalize = False
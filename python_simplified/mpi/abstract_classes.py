@@ -3,11 +3,19 @@
 # abc = Abstract Base Class
 # Used by Python to indicate something is an abstract class
 import abc
-import sys
+import collections
+import concurrent.futures
 import socket
+import sys
+import threading
+import time
+import traceback
 
 from mpi.hb_framework import HummingbirdFramework
-from mpi.message import ControllerToWorkerMessage
+from mpi.message import ControllerToWorkerMessage, TaskError, WorkerToControllerMessage
+from mpi.task_source import TaskSource
+from mpi.transport import Transport
+from mpi.worker_cache import WorkerCache
 
 
 class AbstractWorker:
@@ -16,6 +24,29 @@ class AbstractWorker:
     """
     __metaclass__ = abc.ABCMeta
 
+    """
+    Read-only views of the data returned by load_shared_data().  The views are
+    in memory shared by all workers on the same node.
+    """
+    shared_data = dict()
+
+    """
+    The task class's reduce_op, set by the framework.  If not None, the results
+    of successful tasks are combined into "partial_result" instead of being
+    sent to the master.
+    """
+    reduce_op = None
+
+    """
+    Minimum and maximum seconds between checks for new messages while chunks
+    run concurrently.  In between, the worker waits for 1 /
+    CONCURRENT_POLL_BACKOFF of the time since a message or result last arrived,
+    so long chunks do not keep a core busy polling.
+    """
+    CONCURRENT_POLL_SECONDS = 0.001
+    MAX_CONCURRENT_POLL_SECONDS = 0.05
+    CONCURRENT_POLL_BACKOFF = 10
+
     def __init__(self, comm, rank):
         self.comm = comm
         self.rank = rank
@@ -26,24 +57,338 @@ class AbstractWorker:
         executes them.  This method eventually terminates based on a message
         from the master.
         """
+        self.transport = HummingbirdFramework.build_transport(self.comm)
+        # Requests of result sends whose transfer has not completed yet
+        self._pending_sends = collections.deque()
+        # Messages received from the master but not yet handled
+        self._queued_msgs = collections.deque()
+        # With telemetry, the times each queued message was received and
+        # unpickled
+        self._received_at = dict()
+        self.cache = WorkerCache(HummingbirdFramework.worker_cache_entries,
+                                 HummingbirdFramework.worker_cache_bytes)
+        self._cache_lock = threading.Lock()
+        # Lock of each key that is being loaded
+        self._loading = dict()
+        self.partial_result = None
+        self._reduce_lock = threading.Lock()
+        self.task_log = HummingbirdFramework.build_task_log()
+        self.hostname = socket.gethostname()
+        # Heartbeats start first so a long setup() (e.g., loading a model) is
+        # not mistaken for an unresponsive worker
+        self._start_heartbeat()
+        self.setup()
+
+        if HummingbirdFramework.worker_concurrency > 1:
+            self._run_concurrent(HummingbirdFramework.worker_concurrency)
+
         # Continue running tasks until all have been completed
         while True:
-            msg = self.comm.recv()
+            msg = self._next_message()
 
             if ControllerToWorkerMessage.extract_should_exit(msg):
-                txt = 'Worker Rank #{}: Exiting by request!'.format(self.rank)
-                logging.info(txt)
-                sys.exit(0)
+                self._exit()
+            self._send_results(self._execute_chunk(msg))
+
+    def _run_concurrent(self, concurrency):
+        """
+        Runs up to \\p concurrency chunks at once on a pool of threads, e.g., so
+        one worker per node keeps every core busy with CommandLine.run()
+        subprocesses.  The results of each chunk are sent as soon as it
+        finishes.  Only this thread communicates with the master.
+
+        :param concurrency: Maximum number of chunks executed at once.
+        :type concurrency: int
+        """
+        master = HummingbirdFramework.MASTER_RANK
+        running = set()
+        # When a message or result last arrived
+        active_at = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                # Receive whatever the master already sent
+                while self.transport.iprobe(source=master):
+                    self._accept_message(self.transport.recv(source=master))
+                    active_at = time.time()
+                while self._queued_msgs and len(running) < concurrency:
+                    msg = self._queued_msgs.popleft()
+                    if ControllerToWorkerMessage.extract_should_exit(msg):
+                        for future in concurrent.futures.as_completed(running):
+                            self._send_results(future.result())
+                        self._exit()
+                    running.add(pool.submit(self._execute_chunk, msg))
+
+                if not running:
+                    # Nothing to do until the master sends more
+                    self._accept_message(self.transport.recv(source=master))
+                    active_at = time.time()
+                    continue
+                timeout = min(max(AbstractWorker.CONCURRENT_POLL_SECONDS,
+                                  (time.time() - active_at)
+                                  / AbstractWorker.CONCURRENT_POLL_BACKOFF),
+                              AbstractWorker.MAX_CONCURRENT_POLL_SECONDS)
+                done, _ = concurrent.futures.wait(
+                    running, timeout=timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if done:
+                    active_at = time.time()
+                for future in done:
+                    running.remove(future)
+                    self._send_results(future.result())
+
+    def _execute_chunk(self, msg):
+        """
+        Executes the tasks of a chunk in order.
+
+        :param msg: Message built by ControllerToWorkerMessage.build().
+        :type msg: dict
+
+        :return: Message with the chunk's results.
+        :rtype: dict
+        """
+        tasks = ControllerToWorkerMessage.extract_generated_tasks(msg)
+        task_ids = ControllerToWorkerMessage.extract_task_ids(msg)
+        self.task_log.log('Worker Rank #%d (%s): Executing %d task(s)',
+                          self.rank, self.hostname, len(tasks))
 
-            log_txt = ('Worker Rank #%d (%s): Executing task'
-                       % (self.rank, socket.gethostname()))
-            logging.info(log_txt)
+        # Time at which each task started and, last, at which the chunk ended
+        marks = [time.time()]
+        results = []
+        for task in tasks:
+            results.append(self._execute_safely(task))
+            marks.append(time.time())
+        elapsed = marks[-1] - marks[0]
+        if self.reduce_op is not None:
+            self._combine_results(results)
 
-            task = ControllerToWorkerMessage.extract_generated_task(msg)
-            results = self.execute_task(task)
+        timings = None
+        if HummingbirdFramework.trace_prefix is not None:
+            received, unpickled = self._received_at.pop(id(msg),
+                                                         (marks[0], marks[0]))
+            timings = {"received": received, "unpickled": unpickled,
+                       "marks": marks}
+        # Requires "results" be pickleable
+        return WorkerToControllerMessage.build(task_ids, results, elapsed,
+                                               timings=timings)
 
-            # Requires "results" be pickleable
-            self.comm.send(results, dest=HummingbirdFramework.MASTER_RANK)
+    def _combine_results(self, results):
+        """
+        Combines the results of a chunk's successful tasks into the worker's
+        partial result.  Each combined result is replaced by None in the list
+        so only the failures travel to the master.
+
+        :param results: Results of the chunk's tasks.
+        :type results: List
+        """
+        # Chunks may run concurrently (see HummingbirdFramework.worker_concurrency)
+        with self._reduce_lock:
+            for i, result in enumerate(results):
+                if isinstance(result, TaskError):
+                    continue
+                self.partial_result = HummingbirdFramework.combine_results(
+                    self.reduce_op, self.partial_result, result)
+                results[i] = None
+
+    def _exit(self):
+        """
+        Completes the outstanding sends, contributes the partial result to the
+        reduction (if any), tears down the worker and exits.
+        """
+        self._stop_heartbeat()
+        self._complete_sends(0)
+        if self.reduce_op is not None:
+            HummingbirdFramework.reduce_results(self.comm, self.reduce_op,
+                                                self.partial_result)
+        self.teardown()
+        self.cache.clear()
+        txt = 'Worker Rank #{}: Exiting by request!'.format(self.rank)
+        logging.info(txt)
+        sys.exit(0)
+
+    def setup(self):
+        """
+        Called once before the worker executes its first task.  Override it to
+        load state shared by all of the worker's tasks.
+        """
+        pass
+
+    def teardown(self):
+        """
+        Called once after the worker executed its last task.  Override it to
+        release what setup() acquired.
+        """
+        pass
+
+    def cached(self, key, loader):
+        """
+        Returns state kept between tasks (e.g., a model loaded from disk),
+        loading it on first use.  Keys should match AbstractTask.cache_key() so
+        the controller sends tasks to the worker that already holds their state.
+
+        :param key: Hashable key of the state.
+
+        :param loader: Called without arguments to load the state on a miss.
+        :type loader: callable
+
+        :return: State of the key.
+        """
+        # Chunks may run concurrently (see HummingbirdFramework.worker_concurrency).
+        # Only loads of the same key wait on each other, and the loader runs
+        # without the cache's lock so it may itself call cached().
+        with self._cache_lock:
+            if key in self.cache:
+                return self.cache.get(key, loader)
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._cache_lock:
+                if key in self.cache:
+                    return self.cache.get(key, loader)
+            try:
+                value = loader()
+                with self._cache_lock:
+                    return self.cache.get(key, lambda: value)
+            finally:
+                with self._cache_lock:
+                    self._loading.pop(key, None)
+
+    def _execute_safely(self, task):
+        """
+        Executes a task and captures any exception it raises so the worker
+        survives and the master can retry the task elsewhere.
+
+        :param task: Task passed by the master.
+
+        :return: Result of execute_task() or a TaskError if it raised.
+        """
+        try:
+            return self.execute_task(task)
+        except Exception as e:
+            logging.exception("Worker Rank #%d: Task %r raised an exception"
+                              % (self.rank, task))
+            return TaskError(task, type(e).__name__, str(e), traceback.format_exc(),
+                             self.rank, self.hostname)
+
+    def _start_heartbeat(self):
+        """
+        Starts a background thread that sends heartbeats to the master if the
+        framework's heartbeats are enabled.  The thread requires MPI to be
+        initialized with MPI.THREAD_MULTIPLE.
+        """
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = None
+        interval = HummingbirdFramework.heartbeat_seconds
+        if interval is None:
+            return
+        if Transport.is_mpi_comm(self.comm):
+            from mpi4py import MPI
+            if MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+                logging.warning("Worker Rank #%d: Heartbeats disabled since MPI "
+                                "does not support MPI.THREAD_MULTIPLE" % self.rank)
+                return
+
+        def beat():
+            while not self._heartbeat_stop.wait(interval):
+                self.transport.send_heartbeat(HummingbirdFramework.MASTER_RANK)
+        self._heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _stop_heartbeat(self):
+        """
+        Stops the heartbeat thread (if any).
+        """
+        self._heartbeat_stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+
+    def _next_message(self):
+        """
+        Gets the next message to handle.  With work stealing, every message the
+        master already sent is received first so that revoke requests can find
+        the queued chunks they target.
+
+        :return: Next task chunk or exit message from the master.
+        :rtype: dict
+        """
+        master = HummingbirdFramework.MASTER_RANK
+        while True:
+            while (HummingbirdFramework.steal_work
+                   and self.transport.iprobe(source=master)):
+                self._accept_message(self.transport.recv(source=master))
+            if self._queued_msgs:
+                return self._queued_msgs.popleft()
+            self._accept_message(self.transport.recv(source=master))
+
+    def _accept_message(self, msg):
+        """
+        Queues a message from the master.  A revoke request instead removes its
+        chunk from the queue and returns the chunk's tasks unexecuted.  If the
+        chunk already started, the request is ignored.
+
+        :param msg: Message built by ControllerToWorkerMessage.build().
+        :type msg: dict
+        """
+        if not ControllerToWorkerMessage.extract_revoke(msg):
+            if HummingbirdFramework.trace_prefix is not None:
+                # Local transports do not time the unpickling separately
+                now = time.time()
+                self._received_at[id(msg)] = self.transport.receive_times or (now, now)
+            self._queued_msgs.append(msg)
+            return
+        revoked_ids = ControllerToWorkerMessage.extract_task_ids(msg)
+        for queued in self._queued_msgs:
+            if ControllerToWorkerMessage.extract_task_ids(queued) == revoked_ids:
+                self._queued_msgs.remove(queued)
+                self._received_at.pop(id(queued), None)
+                message = WorkerToControllerMessage.build(
+                    [], [], 0., revoked_task_ids=revoked_ids)
+                self._send_results(message)
+                return
+
+    def _send_results(self, message):
+        """
+        Sends a chunk's results to the master.  If the framework's send window is
+        enabled, the send is non-blocking so the worker can start on its next
+        chunk while the results drain.
+
+        :param message: Message built by WorkerToControllerMessage.build().
+        :type message: dict
+        """
+        timings = WorkerToControllerMessage.extract_timings(message)
+        if timings is not None:
+            timings["sent"] = time.time()
+        window = HummingbirdFramework.send_window
+        if window <= 0:
+            self.transport.send(message, dest=HummingbirdFramework.MASTER_RANK)
+            return
+        self._complete_sends(window - 1)
+        requests = self.transport.isend(message,
+                                        dest=HummingbirdFramework.MASTER_RANK)
+        self._pending_sends.append(requests)
+
+    def _complete_sends(self, max_pending):
+        """
+        Waits on the oldest outstanding sends until no more than \\p max_pending
+        remain.
+
+        :param max_pending: Number of sends allowed to stay outstanding.
+        :type max_pending: int
+        """
+        while len(self._pending_sends) > max_pending:
+            Transport.wait_all(self._pending_sends.popleft())
+
+    @staticmethod
+    def load_shared_data():
+        """
+        Loads large read-only inputs used by every task (e.g., a dataset).  If a
+        worker class overrides this method, it is called once on each node and
+        the data is placed in shared memory.  Each worker then reads it through
+        "self.shared_data" without receiving its own copy.
+
+        :return: Maps a name to a contiguous buffer such as a NumPy array or
+                 bytes.
+        :rtype: dict
+        """
+        return None
 
     @abc.abstractmethod
     def execute_task(self, msg):
@@ -65,13 +410,65 @@ class AbstractTask:
     """
     __metaclass__ = abc.ABCMeta
 
+    """
+    Optional operation that combines two results, e.g., MPI.SUM (which also
+    adds NumPy arrays element-wise) or a function of two results such as
+    operator.add.  It must be associative and commutative.  If set, each
+    worker combines the results of its tasks locally instead of sending them to
+    the controller.  Once every task is done, the workers' partial results are
+    merged by a tree reduction and process_reduced_results() receives the
+    total.  process_results() is then not called, while failed tasks are still
+    passed to process_error().
+    """
+    reduce_op = None
+
     def __init__(self):
         """
         Only defines the task generator.  The user may add any additional
         features to this class that they need when generating or processing
         task results.
         """
-        self.generator = self.__class__.task_generator()
+        # Created on the first call to get_next() so task_source() can use any
+        # state the subclass sets after calling this constructor
+        self.generator = None
+
+    def task_cost(self, task):
+        """
+        Optional hint of a task's relative cost (e.g., its expected run time).
+        The guided scheduler and work stealing use it to balance the load.
+
+        :param task: Task returned by the generator.
+
+        :return: Positive relative cost or None if unknown.
+        :rtype: float
+        """
+        return None
+
+    def cache_key(self, task):
+        """
+        Optional key of the expensive state a task needs on its worker (see
+        AbstractWorker.cached()).  Tasks with the same key are preferably sent
+        to the worker that already holds it.
+
+        :param task: Task returned by the generator.
+
+        :return: Hashable key or None if the task has no cached state.
+        """
+        return None
+
+    def process_error(self, worker_id, error):
+        """
+        Handles a task that still failed after HummingbirdFramework.max_retries
+        retries.  By default, the error is logged.
+
+        :param worker_id: Identification number (rank) of the worker where the
+                          task last failed
+        :type worker_id: int
+        :param error: Task, exception type, message, and traceback of the failure
+        :type error: TaskError
+        """
+        logging.error("CONTROLLER: Task failed on worker %d: %r\n%s"
+                      % (worker_id, error, error.traceback_text or ""))
 
     def get_next(self):
         """
@@ -80,13 +477,37 @@ class AbstractTask:
 
         :return: Next task to be performed by a worker.
         """
+        if self.generator is None:
+            self.generator = TaskSource.iterate(self.task_source())
         return next(self.generator)
 
+    def task_source(self):
+        """
+        Defines the tasks to be performed.  Override this method instead of
+        task_generator() if the tasks depend on the object's state.  Tasks are
+        pulled lazily, only when a worker has room for them.
+
+        :return: Iterable or async iterable of the tasks, e.g., a generator, an
+                 async generator, a ParameterGrid, or TaskSource.file_lines().
+        """
+        return self.__class__.task_generator()
+
     @staticmethod
     @abc.abstractmethod
     def task_generator():
         """
-        Define a generator that enumerates the objects to be created.
+        Define a generator that enumerates the objects to be created.  Not used
+        if task_source() is overridden.
+        """
+        pass
+
+    def process_reduced_results(self, results):
+        """
+        Processes the combination of every successful task's result if the class
+        defines reduce_op.  Called once on the controller after the last task.
+
+        :param results: Results combined with reduce_op or None if no task
+                        succeeded.
         """
         pass
 
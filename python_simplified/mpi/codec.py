@@ -0,0 +1,175 @@
+import abc
+import pickle
+import struct
+import zlib
+
+from mpi.message import ControllerToWorkerMessage
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class AbstractCodec:
+    """
+    Abstract class that defines how messages are converted to and from bytes.
+    A codec is selected per run with HummingbirdFramework.codec and must be the
+    same on every rank.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def dumps(self, obj, buffer_callback=None):
+        """
+        Serializes a message.
+
+        :param obj: Message to serialize.
+
+        :param buffer_callback: Callback passed to pickle for out-of-band
+                                buffers.  None keeps all buffers in-band.
+
+        :return: Serialized message.
+        :rtype: bytes
+        """
+        pass
+
+    @abc.abstractmethod
+    def loads(self, data, buffers=None):
+        """
+        Deserializes a message.
+
+        :param data: Serialized message.
+        :type data: bytes
+
+        :param buffers: Out-of-band buffers in the order they were produced.
+
+        :return: Message that was serialized.
+        """
+        pass
+
+
+class PickleCodec(AbstractCodec):
+    """
+    Pickles the entire message with protocol 5.
+    """
+    def dumps(self, obj, buffer_callback=None):
+        return pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+
+    def loads(self, data, buffers=None):
+        return pickle.loads(data, buffers=buffers)
+
+
+class BinaryCodec(AbstractCodec):
+    """
+    Encodes ControllerToWorkerMessage messages with a small fixed binary header
+    (exit and revoke flags and task IDs) so only the tasks themselves are
+    pickled.  Any other message is pickled in full.
+    """
+
+    PICKLED = 0
+    CONTROL = 1
+
+    """
+    Message kind, exit flag, revoke flag and number of task IDs.
+    """
+    HEADER = struct.Struct("<B??I")
+    TASK_ID_FORMAT = "<%dQ"
+
+    def dumps(self, obj, buffer_callback=None):
+        if not BinaryCodec._is_control_message(obj):
+            return (bytes([BinaryCodec.PICKLED])
+                    + pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback))
+
+        task_ids = ControllerToWorkerMessage.extract_task_ids(obj)
+        tasks = ControllerToWorkerMessage.extract_generated_tasks(obj)
+        parts = [BinaryCodec.HEADER.pack(
+                     BinaryCodec.CONTROL,
+                     ControllerToWorkerMessage.extract_should_exit(obj),
+                     ControllerToWorkerMessage.extract_revoke(obj),
+                     len(task_ids)),
+                 struct.pack(BinaryCodec.TASK_ID_FORMAT % len(task_ids), *task_ids)]
+        # Exit and revoke messages have no tasks so nothing else is transmitted
+        if tasks:
+            parts.append(pickle.dumps(tasks, protocol=5,
+                                      buffer_callback=buffer_callback))
+        return b"".join(parts)
+
+    def loads(self, data, buffers=None):
+        data = memoryview(data)
+        if data[0] == BinaryCodec.PICKLED:
+            return pickle.loads(data[1:], buffers=buffers)
+
+        _, should_exit, revoke, n_ids = BinaryCodec.HEADER.unpack_from(data)
+        offset = BinaryCodec.HEADER.size
+        task_ids = list(struct.unpack_from(BinaryCodec.TASK_ID_FORMAT % n_ids,
+                                           data, offset))
+        offset += 8 * n_ids
+        tasks = []
+        if offset < len(data):
+            tasks = pickle.loads(data[offset:], buffers=buffers)
+        return ControllerToWorkerMessage.build(should_exit, tasks, task_ids, revoke)
+
+    @staticmethod
+    def _is_control_message(obj):
+        """
+        :return: True if the object was built by ControllerToWorkerMessage.build().
+        :rtype: bool
+        """
+        return (isinstance(obj, dict)
+                and set(obj.keys()) == set(ControllerToWorkerMessage.KEYS))
+
+
+class CompressedCodec(AbstractCodec):
+    """
+    Wraps another codec and compresses serialized messages at least as large as
+    a threshold.  Out-of-band buffers are never compressed.
+    """
+
+    RAW = 0
+    ZLIB = 1
+    LZ4 = 2
+
+    def __init__(self, codec=None, threshold=64 * 1024, method="zlib", level=1):
+        """
+        :param codec: Codec whose output is compressed.  Defaults to PickleCodec.
+        :type codec: AbstractCodec
+
+        :param threshold: Minimum serialized size in bytes that is compressed.
+        :type threshold: int
+
+        :param method: Either "zlib" or "lz4".  lz4 requires the lz4 package.
+        :type method: str
+
+        :param level: Compression level passed to the compressor.
+        :type level: int
+        """
+        if method == "lz4" and lz4 is None:
+            raise ValueError("lz4 compression requires the lz4 package")
+        if method not in ("zlib", "lz4"):
+            raise ValueError("Unknown compression method \"%s\"" % method)
+        self.codec = codec if codec is not None else PickleCodec()
+        self.threshold = threshold
+        self.method = method
+        self.level = level
+
+    def dumps(self, obj, buffer_callback=None):
+        data = self.codec.dumps(obj, buffer_callback=buffer_callback)
+        if len(data) < self.threshold:
+            return bytes([CompressedCodec.RAW]) + data
+        if self.method == "lz4":
+            return (bytes([CompressedCodec.LZ4])
+                    + lz4.frame.compress(data, compression_level=self.level))
+        return bytes([CompressedCodec.ZLIB]) + zlib.compress(data, self.level)
+
+    def loads(self, data, buffers=None):
+        data = memoryview(data)
+        method, payload = data[0], data[1:]
+        if method == CompressedCodec.ZLIB:
+            payload = zlib.decompress(payload)
+        elif method == CompressedCodec.LZ4:
+            if lz4 is None:
+                raise ValueError("lz4 compressed message received but the lz4 "
+                                 "package is not installed")
+            payload = lz4.frame.decompress(payload)
+        return self.codec.loads(payload, buffers=buffers)
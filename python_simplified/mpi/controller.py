@@ -1,6 +1,36 @@
 import logging
+import time
+from collections import deque, OrderedDict
 
-from mpi.message import ControllerToWorkerMessage
+from mpi.message import ControllerToWorkerMessage, TaskError
+from mpi.sampled_log import SampledLog
+from mpi.transport import Transport
+
+
+class _Assignment(object):
+    """
+    Chunk sent to a worker.
+    """
+    def __init__(self, chunk, speculative=False):
+        """
+        :param chunk: (task ID, task, cost) of each task in the chunk.
+        :type chunk: List[Tuple(int, object, float)]
+
+        :param speculative: True if the chunk duplicates a straggler.
+        :type speculative: bool
+        """
+        self.chunk = chunk
+        self.speculative = speculative
+        # Time the worker (presumably) started the chunk or None if still queued
+        self.started_at = None
+        self.duplicated = False
+
+    def cost(self):
+        """
+        :return: Total cost of the tasks in the chunk.
+        :rtype: float
+        """
+        return sum(e[2] for e in self.chunk)
 
 
 class Controller(object):
@@ -9,39 +39,239 @@ class Controller(object):
     """
     FIRST_WORKER_RANK = 1
 
-    def __init__(self, comm):
+    """
+    Weight of the newest measurement in the moving average of the task duration.
+    """
+    TASK_TIME_SMOOTHING = 0.2
+
+    """
+    Chunks have a fixed number of tasks (or a fixed duration if chunking is
+    adaptive).
+    """
+    STATIC = "static"
+    """
+    Guided self-scheduling.  Once the end of the task generator is in sight,
+    each chunk gets a share of the remaining (estimated) work so chunks shrink
+    toward the end of the run.
+    """
+    GUIDED = "guided"
+    """
+    In guided mode, each chunk is at most the remaining work divided by this
+    factor times the number of workers.
+    """
+    GUIDED_FACTOR = 2
+    """
+    In guided mode, how many chunks per worker are pulled from the task
+    generator ahead of dispatch to detect the end of the generator.
+    """
+    GUIDED_LOOKAHEAD = 4
+    """
+    A running chunk is only duplicated if it has run this many times longer
+    than its expected duration.
+    """
+    SPECULATION_SLOWDOWN = 1.5
+    """
+    Seconds between straggler checks while idle workers wait for the last chunks.
+    """
+    SPECULATION_POLL_SECONDS = 0.01
+    """
+    A worker is declared unresponsive after this many heartbeat intervals
+    without a heartbeat.
+    """
+    HEARTBEAT_MISSES = 5
+    """
+    Minimum and maximum seconds between checks for results while the task
+    deadlines and heartbeats are checked.  In between, the controller sleeps
+    for 1 / FAULT_POLL_BACKOFF of the time since it started waiting, so a result
+    is handled at most that fraction of its wait late while a long wait does not
+    keep a core busy.
+    """
+    FAULT_POLL_SECONDS = 0.001
+    MAX_FAULT_POLL_SECONDS = 0.05
+    FAULT_POLL_BACKOFF = 10
+    """
+    The task deadlines and heartbeats are checked this many times per the
+    shorter of task_timeout and heartbeat_seconds.
+    """
+    FAULT_CHECKS_PER_INTERVAL = 10
+    """
+    Once tasks have cache keys, how many chunks per worker are pulled from the
+    task generator ahead of dispatch to find tasks whose key a worker holds.
+    """
+    AFFINITY_LOOKAHEAD = 4
+
+    def __init__(self, comm, chunk_size=1, target_chunk_seconds=None,
+                 max_chunk_size=1024, prefetch_depth=1, transport=None,
+                 scheduler=STATIC, steal_work=False, speculate=False,
+                 task_timeout=None, heartbeat_seconds=None, max_retries=2,
+                 cache_entries=4):
+        """
+        :param comm: MPI communicator shared by the controller and its workers.
+
+        :param chunk_size: Number of tasks sent to a worker in each message.  When
+                           chunking is adaptive, this is the initial chunk size.
+        :type chunk_size: int
+
+        :param target_chunk_seconds: If not None, the chunk size adapts so that a
+                                     worker spends about this many seconds on each
+                                     chunk.
+        :type target_chunk_seconds: float
+
+        :param max_chunk_size: Upper bound on the adaptive chunk size.
+        :type max_chunk_size: int
+
+        :param prefetch_depth: Maximum number of chunks outstanding on each worker.
+                               A depth above one queues the next chunk on the
+                               worker while it is still executing the current one.
+        :type prefetch_depth: int
+
+        :param transport: Transport used to send messages to the workers.  If not
+                          specified, messages are pickled by mpi4py.
+        :type transport: Transport
+
+        :param scheduler: Either Controller.STATIC or Controller.GUIDED.
+        :type scheduler: str
+
+        :param steal_work: If True, chunks queued but not started on a busy worker
+                           are moved to idle workers once no new tasks remain.
+        :type steal_work: bool
+
+        :param speculate: If True, once no new tasks remain, idle workers rerun
+                          the longest running (straggler) chunks.  The first
+                          result of each task is kept.
+        :type speculate: bool
+
+        :param task_timeout: If not None, a worker whose running chunk takes more
+                             than this many seconds per task is declared failed.
+        :type task_timeout: float
+
+        :param heartbeat_seconds: If not None, the interval at which workers send
+                                  heartbeats.  A worker that misses
+                                  HEARTBEAT_MISSES heartbeats is declared failed.
+        :type heartbeat_seconds: float
+
+        :param max_retries: Number of times a failed task is executed again
+                            before giving up on it.
+        :type max_retries: int
+
+        :param cache_entries: Number of values in each worker's cache.  Used to
+                              track which cache keys each worker holds.
+        :type cache_entries: int
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if prefetch_depth < 1:
+            raise ValueError("prefetch_depth must be at least 1")
+        if scheduler not in (Controller.STATIC, Controller.GUIDED):
+            raise ValueError("Unknown scheduler \"%s\"" % scheduler)
         self.comm = comm
+        self.transport = transport if transport is not None else Transport(comm)
         self.n_workers = comm.Get_size() - 1
 
         self.all_workers = list(range(Controller.FIRST_WORKER_RANK,
                                       self.n_workers + Controller.FIRST_WORKER_RANK))
-        self.available_workers = set(self.all_workers)
+        self.prefetch_depth = prefetch_depth
+        # Number of chunks sent to each worker whose results are not back yet
+        self.outstanding = {w: 0 for w in self.all_workers}
+        # Index "i" holds the workers with exactly "i" outstanding chunks
+        self._workers_by_load = [set() for _ in range(prefetch_depth + 1)]
+        self._workers_by_load[0].update(self.all_workers)
+
+        self.chunk_size = chunk_size
+        self.target_chunk_seconds = target_chunk_seconds
+        self.max_chunk_size = max_chunk_size
+        self.scheduler = scheduler
+        self.steal_work = steal_work
+        self.speculate = speculate
+        self.task_timeout = task_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_retries = max_retries
+        self.cache_entries = cache_entries
+        self._avg_seconds_per_cost = None
+        self._worker_seconds_per_cost = dict()
+        self._next_task_id = 0
+
+        # Tasks not yet sent to a worker as (task ID, task, cost) tuples
+        self.pending = deque()
+        self._pending_cost = 0.
+        self.generator_exhausted = False
+        # Tasks pulled from the generator whose results have not been accepted
+        self.n_unfinished_tasks = 0
+        # IDs of tasks completed by a previous run that must not be executed
+        self.completed_task_ids = set()
+        # If not None, the MemoCache whose stored results replace executing tasks
+        self.memo = None
+        # Log of the per-task (dispatch) messages
+        self.task_log = SampledLog()
+        # If not None, the Telemetry that records the timeline of the run
+        self.telemetry = None
+        # (task ID, result) of each pulled task served by the memo cache
+        self.memo_hits = []
+        # Memo cache key of each task that is queued or running
+        self._memo_keys = dict()
+        # Assignments sent to each worker in order, keyed by the first task ID
+        self.assigned = {w: OrderedDict() for w in self.all_workers}
+        # Workers with a revoke request in flight mapped to the revoked chunk
+        self._revoking = dict()
+        # Outstanding copies of each speculatively duplicated task
+        self._copies = dict()
+        # Duplicated tasks whose first result has already been accepted
+        self._accepted_copies = set()
+        # Workers that stopped responding and no longer receive tasks
+        self.failed_workers = set()
+        # Number of times each failed task has been retried
+        self._retries = dict()
+        # Failed tasks waiting for a worker they have not failed on
+        self._retry_queue = deque()
+        # Workers each failed task already failed on
+        self._failed_on = dict()
+        # Tasks of chunks that exceeded their deadline, which are retried alone
+        self._timed_out = set()
+        self._last_heartbeat = {w: time.time() for w in self.all_workers}
+        intervals = [s for s in (task_timeout, heartbeat_seconds) if s is not None]
+        # Seconds between checks of the deadlines and heartbeats
+        self.fault_check_seconds = (min(intervals) / Controller.FAULT_CHECKS_PER_INTERVAL
+                                    if intervals else None)
+        self._next_fault_check = 0.
+        # Cache key of each queued or running task that has one
+        self._task_keys = dict()
+        # Cache keys each worker (likely) holds in least recently used order
+        self._worker_keys = {w: OrderedDict() for w in self.all_workers}
+        # True once any task has a cache key
+        self._affinity = False
+        # (worker, requests) of the sends to the workers that have not completed
+        # yet
+        self._pending_sends = deque()
+        # Requests of the sends to failed workers, which may never complete.
+        # Kept so that their buffers stay alive until the controller exits.
+        self._abandoned_sends = []
 
     def have_available_workers_p(self):
         """
-        Checks whether any worker processes are idle.
+        Checks whether any worker processes have a free prefetch slot.
 
-        :return: True if at least one worker is available.
+        :return: True if at least one worker can accept another chunk.
         :rtype: bool
         """
-        return len(self.available_workers) > 0
+        return len(self._workers_by_load[self.prefetch_depth]) < self.n_workers
 
     def add_available_worker(self, w):
         """
-        Adds a worker to management by the master.
+        Returns a credit to a worker after it sends back the results of a chunk.
 
-        :param w: ID of the worker to add
+        :param w: ID of the worker that reported back
         :type w: int
         """
-        assert w not in self.available_workers
-        self.available_workers.add(w)
+        assert self.outstanding[w] > 0
+        self._move_worker(w, -1)
 
     def terminate_everything(self):
         """
         All tasks are completed so the master kills all workers then exits
         completely.
         """
-        self.terminate_workers(self.all_workers)
+        self.terminate_workers([w for w in self.all_workers
+                                if w not in self.failed_workers])
         txt = "CONTROLLER: Finished Successfully. Waiting" + \
               " on any unfinished workers..."
         logging.info(txt)
@@ -56,22 +286,773 @@ class Controller(object):
         """
         message = ControllerToWorkerMessage.exit_message()
         for w in workers_l:
-            self.comm.isend(message, dest=w)
+            self._send(message, w)
+        while self._pending_sends:
+            Transport.wait_all(self._pending_sends.popleft()[1])
 
-    def get_available_worker(self):
+    def get_available_worker(self, avoid=(), key=None, idle=False):
         """
-        Accesses an available worker.
+        Accesses the least loaded worker with a free prefetch slot and charges
+        it one credit.
+
+        :param avoid: Workers to skip unless no other worker has a free slot.
+        :type avoid: set
+
+        :param key: If not None, a worker that holds this cache key is preferred.
+
+        :param idle: If True, only a worker without outstanding chunks that is
+                     not in \\p avoid qualifies, and \\p key is ignored.
+        :type idle: bool
 
         :return: Index of the next worker that will perform a specified task.
         """
-        # available_workers MUST BE NOT EMPTY
+        # At least one worker MUST HAVE A FREE SLOT
         assert self.have_available_workers_p()
 
-        return self.available_workers.pop()
+        w = None
+        if idle:
+            w = self._free_worker(avoid, max_load=1)
+            assert w is not None
+        elif key is not None:
+            w = self._free_worker(avoid, key)
+        if w is None:
+            w = self._free_worker(avoid)
+        if w is None:
+            w = self._free_worker()
+        self._move_worker(w, 1)
+        return w
+
+    def _free_worker(self, avoid=(), key=None, max_load=None):
+        """
+        :param avoid: Workers to skip.
+        :type avoid: set
+
+        :param key: If not None, only workers that hold this cache key qualify.
+
+        :param max_load: If not None, only workers with fewer outstanding chunks
+                         qualify.
+        :type max_load: int
+
+        :return: Least loaded worker with a free prefetch slot that is not in
+                 \\p avoid, or None if there is none.
+        :rtype: int
+        """
+        if max_load is None:
+            max_load = self.prefetch_depth
+        for workers in self._workers_by_load[:max_load]:
+            for w in workers:
+                if w not in avoid and (key is None or key in self._worker_keys[w]):
+                    return w
+        return None
+
+    def _move_worker(self, w, delta):
+        """
+        Changes the number of outstanding chunks on a worker.
+
+        :param w: ID of the worker
+        :type w: int
+
+        :param delta: Change in the number of outstanding chunks
+        :type delta: int
+        """
+        self._workers_by_load[self.outstanding[w]].remove(w)
+        self.outstanding[w] += delta
+        self._workers_by_load[self.outstanding[w]].add(w)
+        if self.telemetry is not None:
+            self.telemetry.record_busy_workers(
+                self.n_workers - len(self._workers_by_load[0]))
+
+    def assign_task_ids(self, n_tasks):
+        """
+        Reserves consecutive IDs for new tasks.
+
+        :param n_tasks: Number of tasks that need IDs.
+        :type n_tasks: int
+
+        :return: ID of each task.
+        :rtype: List[int]
+        """
+        task_ids = list(range(self._next_task_id, self._next_task_id + n_tasks))
+        self._next_task_id += n_tasks
+        return task_ids
+
+    def add_tasks(self, task_ids, tasks, costs=None, front=False):
+        """
+        Queues tasks to be dispatched.
+
+        :param task_ids: ID of each task.
+        :type task_ids: List[int]
+
+        :param tasks: Tasks to queue.
+        :type tasks: List
+
+        :param costs: Relative cost of each task.  Defaults to one per task.
+        :type costs: List[float]
+
+        :param front: If True, the tasks are dispatched before any others.
+        :type front: bool
+        """
+        if costs is None:
+            costs = [1.] * len(tasks)
+        entries = list(zip(task_ids, tasks, costs))
+        if front:
+            self.pending.extendleft(reversed(entries))
+        else:
+            self.pending.extend(entries)
+        self._pending_cost += sum(costs)
+
+    def pull_tasks(self, solver):
+        """
+        Pulls tasks from the task generator until enough are queued to build the
+        next chunk.
+
+        :param solver: Task object whose generator is consumed.
+        :type solver: AbstractTask
+        """
+        if self.scheduler == Controller.GUIDED:
+            lookahead = (Controller.GUIDED_LOOKAHEAD * self.n_workers
+                         * self.chunk_size * self.prefetch_depth)
+        else:
+            lookahead = self.next_chunk_size()
+        if self._affinity:
+            lookahead = max(lookahead, Controller.AFFINITY_LOOKAHEAD
+                            * self.n_workers * self.chunk_size)
+        while (not self.generator_exhausted and len(self.pending) < lookahead
+               and len(self.memo_hits) < lookahead):
+            try:
+                task = solver.get_next()
+            except StopIteration:
+                # Generator fully consumed
+                self.generator_exhausted = True
+                break
+            task_id = self.assign_task_ids(1)[0]
+            if task_id in self.completed_task_ids:
+                self.completed_task_ids.remove(task_id)
+                continue
+            if self.memo is not None:
+                memo_key = self.memo.key(task)
+                hit, result = self.memo.load(memo_key)
+                if hit:
+                    self.memo_hits.append((task_id, result))
+                    continue
+                self._memo_keys[task_id] = memo_key
+            key = solver.cache_key(task)
+            if key is not None:
+                self._task_keys[task_id] = key
+                if not self._affinity:
+                    self._affinity = True
+                    lookahead = max(lookahead, Controller.AFFINITY_LOOKAHEAD
+                                    * self.n_workers * self.chunk_size)
+            cost = solver.task_cost(task)
+            self.add_tasks([task_id], [task], [cost if cost is not None else 1.])
+            self.n_unfinished_tasks += 1
+
+    def pop_memo_hits(self):
+        """
+        :return: (task ID, result) of each task served by the memo cache since
+                 the last call.
+        :rtype: List[Tuple(int, object)]
+        """
+        hits, self.memo_hits = self.memo_hits, []
+        return hits
+
+    def pop_memo_key(self, task_id):
+        """
+        :param task_id: ID of a task whose result was accepted or given up.
+        :type task_id: int
+
+        :return: Memo cache key of the task or None if it has none.
+        :rtype: str
+        """
+        return self._memo_keys.pop(task_id, None)
+
+    def all_tasks_dispatched(self):
+        """
+        :return: True if the task generator is exhausted and no task is queued.
+        :rtype: bool
+        """
+        return self.generator_exhausted and not self.pending and not self._retry_queue
+
+    def next_chunk(self):
+        """
+        Removes the next chunk of tasks from the queue per the scheduler.
+
+        :return: (task ID, task, cost) of each task in the chunk.
+        :rtype: List[Tuple(int, object, float)]
+        """
+        # Failed tasks are retried alone on a worker they have not failed on
+        for entry in self._retry_queue:
+            if self._free_worker(self._retry_avoid(entry[0])) is not None:
+                self._retry_queue.remove(entry)
+                return [entry]
+        if not self.pending:
+            return []
+        if self.scheduler == Controller.GUIDED and self.generator_exhausted:
+            target_cost = self._pending_cost / (Controller.GUIDED_FACTOR
+                                                * self.n_workers)
+            max_tasks = self.max_chunk_size
+        else:
+            target_cost = None
+            max_tasks = self.next_chunk_size()
+            if (self.target_chunk_seconds is not None
+                    and self._avg_seconds_per_cost):
+                target_cost = self.target_chunk_seconds / self._avg_seconds_per_cost
+                max_tasks = self.max_chunk_size
+        if self._affinity:
+            return self._next_affine_chunk(max_tasks, target_cost)
+
+        chunk = []
+        chunk_cost = 0.
+        while self.pending and len(chunk) < max_tasks:
+            if target_cost is not None and chunk and chunk_cost >= target_cost:
+                break
+            entry = self.pending.popleft()
+            chunk.append(entry)
+            chunk_cost += entry[2]
+        self._pending_cost -= chunk_cost
+        return chunk
+
+    def _next_affine_chunk(self, max_tasks, target_cost):
+        """
+        Builds a chunk of tasks that share a cache key.  The key is, in order of
+        preference, one held by a worker with a free slot, one held by no worker,
+        or that of the oldest queued task.
+
+        :param max_tasks: Maximum number of tasks in the chunk.
+        :type max_tasks: int
+
+        :param target_cost: If not None, the chunk stops growing once its cost
+                            reaches this value.
+        :type target_cost: float
+
+        :return: (task ID, task, cost) of each task in the chunk.
+        :rtype: List[Tuple(int, object, float)]
+        """
+        free_keys = set()
+        held_keys = set()
+        for w in self.all_workers:
+            if w in self.failed_workers:
+                continue
+            held_keys.update(self._worker_keys[w])
+            if self.outstanding[w] < self.prefetch_depth:
+                free_keys.update(self._worker_keys[w])
+        keys = [self._task_keys.get(entry[0]) for entry in self.pending]
+        seed = next((i for i, key in enumerate(keys) if key in free_keys), None)
+        if seed is None:
+            seed = next((i for i, key in enumerate(keys) if key not in held_keys), 0)
+
+        chunk = []
+        chunk_cost = 0.
+        rest = deque()
+        for i, entry in enumerate(self.pending):
+            full = (len(chunk) >= max_tasks or (target_cost is not None and chunk
+                                                and chunk_cost >= target_cost))
+            if i >= seed and not full and keys[i] == keys[seed]:
+                chunk.append(entry)
+                chunk_cost += entry[2]
+            else:
+                rest.append(entry)
+        self.pending = rest
+        self._pending_cost -= chunk_cost
+        return chunk
+
+    def dispatch(self, chunk, speculative=False):
+        """
+        Sends a chunk to the least loaded worker with a free prefetch slot.  A
+        speculative copy only goes to an idle worker that does not already run
+        the chunk, whichever workers hold its cache key.
+
+        :param chunk: Chunk built by next_chunk().
+        :type chunk: List[Tuple(int, object, float)]
+
+        :param speculative: True if the chunk duplicates a straggler.
+        :type speculative: bool
+
+        :return: Worker the chunk was sent to.
+        :rtype: int
+        """
+        first_id = chunk[0][0]
+        if speculative:
+            avoid = set(w for w, assignments in self.assigned.items()
+                        if first_id in assignments)
+        else:
+            avoid = self._retry_avoid(first_id) if len(chunk) == 1 else ()
+        key = self._task_keys.get(first_id)
+        worker = self.get_available_worker(avoid, key, idle=speculative)
+        # A worker runs at most one copy of a chunk
+        assert first_id not in self.assigned[worker]
+        if key is not None:
+            self._record_key(worker, key)
+        assignment = _Assignment(chunk, speculative)
+        if not self.assigned[worker]:
+            assignment.started_at = time.time()
+        self.assigned[worker][first_id] = assignment
+        task_ids = [task_id for task_id, _, _ in chunk]
+        tasks = [task for _, task, _ in chunk]
+        self.task_log.log("CONTROLLER: Packing %d task(s) \"%s\" for worker %d",
+                          len(tasks), tasks, worker)
+        message = ControllerToWorkerMessage.build(False, tasks, task_ids)
+        sent_at = time.time()
+        self._send(message, worker)
+        if self.telemetry is not None:
+            self.telemetry.record_dispatch(worker, task_ids, sent_at, time.time())
+        return worker
+
+    def _send(self, message, w):
+        """
+        Sends a message to a worker without waiting for the worker to receive
+        it.  A busy worker only receives a prefetched chunk after its current
+        chunk, and it may itself be blocked sending the results of that chunk
+        to the controller, so a blocking send of a large message would deadlock.
+        The requests are kept until the send completes.
+
+        :param message: Message built by ControllerToWorkerMessage.
+        :type message: dict
+
+        :param w: ID of the worker.
+        :type w: int
+        """
+        self._pending_sends.append((w, self.transport.isend(message, dest=w)))
+        while self._pending_sends and Transport.test_all(self._pending_sends[0][1]):
+            self._pending_sends.popleft()
+
+    def _record_key(self, w, key):
+        """
+        Notes that a worker loads or uses a cache key.  Mirrors the least
+        recently used eviction of the worker's cache.
+
+        :param w: ID of the worker.
+        :type w: int
+
+        :param key: Cache key of the tasks sent to the worker.
+        """
+        keys = self._worker_keys[w]
+        keys[key] = None
+        keys.move_to_end(key)
+        while len(keys) > self.cache_entries:
+            keys.popitem(last=False)
+
+    def complete_chunk(self, w, task_ids, elapsed, revoked_task_ids=None,
+                       failed_task_ids=None):
+        """
+        Records a chunk returned by a worker and returns the worker's credit.
+        Tasks the worker gave up because they were revoked are queued again, as
+        are failed tasks that have retries left.
+
+        :param w: ID of the worker that reported back
+        :type w: int
+
+        :param task_ids: IDs of the executed tasks.
+        :type task_ids: List[int]
+
+        :param elapsed: Seconds the worker spent executing the chunk.
+        :type elapsed: float
+
+        :param revoked_task_ids: IDs of the chunk's tasks that were not executed.
+        :type revoked_task_ids: List[int]
+
+        :param failed_task_ids: IDs of the executed tasks whose result is a
+                                TaskError.
+        :type failed_task_ids: List[int]
+
+        :return: For each executed task, True if its result (or its TaskError once
+                 the retries are exhausted) should be processed and False if it is
+                 a late duplicate or was queued again.
+        :rtype: List[bool]
+        """
+        if w in self.failed_workers:
+            logging.warning("CONTROLLER: Discarding late results of failed "
+                            "worker %d" % w)
+            return [False] * len(task_ids)
+        self._last_heartbeat[w] = time.time()
+        self.add_available_worker(w)
+        first_id = task_ids[0] if task_ids else revoked_task_ids[0]
+        assignment = self.assigned[w].pop(first_id)
+        if self._revoking.get(w) == first_id:
+            del self._revoking[w]
+        # The next queued chunk on the worker starts now
+        if self.assigned[w]:
+            head = next(iter(self.assigned[w].values()))
+            if head.started_at is None:
+                head.started_at = time.time()
+
+        chunk = assignment.chunk
+        if revoked_task_ids:
+            logging.info("CONTROLLER: Worker %d returned %d queued task(s) for "
+                         "other workers" % (w, len(revoked_task_ids)))
+            self.add_tasks([e[0] for e in chunk], [e[1] for e in chunk],
+                           [e[2] for e in chunk], front=True)
+            return []
+        self.record_chunk_time(assignment.cost(), elapsed, w)
+
+        failed = set(failed_task_ids) if failed_task_ids else ()
+        entries = {e[0]: e for e in chunk}
+        accepted = []
+        for task_id in task_ids:
+            if task_id in failed:
+                accepted.append(self._retry_task(entries[task_id], w))
+            else:
+                accepted.append(self._accept_result(task_id))
+                if accepted[-1]:
+                    self.n_unfinished_tasks -= 1
+                    self._retries.pop(task_id, None)
+                    self._failed_on.pop(task_id, None)
+                    self._timed_out.discard(task_id)
+                    self._task_keys.pop(task_id, None)
+        return accepted
+
+    def _retry_task(self, entry, w, retry=True):
+        """
+        Queues a failed task again unless another copy of it is still running or
+        its retries are exhausted.
+
+        :param entry: (task ID, task, cost) of the failed task.
+        :type entry: Tuple(int, object, float)
+
+        :param w: ID of the worker the task failed on.
+        :type w: int
+
+        :param retry: If False, the task is given up even if retries are left.
+        :type retry: bool
+
+        :return: True if the task was given up.
+        :rtype: bool
+        """
+        task_id = entry[0]
+        if self._release_copy(task_id):
+            return False
+        n_retries = self._retries.get(task_id, 0)
+        if not retry or n_retries >= self.max_retries:
+            logging.error("CONTROLLER: Giving up on task %d after %d attempt(s)"
+                          % (task_id, n_retries + 1))
+            self._retries.pop(task_id, None)
+            self._failed_on.pop(task_id, None)
+            self._timed_out.discard(task_id)
+            self._task_keys.pop(task_id, None)
+            self._memo_keys.pop(task_id, None)
+            self.n_unfinished_tasks -= 1
+            return True
+        self._retries[task_id] = n_retries + 1
+        self._failed_on.setdefault(task_id, set()).add(w)
+        self._retry_queue.append(entry)
+        return False
+
+    def _retry_avoid(self, task_id):
+        """
+        :param task_id: ID of a task.
+        :type task_id: int
+
+        :return: Workers the task should not be retried on.  Empty if the task
+                 already failed on every remaining worker.
+        :rtype: set
+        """
+        avoid = self._failed_on.get(task_id, ())
+        if len(avoid) >= self.n_workers and all(
+                w in avoid for w in self.all_workers if w not in self.failed_workers):
+            return ()
+        return avoid
+
+    def attempts(self, task_id):
+        """
+        :param task_id: ID of a task.
+        :type task_id: int
+
+        :return: Number of times the task has been executed so far.
+        :rtype: int
+        """
+        return self._retries.get(task_id, 0) + 1
+
+    def _release_copy(self, task_id):
+        """
+        Forgets one copy of a task that failed.
+
+        :param task_id: ID of the failed task.
+        :type task_id: int
+
+        :return: True if another copy of the task is still running or already
+                 succeeded.
+        :rtype: bool
+        """
+        if task_id not in self._copies:
+            return False
+        other_copy = (self._copies[task_id] > 1
+                      or task_id in self._accepted_copies)
+        self._copies[task_id] -= 1
+        if self._copies[task_id] == 0:
+            del self._copies[task_id]
+            self._accepted_copies.discard(task_id)
+        return other_copy
+
+    def check_workers(self):
+        """
+        Declares failed every worker whose running chunk is past its deadline
+        or that missed its heartbeats.  The tasks of a failed worker are queued
+        again on the remaining workers.  Calls within fault_check_seconds of the
+        last check return at once.
+
+        :return: (worker, error) of each task whose retries are exhausted.
+        :rtype: List[Tuple(int, TaskError)]
+        """
+        now = time.time()
+        if now < self._next_fault_check:
+            return []
+        self._next_fault_check = now + self.fault_check_seconds
+        for w in self.transport.recv_heartbeats():
+            self._last_heartbeat[w] = now
+
+        given_up = []
+        for w in self.all_workers:
+            if w in self.failed_workers:
+                continue
+            reason = None
+            timed_out = False
+            silence = now - self._last_heartbeat[w]
+            if (self.heartbeat_seconds is not None
+                    and silence > Controller.HEARTBEAT_MISSES * self.heartbeat_seconds):
+                reason = "No heartbeat for %.1f seconds" % silence
+            elif self.task_timeout is not None and self.assigned[w]:
+                head = next(iter(self.assigned[w].values()))
+                if (head.started_at is not None and now - head.started_at
+                        > self.task_timeout * len(head.chunk)):
+                    reason = ("Chunk of %d task(s) exceeded its deadline of %.1f "
+                              "seconds" % (len(head.chunk),
+                                           self.task_timeout * len(head.chunk)))
+                    timed_out = True
+            if reason is not None:
+                given_up.extend(self.fail_worker(w, reason, timed_out))
+        return given_up
+
+    def fail_worker(self, w, reason, timed_out=False):
+        """
+        Stops sending tasks to a worker and queues its tasks again.  If no
+        worker is left, the job is aborted since the other ranks would otherwise
+        wait forever.
+
+        A task that exceeded its deadline is likely to hang on any worker, and
+        each worker it hangs on is lost for the rest of the job.  So a task that
+        exceeded its deadline on its own is given up at once instead of being
+        retried.  The tasks of a larger chunk that exceeded its deadline are
+        retried alone, and given up if they exceed it again.
+
+        :param w: ID of the failed worker.
+        :type w: int
+
+        :param reason: Why the worker is considered failed.
+        :type reason: str
+
+        :param timed_out: True if the running chunk of the worker exceeded its
+                          deadline, i.e., the chunk rather than the worker may be
+                          at fault.
+        :type timed_out: bool
+
+        :return: (worker, error) of each task whose retries are exhausted.
+        :rtype: List[Tuple(int, TaskError)]
+        """
+        logging.error("CONTROLLER: Worker %d failed (%s). Requeuing its tasks..."
+                      % (w, reason))
+        self.failed_workers.add(w)
+        self._workers_by_load[self.outstanding[w]].remove(w)
+        self.outstanding[w] = 0
+        self.n_workers -= 1
+        self._revoking.pop(w, None)
+        # The failed worker may never receive the messages still being sent to
+        # it, so waiting on them would hang the controller
+        self._abandoned_sends.extend(requests for dest, requests in self._pending_sends
+                                     if dest == w)
+        self._pending_sends = deque((dest, requests)
+                                    for dest, requests in self._pending_sends
+                                    if dest != w)
+        if self.n_workers == 0:
+            logging.error("CONTROLLER: Every worker failed. Aborting...")
+            self.comm.Abort(1)
+
+        given_up = []
+        assignments = self.assigned[w]
+        self.assigned[w] = OrderedDict()
+        for i, assignment in enumerate(assignments.values()):
+            # Only the first chunk was running when the deadline passed
+            hung = timed_out and i == 0
+            for entry in assignment.chunk:
+                attempts = self.attempts(entry[0])
+                retry = True
+                if hung:
+                    retry = len(assignment.chunk) > 1 and entry[0] not in self._timed_out
+                    self._timed_out.add(entry[0])
+                if self._retry_task(entry, w, retry):
+                    error = TaskError(entry[1], TaskError.WORKER_FAILURE, reason,
+                                      worker_rank=w)
+                    error.attempts = attempts
+                    given_up.append((w, error))
+        return given_up
+
+    def fault_poll_seconds(self, waited_seconds):
+        """
+        :param waited_seconds: Seconds since the controller started waiting for
+                               a worker to report back.
+        :type waited_seconds: float
+
+        :return: Seconds to sleep before the next check for results.
+        :rtype: float
+        """
+        return min(max(Controller.FAULT_POLL_SECONDS,
+                       waited_seconds / Controller.FAULT_POLL_BACKOFF),
+                   Controller.MAX_FAULT_POLL_SECONDS, self.fault_check_seconds)
+
+    def fault_detection_p(self):
+        """
+        :return: True if task deadlines or heartbeats are checked.
+        :rtype: bool
+        """
+        return self.task_timeout is not None or self.heartbeat_seconds is not None
+
+    def _accept_result(self, task_id):
+        """
+        :param task_id: ID of a task whose result was received.
+        :type task_id: int
+
+        :return: True if this is the first result received for the task.
+        :rtype: bool
+        """
+        if task_id not in self._copies:
+            return True
+        accept = task_id not in self._accepted_copies
+        self._accepted_copies.add(task_id)
+        self._copies[task_id] -= 1
+        if self._copies[task_id] == 0:
+            del self._copies[task_id]
+            self._accepted_copies.discard(task_id)
+        return accept
+
+    def speculate_stragglers(self):
+        """
+        Once no new tasks remain, duplicates the longest running chunks onto idle
+        workers.  Only chunks that have run much longer than expected are
+        duplicated, and each at most once.
+
+        :return: True if an idle worker is waiting on a running chunk that may
+                 still become a straggler, i.e., the caller should call this
+                 again before blocking on the next result.
+        :rtype: bool
+        """
+        if (not self.speculate or not self.all_tasks_dispatched()
+                or self._avg_seconds_per_cost is None):
+            return False
+        now = time.time()
+        candidates = []
+        n_waiting = 0
+        for w, assignments in self.assigned.items():
+            if not assignments:
+                continue
+            head = next(iter(assignments.values()))
+            if head.duplicated or head.speculative or head.started_at is None:
+                continue
+            expected = head.cost() * self._avg_seconds_per_cost
+            if now - head.started_at > Controller.SPECULATION_SLOWDOWN * expected:
+                candidates.append((head.started_at, w, head))
+            else:
+                n_waiting += 1
+        candidates.sort(key=lambda c: c[0])
+
+        for _, w, head in candidates:
+            if not self._workers_by_load[0]:
+                return False
+            head.duplicated = True
+            for task_id, _, _ in head.chunk:
+                self._copies[task_id] = self._copies.get(task_id, 1) + 1
+            worker = self.dispatch(head.chunk, speculative=True)
+            logging.info("CONTROLLER: Duplicated %d straggler task(s) of worker "
+                         "%d onto worker %d" % (len(head.chunk), w, worker))
+        return n_waiting > 0 and bool(self._workers_by_load[0])
+
+    def steal_queued_work(self):
+        """
+        Once no new tasks remain, asks the busy worker with the largest estimated
+        backlog to give up its newest queued (i.e., unstarted) chunk for each
+        idle worker.  The worker returns the tasks of the chunk if it has not
+        started it yet.
+        """
+        if not self.steal_work or not self.all_tasks_dispatched():
+            return
+        n_idle = len(self._workers_by_load[0])
+        while n_idle > 0:
+            victim = self._select_steal_victim()
+            if victim is None:
+                return
+            first_id = next(reversed(self.assigned[victim]))
+            self._revoking[victim] = first_id
+            chunk_ids = [e[0] for e in self.assigned[victim][first_id].chunk]
+            message = ControllerToWorkerMessage.build(False, [], chunk_ids,
+                                                      revoke=True)
+            self._send(message, victim)
+            n_idle -= 1
+
+    def _select_steal_victim(self):
+        """
+        :return: Worker with at least one queued chunk and the largest estimated
+                 backlog, or None if no worker has a queued chunk.
+        :rtype: int
+        """
+        victim, victim_backlog = None, 0.
+        for w, assignments in self.assigned.items():
+            # The oldest chunk is already running and cannot be revoked
+            if len(assignments) < 2 or w in self._revoking:
+                continue
+            queued_cost = sum(a.cost() for a in list(assignments.values())[1:])
+            speed = self._worker_seconds_per_cost.get(w, self._avg_seconds_per_cost)
+            backlog = queued_cost * (speed if speed else 1.)
+            if backlog > victim_backlog:
+                victim, victim_backlog = w, backlog
+        return victim
+
+    def next_chunk_size(self):
+        """
+        :return: Number of tasks to pack into the next message to a worker.
+        :rtype: int
+        """
+        return self.chunk_size
+
+    def record_chunk_time(self, cost, elapsed, w=None):
+        """
+        Updates the estimated time per unit of task cost with a chunk a worker
+        completed.  If chunking is adaptive, the chunk size is resized to the
+        target duration.
+
+        :param cost: Total cost of the tasks in the chunk.  Without cost hints,
+                     this is the number of tasks.
+        :type cost: float
+
+        :param elapsed: Seconds the worker spent executing the chunk.
+        :type elapsed: float
+
+        :param w: ID of the worker that executed the chunk, if known.
+        :type w: int
+        """
+        if cost <= 0:
+            return
+        seconds_per_cost = elapsed / cost
+        alpha = Controller.TASK_TIME_SMOOTHING
+        if self._avg_seconds_per_cost is None:
+            self._avg_seconds_per_cost = seconds_per_cost
+        else:
+            self._avg_seconds_per_cost = (alpha * seconds_per_cost
+                                          + (1 - alpha) * self._avg_seconds_per_cost)
+        if w is not None:
+            prev = self._worker_seconds_per_cost.get(w, seconds_per_cost)
+            self._worker_seconds_per_cost[w] = (alpha * seconds_per_cost
+                                                + (1 - alpha) * prev)
+
+        if self.target_chunk_seconds is None:
+            return
+        if self._avg_seconds_per_cost <= 0:
+            self.chunk_size = self.max_chunk_size
+        else:
+            size = int(self.target_chunk_seconds / self._avg_seconds_per_cost)
+            self.chunk_size = max(1, min(size, self.max_chunk_size))
 
     def all_workers_completed(self):
         """
-        :return: True if all workers are done processing (i.e., are available)
+        :return: True if all workers are done processing (i.e., have no
+                 outstanding chunks)
         :rtype: bool
         """
-        return len(self.available_workers) == self.n_workers
+        return len(self._workers_by_load[0]) == self.n_workers
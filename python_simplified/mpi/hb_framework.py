@@ -1,10 +1,22 @@
+import atexit
+import functools
 import logging
-import time
+import os
+import pickle
+import queue
 import sys
-from mpi4py import MPI
+import time
+from logging.handlers import QueueHandler, QueueListener
 
+import mpi
 from mpi.controller import Controller
-from mpi.message import ControllerToWorkerMessage
+from mpi.result_processor import ResultProcessor
+from mpi.sampled_log import SampledLog
+from mpi.message import TaskError, WorkerToControllerMessage
+from mpi.transport import Transport
+
+# mpi4py is imported on the MPI path only so that the local backend (see
+# mpi.local_backend) runs without it
 
 
 class HummingbirdFramework(object):
@@ -20,25 +32,291 @@ class HummingbirdFramework(object):
     Logging level when printing messages.
     """
     log_level = logging.DEBUG
+    """
+    If True, every rank writes its own log file whose name is "log_file" with
+    the rank inserted before the extension (e.g., "hb_framework.3.log") instead
+    of all ranks appending to one (possibly shared filesystem) file.
+    """
+    log_per_rank = False
+    """
+    If True, log records are queued and written by a background thread so the
+    controller and workers never block on file I/O.
+    """
+    log_async = False
+    """
+    Only one of every this many per-task messages (the controller's dispatches
+    and the workers' chunk executions) is logged.
+    """
+    log_task_every = 1
+    """
+    If not None, maximum number of per-task messages each rank logs per second.
+    """
+    log_task_max_per_second = None
+    """
+    Number of tasks packed into each message sent to a worker.  Larger chunks
+    amortize the per-message overhead over many small tasks.  When
+    "target_chunk_seconds" is set, this is only the initial chunk size.
+    """
+    chunk_size = 1
+    """
+    If not None, the chunk size adapts to the measured task duration so that a
+    worker spends about this many seconds on each chunk.
+    """
+    target_chunk_seconds = None
+    """
+    Upper bound on the chunk size when chunking is adaptive.
+    """
+    max_chunk_size = 1024
+    """
+    Maximum number of chunks queued on each worker.  With a depth above one, the
+    worker's next chunk is already waiting when it finishes the current one so
+    it does not idle for a controller round-trip.
+    """
+    prefetch_depth = 1
+    """
+    Maximum number of result messages a worker may have in flight using
+    non-blocking sends.  Zero makes workers block on each send.  This overlaps
+    returning large results with computing the next (prefetched) chunk.
+    """
+    send_window = 0
+    """
+    If not None, tasks and results are pickled with protocol 5 and any contiguous
+    buffer (e.g., a NumPy array) of at least this many bytes is sent with MPI's
+    buffer-based Send/Recv instead of being copied into the pickle stream.
+    """
+    zero_copy_threshold = None
+    """
+    Codec (see mpi.codec) that serializes every message, e.g.,
+    CompressedCodec(BinaryCodec()).  None uses mpi4py's built-in pickling.
+    """
+    codec = None
+    """
+    Enables the hierarchical mode when not None.  Ranks other than the master
+    are split into groups of this many ranks (or one group per node if set to
+    GROUP_BY_NODE).  The lowest rank in each group is a sub-controller that takes
+    blocks of tasks from the master and hands them to the rest of its group.
+    """
+    group_size = None
+    """
+    Number of tasks the master sends a sub-controller in each block.  If None,
+    the block fills every worker of the largest group "prefetch_depth" times.
+    """
+    group_block_size = None
+    """
+    Chunk scheduler of the controller.  Controller.GUIDED makes chunks shrink
+    toward the end of the task generator (guided self-scheduling) based on
+    AbstractTask.task_cost() hints or the observed task durations.
+    """
+    scheduler = Controller.STATIC
+    """
+    If True, once no new tasks remain, chunks queued (but not started) on busy
+    workers are moved to idle workers.  Only useful with prefetch_depth above
+    one.  Not supported in the hierarchical mode.
+    """
+    steal_work = False
+    """
+    If True, once no new tasks remain, idle workers speculatively rerun chunks
+    that are running much longer than expected and the first result of each task
+    is kept.  Tasks must be safe to execute more than once.  Not supported in the
+    hierarchical mode.
+    """
+    speculate = False
+    """
+    If not None, the controller appends each processed result to this journal
+    file.  When a killed job is restarted with the same file, the journaled
+    results are replayed into process_results() and those tasks are skipped.
+    The task generator must yield the same tasks in the same order on every run.
+    Delete the file to start from scratch.
+    """
+    journal_file = None
+    """
+    Maximum number of results written to the journal between syncs to disk.
+    """
+    journal_sync_records = 256
+    """
+    Maximum number of seconds between syncs of the journal to disk.
+    """
+    journal_sync_seconds = 1.
+    """
+    If not None, a worker whose running chunk takes more than this many seconds
+    per task (e.g., it hangs inside execute_task()) is declared failed and its
+    tasks are queued on the other workers.  A task that exceeds the deadline on
+    its own is not retried but passed to process_error(), so that it does not
+    hang every other worker too.  Not supported in the hierarchical mode.
+    """
+    task_timeout = None
+    """
+    If not None, workers send a heartbeat from a background thread at this
+    interval.  A worker that misses Controller.HEARTBEAT_MISSES heartbeats is
+    declared failed.  Not supported in the hierarchical mode.
+    """
+    heartbeat_seconds = None
+    """
+    Number of times a task that raised an exception or whose worker failed is
+    executed again before its TaskError is passed to process_error().
+    """
+    max_retries = 2
+    """
+    If not None, a callable that is run once on the controller and returns a
+    ResultSink, e.g., functools.partial(JsonlSink, "results").  Each result is
+    written to the sink in the background after process_results() so results
+    need not be kept in memory.  With a journal, replayed results are written
+    again so create the sink with overwrite=True.
+    """
+    result_sink = None
+    """
+    Where process_results() runs.  ResultProcessor.INLINE runs it on the
+    controller's thread, which stops dispatching while it runs.
+    ResultProcessor.ORDERED runs it on a background thread in the same order
+    and ResultProcessor.UNORDERED on a pool of process_results_threads threads.
+    """
+    process_results_mode = ResultProcessor.INLINE
+    """
+    Number of threads that run process_results() in the unordered mode.
+    """
+    process_results_threads = 4
+    """
+    Maximum number of values in each worker's cache (see AbstractWorker.cached()).
+    """
+    worker_cache_entries = 4
+    """
+    If not None, maximum total size in bytes of the values in each worker's
+    cache.
+    """
+    worker_cache_bytes = None
+    """
+    If not None, directory of an on-disk store of task results shared across
+    runs and jobs.  A task whose result is stored is not executed and its
+    result is passed to process_results() with the controller's rank as the
+    worker ID.
+    """
+    memo_dir = None
+    """
+    Version of the code that computes the results.  Change it to invalidate the
+    stored results.
+    """
+    memo_code_version = ""
+    """
+    If not None, the least recently used stored results are evicted at the end
+    of a run until the store is no larger than this many bytes.
+    """
+    memo_max_bytes = None
+    """
+    If not None, stored results not used for this many seconds are evicted at
+    the end of a run.
+    """
+    memo_max_age_seconds = None
+    """
+    Number of chunks each worker executes at once on a pool of threads.  Meant
+    for tasks that spend their time in CommandLine.run() subprocesses so one
+    worker per node (e.g., "mpirun --map-by ppr:1:node") can keep every core
+    busy.  execute_task() must be thread-safe.  Each worker is sent this many
+    chunks (plus prefetch_depth - 1 queued) at a time.
+    """
+    worker_concurrency = 1
+    """
+    If not None, the workers time every task and the controller writes the
+    timeline of the run to "<trace_prefix>.json" (a Chrome trace that
+    ui.perfetto.dev opens) and "<trace_prefix>.csv" and logs counters such as
+    the tasks per second, idle worker seconds and message bytes.  See
+    mpi/telemetry.py.
+    """
+    trace_prefix = None
+    """
+    If True, rank MASTER_RANK validates the settings and broadcasts them to
+    every other rank, which adopts them.  Only the master then needs to compute
+    the settings (e.g., read a configuration file) and an invalid setting stops
+    every rank with the same error.
+    """
+    broadcast_config = False
+    """
+    Number of worker processes of the local backend (see run()).  If None, one
+    fewer than the number of CPUs.
+    """
+    local_workers = None
 
     MASTER_RANK = 0
+    GROUP_BY_NODE = "node"
+
+    """
+    Environment variable that selects the backend of run() (MPI_BACKEND or
+    LOCAL_BACKEND).
+    """
+    BACKEND_ENV_VAR = mpi.BACKEND_ENV_VAR
+    MPI_BACKEND = "mpi"
+    LOCAL_BACKEND = mpi.LOCAL_BACKEND
+
+    """
+    Settings read by ranks other than MASTER_RANK (workers and
+    sub-controllers).  These are the settings broadcast_config copies.
+    Settings that only the master reads, such as result_sink, stay on the
+    master.
+    """
+    SHARED_SETTINGS = ("log_file", "log_level", "log_per_rank", "log_async",
+                       "log_task_every", "log_task_max_per_second",
+                       "chunk_size", "target_chunk_seconds", "max_chunk_size",
+                       "prefetch_depth", "send_window", "zero_copy_threshold",
+                       "codec", "group_size", "group_block_size", "scheduler",
+                       "steal_work", "speculate", "task_timeout",
+                       "heartbeat_seconds", "max_retries",
+                       "worker_cache_entries", "worker_cache_bytes",
+                       "worker_concurrency", "trace_prefix")
+
+    # Handlers added by _setup_logger() and the background writer (if any)
+    _log_handlers = []
+    _log_listener = None
 
     # noinspection PyPep8Naming
     @staticmethod
-    def run(TaskClass, WorkerClass):
+    def run(TaskClass, WorkerClass, backend=None):
         """
         Run by the user.  It manages all communication operations that must be
         done.  It only leaves for the user to define what tasks must be
         performed.
 
+        With the local backend, the script runs without mpirun and the workers
+        are processes of this machine (see mpi.local_backend.LocalBackend).
+
         :param TaskClass: Defines the task sent to the workers.
         :type TaskClass: class
 
         :param WorkerClass: Class that defines how the workers execute the
                             passed task.
         :type WorkerClass: class
+
+        :param backend: MPI_BACKEND or LOCAL_BACKEND.  If None, the HB_BACKEND
+                        environment variable selects it (MPI by default).
+        :type backend: str
         """
-        HummingbirdFramework._setup_logger()
+        if backend is None:
+            backend = os.environ.get(HummingbirdFramework.BACKEND_ENV_VAR,
+                                     HummingbirdFramework.MPI_BACKEND)
+        if backend == HummingbirdFramework.LOCAL_BACKEND:
+            # The optional subsystems are imported once their setting is checked
+            from mpi.local_backend import LocalBackend
+            HummingbirdFramework.validate_config(TaskClass)
+            HummingbirdFramework._setup_logger(HummingbirdFramework.MASTER_RANK)
+            if HummingbirdFramework.group_size is not None:
+                raise ValueError("The hierarchical mode requires the MPI backend")
+            LocalBackend.run(TaskClass, WorkerClass,
+                             HummingbirdFramework.local_workers)
+            return
+        if backend != HummingbirdFramework.MPI_BACKEND:
+            raise ValueError("Unknown backend \"%s\"" % backend)
+
+        from mpi4py import MPI
+
+        if HummingbirdFramework.broadcast_config:
+            HummingbirdFramework._broadcast_config(MPI.COMM_WORLD, TaskClass)
+        else:
+            HummingbirdFramework.validate_config(TaskClass)
+        HummingbirdFramework._setup_logger(MPI.COMM_WORLD.Get_rank())
+        shared_data = HummingbirdFramework._share_worker_data(WorkerClass)
+
+        if HummingbirdFramework.group_size is not None:
+            HummingbirdFramework._run_hierarchical(TaskClass, WorkerClass,
+                                                   shared_data)
+            return
 
         # Rank selects whether the task is a master or slave.
         rank = MPI.COMM_WORLD.Get_rank()
@@ -48,78 +326,533 @@ class HummingbirdFramework(object):
             logging.info("************* HUMMINGBIRD MPI HOST CREATED *************")
             HummingbirdFramework._run_controller(comm, TaskClass)
         else:
-            worker = WorkerClass(comm, rank)
-            worker.run()
+            HummingbirdFramework._run_worker(WorkerClass, comm, rank, shared_data,
+                                             TaskClass.reduce_op)
 
+    # noinspection PyPep8Naming
     @staticmethod
-    def _is_message_pending(comm):
+    def validate_config(TaskClass=None):
         """
-        Waits for a pending message to arrive.
+        Checks the framework's settings.  Called by run().
 
-        :param comm:
-        :return: Message from the finished worker.
-        :rtype: dict
+        :param TaskClass: If specified, the settings are also checked against
+                          the task class (e.g., its reduce_op).
+        :type TaskClass: class
+
+        :raises ValueError: If a setting is invalid.
+        """
+        framework = HummingbirdFramework
+        for name, minimum in (("chunk_size", 1), ("max_chunk_size", 1),
+                              ("prefetch_depth", 1), ("send_window", 0),
+                              ("max_retries", 0), ("worker_cache_entries", 1),
+                              ("worker_concurrency", 1), ("log_task_every", 1)):
+            if getattr(framework, name) < minimum:
+                raise ValueError("%s must be at least %d" % (name, minimum))
+        if framework.scheduler not in (Controller.STATIC, Controller.GUIDED):
+            raise ValueError("Unknown scheduler \"%s\"" % framework.scheduler)
+        if framework.process_results_mode not in (ResultProcessor.INLINE,
+                                                  ResultProcessor.ORDERED,
+                                                  ResultProcessor.UNORDERED):
+            raise ValueError("Unknown result processing mode \"%s\""
+                             % framework.process_results_mode)
+        if TaskClass is not None and TaskClass.reduce_op is not None:
+            # Individual results never reach the controller, and a task may
+            # only be combined once
+            for name in ("group_size", "speculate", "task_timeout",
+                         "heartbeat_seconds", "journal_file", "memo_dir",
+                         "result_sink"):
+                if getattr(framework, name) not in (None, False):
+                    raise ValueError("%s is not supported when the results are "
+                                     "reduced (see AbstractTask.reduce_op)" % name)
+        if framework.group_size is None:
+            return
+        if framework.steal_work:
+            raise ValueError("Work stealing is not supported in the hierarchical mode")
+        if framework.speculate:
+            raise ValueError("Speculative execution is not supported in the "
+                             "hierarchical mode")
+        if (framework.task_timeout is not None
+                or framework.heartbeat_seconds is not None):
+            raise ValueError("Task deadlines and heartbeats are not supported in "
+                             "the hierarchical mode")
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def _broadcast_config(comm, TaskClass=None):
         """
-        return comm.Iprobe(source=MPI.ANY_SOURCE)
+        Validates the settings on rank MASTER_RANK and copies those in
+        SHARED_SETTINGS to the other ranks.  A validation error, or a setting
+        that cannot be pickled, is raised on every rank.
+
+        :param comm: Communicator of every rank of the run.
+
+        :param TaskClass: Task class the settings are checked against.
+        :type TaskClass: class
+        """
+        framework = HummingbirdFramework
+        config = None
+        if comm.Get_rank() == framework.MASTER_RANK:
+            error = None
+            try:
+                framework.validate_config(TaskClass)
+            except ValueError as e:
+                error = e
+            settings = dict()
+            for name in framework.SHARED_SETTINGS:
+                value = getattr(framework, name)
+                try:
+                    pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    # Raising here would leave the other ranks in bcast()
+                    error = ValueError("Setting %s cannot be broadcast: %s"
+                                       % (name, e))
+                    break
+                settings[name] = value
+            config = (error, settings)
+        error, settings = comm.bcast(config, root=framework.MASTER_RANK)
+        if error is not None:
+            raise error
+        for name, value in settings.items():
+            setattr(framework, name, value)
 
     # noinspection PyPep8Naming
     @staticmethod
-    def _run_controller(comm, TaskClass):
+    def _run_worker(WorkerClass, comm, rank, shared_data, reduce_op=None):
+        """
+        Creates and runs a worker.
+
+        :param WorkerClass: Class that defines how the workers execute the
+                            passed task.
+        :type WorkerClass: class
+
+        :param comm: Communicator whose rank MASTER_RANK sends this worker tasks.
+
+        :param rank: Rank of the worker in MPI.COMM_WORLD.
+        :type rank: int
+
+        :param shared_data: Views of the node's shared data and their window.
+        :type shared_data: Tuple(dict, MPI.Win)
+
+        :param reduce_op: The task class's reduce_op.
+        """
+        worker = WorkerClass(comm, rank)
+        worker.shared_data, worker.shared_window = shared_data
+        worker.reduce_op = reduce_op
+        worker.run()
+
+    @staticmethod
+    def combine_results(op, a, b):
+        """
+        Combines two partial results with a task class's reduce_op.  None stands
+        for no result (e.g., a worker that completed no task).
+
+        :param op: The task class's reduce_op.
+
+        :return: Combination of \\p a and \\p b.
+        """
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return op(a, b)
+
+    @staticmethod
+    def reduce_results(comm, op, partial):
+        """
+        Merges the partial results of every rank onto rank MASTER_RANK with a
+        tree reduction.  This is a collective operation over \\p comm.
+
+        :param comm: Communicator of the controller and its workers.
+
+        :param op: The task class's reduce_op.
+
+        :param partial: This rank's partial result or None.
+
+        :return: On rank MASTER_RANK, the combination of every partial result
+                 (None if there is none).  None on the other ranks.
+        """
+        return comm.reduce(partial, op=functools.partial(
+            HummingbirdFramework.combine_results, op),
+            root=HummingbirdFramework.MASTER_RANK)
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def _share_worker_data(WorkerClass):
+        """
+        If the worker class defines load_shared_data(), the lowest ranked worker
+        on each node loads the data into a shared-memory window that every worker
+        on the node views.  This is a collective operation over MPI.COMM_WORLD.
+
+        :param WorkerClass: Class that defines how the workers execute the
+                            passed task.
+        :type WorkerClass: class
+
+        :return: Views of the node's shared data and their window.
+        :rtype: Tuple(dict, MPI.Win)
+        """
+        from mpi.abstract_classes import AbstractWorker
+        if WorkerClass.load_shared_data is AbstractWorker.load_shared_data:
+            return dict(), None
+        from mpi4py import MPI
+        from mpi.shared_data import SharedData
+
+        world = MPI.COMM_WORLD
+        rank = world.Get_rank()
+        node = SharedData.node_comm(world)
+        is_master = rank == HummingbirdFramework.MASTER_RANK
+        workers_on_node = node.Split(MPI.UNDEFINED if is_master else 0, key=rank)
+        node.Free()
+        if is_master:
+            return dict(), None
+
+        data = None
+        if workers_on_node.Get_rank() == 0:
+            logging.info("Worker Rank #%d: Loading shared data for %d rank(s) on "
+                         "this node" % (rank, workers_on_node.Get_size()))
+            data = WorkerClass.load_shared_data()
+        return SharedData.create(workers_on_node, data)
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def _run_hierarchical(TaskClass, WorkerClass, shared_data):
+        """
+        Splits MPI.COMM_WORLD into groups, each run by a sub-controller, and runs
+        this rank's role.  The master is rank MASTER_RANK of an upper communicator
+        that holds it and every sub-controller.  In each group's communicator, the
+        sub-controller is rank MASTER_RANK so the workers are unchanged.
+
+        :param TaskClass: Defines the task sent to the workers.
+        :type TaskClass: class
+
+        :param WorkerClass: Class that defines how the workers execute the
+                            passed task.
+        :type WorkerClass: class
+
+        :param shared_data: Views of the node's shared data and their window.
+        :type shared_data: Tuple(dict, MPI.Win)
+        """
+        # Only needed once group_size enables the hierarchical mode
+        from mpi4py import MPI
+        from mpi.sub_controller import SubController
+        world = MPI.COMM_WORLD
+        rank = world.Get_rank()
+        is_master = rank == HummingbirdFramework.MASTER_RANK
+
+        color = HummingbirdFramework._group_color(world)
+        local = world.Split(MPI.UNDEFINED if is_master else color, key=rank)
+        is_sub_controller = (not is_master
+                             and local.Get_rank() == HummingbirdFramework.MASTER_RANK)
+        # Key by the world rank so the master keeps rank MASTER_RANK (i.e., zero)
+        upper = world.Split(0 if is_master or is_sub_controller else MPI.UNDEFINED,
+                            key=rank)
+
+        n_local_workers = local.Get_size() - 1 if is_sub_controller else 0
+        if upper != MPI.COMM_NULL:
+            n_local_workers = upper.allgather(n_local_workers)
+
+        if is_master:
+            logging.info("************* HUMMINGBIRD MPI HOST CREATED *************")
+            block_size = HummingbirdFramework.group_block_size
+            if block_size is None:
+                block_size = max(1, HummingbirdFramework.chunk_size
+                                 * HummingbirdFramework.prefetch_depth
+                                 * max(n_local_workers))
+            # Sub-controllers always get a second block so they never idle
+            controller = Controller(upper, block_size, None, block_size,
+                                    max(2, HummingbirdFramework.prefetch_depth),
+                                    HummingbirdFramework.build_transport(upper))
+            HummingbirdFramework._run_controller(upper, TaskClass, controller)
+        elif is_sub_controller and local.Get_size() == 1:
+            # A group with no workers executes its blocks itself
+            HummingbirdFramework._run_worker(WorkerClass, upper, rank, shared_data)
+        elif is_sub_controller:
+            world_ranks = HummingbirdFramework._world_ranks(local)
+            sub_controller = SubController(
+                HummingbirdFramework.build_transport(upper),
+                HummingbirdFramework.MASTER_RANK,
+                HummingbirdFramework._build_controller(local), world_ranks)
+            sub_controller.run()
+        else:
+            HummingbirdFramework._run_worker(WorkerClass, local, rank, shared_data)
+
+    @staticmethod
+    def _group_color(world):
+        """
+        Identifies the group of this rank in the hierarchical mode.  This is a
+        collective operation over \\p world.
+
+        :param world: Communicator holding every rank.
+
+        :return: Group identifier shared by all ranks in the same group.
+        :rtype: int
+        """
+        rank = world.Get_rank()
+        if HummingbirdFramework.group_size == HummingbirdFramework.GROUP_BY_NODE:
+            from mpi4py import MPI
+            node = world.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+            color = node.allreduce(rank, op=MPI.MIN)
+            node.Free()
+            return color
+
+        group_size = HummingbirdFramework.group_size
+        if not isinstance(group_size, int) or group_size < 2:
+            raise ValueError("group_size must be an integer of at least 2 or "
+                             "HummingbirdFramework.GROUP_BY_NODE")
+        return (rank - Controller.FIRST_WORKER_RANK) // group_size
+
+    @staticmethod
+    def _world_ranks(comm):
+        """
+        :param comm: Any communicator that is a subset of MPI.COMM_WORLD.
+
+        :return: Rank in MPI.COMM_WORLD of each rank in \\p comm.
+        :rtype: List[int]
+        """
+        if not Transport.is_mpi_comm(comm):
+            # The local backend's LocalComm
+            return list(range(comm.Get_size()))
+        from mpi4py import MPI
+        return comm.Get_group().Translate_ranks(list(range(comm.Get_size())),
+                                                MPI.COMM_WORLD.Get_group())
+
+    @staticmethod
+    def _build_controller(comm):
+        """
+        Creates the controller configured for this run.
+
+        :param comm: MPI communicator shared by the controller and its workers.
+
+        :return: Controller that manages the other ranks in \\p comm.
+        :rtype: Controller
+        """
+        controller = Controller(comm, HummingbirdFramework.chunk_size,
+                                HummingbirdFramework.target_chunk_seconds,
+                                HummingbirdFramework.max_chunk_size,
+                                HummingbirdFramework.prefetch_depth
+                                + HummingbirdFramework.worker_concurrency - 1,
+                                HummingbirdFramework.build_transport(comm),
+                                HummingbirdFramework.scheduler,
+                                HummingbirdFramework.steal_work,
+                                HummingbirdFramework.speculate,
+                                HummingbirdFramework.task_timeout,
+                                HummingbirdFramework.heartbeat_seconds,
+                                HummingbirdFramework.max_retries,
+                                HummingbirdFramework.worker_cache_entries)
+        controller.task_log = HummingbirdFramework.build_task_log()
+        return controller
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def _run_controller(comm, TaskClass, controller=None):
         """
         Executes the controller and manages sending the messages to the workers.
 
+        The controller is event driven.  It first hands a task to every idle
+        worker and then blocks until any worker reports back.  The reporting
+        worker is immediately given its next task so no time is spent polling.
+
         :param comm:
         :param TaskClass: Class that defines the tasks to be sent to the
                           workers.
         :type TaskClass: class
+
+        :param controller: Manages the workers.  If not specified, it is built
+                           from the framework's settings.
+        :type controller: Controller
         """
-        status = MPI.Status()
-        controller = Controller(comm)
+        if controller is None:
+            controller = HummingbirdFramework._build_controller(comm)
+        transport = controller.transport
+        status = transport.new_status()
+        world_ranks = HummingbirdFramework._world_ranks(comm)
 
         log_txt = 'CONTROLLER: Starting %d workers' % controller.n_workers
         logging.info(log_txt)
         solver = TaskClass()
+        telemetry = None
+        if HummingbirdFramework.trace_prefix is not None:
+            from mpi.telemetry import Telemetry
+            telemetry = Telemetry(HummingbirdFramework.trace_prefix,
+                                  controller.n_workers)
+            controller.telemetry = telemetry
+        processor = ResultProcessor(solver, HummingbirdFramework.process_results_mode,
+                                    HummingbirdFramework.process_results_threads,
+                                    telemetry=telemetry)
+        sink = None
+        if HummingbirdFramework.result_sink is not None:
+            sink = HummingbirdFramework.result_sink()
+        journal = None
+        if HummingbirdFramework.journal_file is not None:
+            from mpi.journal import Journal
+            journal = Journal(HummingbirdFramework.journal_file,
+                              HummingbirdFramework.journal_sync_records,
+                              HummingbirdFramework.journal_sync_seconds)
+            controller.completed_task_ids = journal.completed_task_ids()
+            journal.replay(solver, sink)
+        memo = None
+        if HummingbirdFramework.memo_dir is not None:
+            from mpi.memo_cache import MemoCache
+            memo = MemoCache(HummingbirdFramework.memo_dir,
+                             HummingbirdFramework.memo_code_version,
+                             HummingbirdFramework.memo_max_bytes,
+                             HummingbirdFramework.memo_max_age_seconds)
+            controller.memo = memo
+
+        reduce_op = TaskClass.reduce_op
 
-        all_messages_sent = False
+        def accept_result(task_id, worker_rank, result):
+            """
+            Hands a result to process_results() and to the sink, journal and
+            memo cache if they are enabled.
+            """
+            if reduce_op is not None and not isinstance(result, TaskError):
+                # Combined on the worker and reduced once every task is done
+                return
+            processor.submit(worker_rank, result, task_id)
+            if isinstance(result, TaskError):
+                return
+            if sink is not None:
+                sink.write(worker_rank, result)
+            if journal is not None:
+                journal.append(task_id, worker_rank, result)
+            memo_key = controller.pop_memo_key(task_id)
+            if memo_key is not None:
+                memo.store(memo_key, result)
 
         # Run the master
+        all_finished_logged = False
+        # When the controller started waiting for results while checking the
+        # deadlines and heartbeats
+        waiting_since = None
         while True:
-            while HummingbirdFramework._is_message_pending(comm):
-                worker_result = comm.recv(status=status)
-                controller.add_available_worker(status.Get_source())
-                solver.process_results(status.Get_source(), worker_result)
+            while controller.have_available_workers_p():
+                controller.pull_tasks(solver)
+                memo_hits = controller.pop_memo_hits()
+                for task_id, result in memo_hits:
+                    accept_result(task_id, world_ranks[0], result)
+                chunk = controller.next_chunk()
+                if not chunk:
+                    # Keep pulling if the memo cache served every pulled task
+                    if memo_hits:
+                        continue
+                    break
+                controller.dispatch(chunk)
 
-            # If all tasks are done, do not exit until
-            if all_messages_sent:
+            # If all tasks are done, do not exit until every worker reports back
+            if controller.all_tasks_dispatched():
                 if controller.all_workers_completed():
-                    logging.info("CONTROLLER: All workers done and " 
+                    processor.close()
+                    if sink is not None:
+                        sink.close()
+                    if journal is not None:
+                        journal.close()
+                    if memo is not None:
+                        logging.info("CONTROLLER: Memo cache served %d of %d "
+                                     "task(s)" % (memo.hits, memo.hits + memo.misses))
+                        memo.evict()
+                    if telemetry is not None:
+                        telemetry.write(transport)
+                    controller.terminate_everything()
+                    if reduce_op is not None:
+                        start = time.time()
+                        reduced = HummingbirdFramework.reduce_results(
+                            comm, reduce_op, None)
+                        logging.info("CONTROLLER: Reduced the results in %.3f "
+                                     "seconds" % (time.time() - start))
+                        solver.process_reduced_results(reduced)
+                    logging.info("CONTROLLER: All workers done and "
                                  "processed. Exiting...")
+                    if controller.failed_workers:
+                        # Failed workers may never exit so take down the job
+                        logging.warning("CONTROLLER: Aborting %d failed worker(s)"
+                                        % len(controller.failed_workers))
+                        comm.Abort(0)
                     sys.exit(0)
-                time.sleep(1)
+                controller.steal_queued_work()
+                # Wait for stragglers with a short poll so idle workers can rerun
+                # them.  Otherwise, nothing would wake the controller up.
+                while (controller.speculate_stragglers()
+                       and not transport.iprobe()):
+                    time.sleep(Controller.SPECULATION_POLL_SECONDS)
+                if controller.n_unfinished_tasks == 0 and not all_finished_logged:
+                    logging.info("CONTROLLER: All tasks finished. Waiting for "
+                                 "duplicate tasks to complete...")
+                    all_finished_logged = True
+
+            # Check the deadlines and heartbeats until a worker reports back,
+            # backing off so that a long wait does not keep a core busy.  Return
+            # to the top after a check so requeued tasks are dispatched.
+            if (controller.fault_detection_p()
+                    and not transport.iprobe()):
+                for worker, error in controller.check_workers():
+                    accept_result(None, world_ranks[worker], error)
+                now = time.time()
+                if waiting_since is None:
+                    waiting_since = now
+                time.sleep(controller.fault_poll_seconds(now - waiting_since))
                 continue
+            waiting_since = None
 
-            while controller.have_available_workers_p():
-                try:
-                    task = solver.get_next()
-                except StopIteration:
-                    # Generator fully consumed
-                    controller.terminate_everything()
-                    all_messages_sent = True
-                    break
-                else:
-                    worker = controller.get_available_worker()
-                    logging.info("CONTROLLER: Packing task \"%s\" for worker %d"
-                                 % (task, worker))
-                    message = ControllerToWorkerMessage.build(False, task)
-                    comm.send(message, dest=worker)
-                    time.sleep(1)
+            # Block until any worker returns its results
+            worker_msg = transport.recv(status=status)
+            returned_at = unpickled_at = time.time()
+            if transport.receive_times is not None:
+                returned_at, unpickled_at = transport.receive_times
+            worker = status.Get_source()
+            task_ids = WorkerToControllerMessage.extract_task_ids(worker_msg)
+            results = WorkerToControllerMessage.extract_results(worker_msg)
+            failed_task_ids = []
+            for task_id, result in zip(task_ids, results):
+                if isinstance(result, TaskError):
+                    result.attempts = controller.attempts(task_id)
+                    failed_task_ids.append(task_id)
+            accepted = controller.complete_chunk(
+                worker, task_ids, WorkerToControllerMessage.extract_elapsed(worker_msg),
+                WorkerToControllerMessage.extract_revoked_task_ids(worker_msg),
+                failed_task_ids)
+            if telemetry is not None:
+                telemetry.record_results(
+                    worker, task_ids, accepted,
+                    WorkerToControllerMessage.extract_timings(worker_msg), returned_at,
+                    unpickled_at,
+                    WorkerToControllerMessage.extract_revoked_task_ids(worker_msg))
+            worker_ranks = WorkerToControllerMessage.extract_worker_ranks(worker_msg)
+            if worker_ranks is None:
+                worker_ranks = [world_ranks[worker]] * len(results)
+            for task_id, worker_rank, worker_result, accept in zip(
+                    task_ids, worker_ranks, results, accepted):
+                # Late duplicates and tasks queued for a retry are dropped
+                if not accept:
+                    continue
+                accept_result(task_id, worker_rank, worker_result)
 
     @staticmethod
-    def _setup_logger():
+    def build_transport(comm):
+        """
+        Creates the transport configured for this run.
+
+        :param comm: MPI communicator shared by the controller and the workers.
+
+        :return: Transport used for tasks and results.
+        :rtype: Transport
+        """
+        if not Transport.is_mpi_comm(comm):
+            # Messages of the local backend's LocalComm are always pickled
+            return Transport(comm)
+        return Transport(comm, HummingbirdFramework.zero_copy_threshold,
+                         HummingbirdFramework.codec,
+                         HummingbirdFramework.trace_prefix is not None)
+
+    @staticmethod
+    def _setup_logger(rank=None):
         """
         Logger Configurator
 
         Configures the framework's logger.
+
+        :param rank: Rank of this process, used to name its log file if
+                     "log_per_rank" is set.
+        :type rank: int
         """
         # noinspection PyProtectedMember
         logger = logging.getLogger()
@@ -133,13 +866,65 @@ class HummingbirdFramework(object):
         date_format = '%m/%d/%Y %I:%M:%S %p'
 
         format_str = '%(asctime)s -- %(levelname)s -- %(message)s'
-        logging.basicConfig(filename=HummingbirdFramework.log_file,
-                            level=HummingbirdFramework.log_level,
-                            format=format_str, datefmt=date_format)
+        log_file = HummingbirdFramework.log_file
+        if HummingbirdFramework.log_per_rank and rank is not None:
+            root, extension = os.path.splitext(log_file)
+            log_file = "%s.%d%s" % (root, rank, extension)
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter(format_str, date_format))
+        logger.setLevel(HummingbirdFramework.log_level)
 
         # Also print to stdout
         handler = logging.StreamHandler(sys.stdout)
         handler.setLevel(logging.INFO)
         formatter = logging.Formatter(format_str)
         handler.setFormatter(formatter)
-        logging.getLogger().addHandler(handler)
+
+        handlers = [file_handler, handler]
+        if HummingbirdFramework.log_async:
+            # The listener's thread is the only one that writes the records
+            listener = QueueListener(
+                queue.SimpleQueue(), *handlers, respect_handler_level=True)
+            listener.start()
+            atexit.register(HummingbirdFramework._stop_logger)
+            HummingbirdFramework._log_listener = listener
+            handlers = [QueueHandler(listener.queue)]
+        for handler in handlers:
+            logger.addHandler(handler)
+        HummingbirdFramework._log_handlers = handlers
+
+    @staticmethod
+    def _stop_logger():
+        """
+        Writes the queued log records if logging is asynchronous.  Called at
+        exit.
+        """
+        listener = HummingbirdFramework._log_listener
+        if listener is not None:
+            HummingbirdFramework._log_listener = None
+            listener.stop()
+
+    @staticmethod
+    def _reset_logger(rank):
+        """
+        Replaces the logger inherited by a forked process (whose background
+        writer, if any, did not survive the fork) with its own.
+
+        :param rank: Rank of this process.
+        :type rank: int
+        """
+        logger = logging.getLogger()
+        for handler in HummingbirdFramework._log_handlers:
+            logger.removeHandler(handler)
+        HummingbirdFramework._log_handlers = []
+        HummingbirdFramework._log_listener = None
+        HummingbirdFramework._setup_logger(rank)
+
+    @staticmethod
+    def build_task_log():
+        """
+        :return: Log of per-task messages configured for this run.
+        :rtype: SampledLog
+        """
+        return SampledLog(HummingbirdFramework.log_task_every,
+                          HummingbirdFramework.log_task_max_per_second)
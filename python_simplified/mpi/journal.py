@@ -0,0 +1,159 @@
+import logging
+import os
+import pickle
+import struct
+import time
+import zlib
+
+
+class Journal(object):
+    """
+    Append-only file of the results the controller has processed.  If a job is
+    killed (e.g., at the Slurm walltime) and restarted with the same journal,
+    the results in the journal are replayed into process_results() and their
+    tasks are not executed again.  Only the work in flight is lost.
+
+    Tasks are matched by their position in the task generator so the generator
+    must yield the same tasks in the same order on every run.
+
+    Writes are buffered and the file is flushed to disk (fsync) in batches.  A
+    record cut short by a crash is detected by its checksum and dropped when the
+    journal is reopened.
+    """
+
+    MAGIC = b"HBJOURNAL1\n"
+
+    """
+    Task ID, world rank of the worker, size of the pickled result, and CRC32 of
+    the pickled result.
+    """
+    RECORD_HEADER = struct.Struct("<QiII")
+
+    def __init__(self, path, sync_records=256, sync_seconds=1.):
+        """
+        Opens the journal, creating it if it does not exist.
+
+        :param path: Path to the journal file.
+        :type path: str
+
+        :param sync_records: Maximum number of records written between syncs.
+        :type sync_records: int
+
+        :param sync_seconds: Maximum number of seconds between syncs.
+        :type sync_seconds: float
+        """
+        self.path = path
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+
+        self.records, valid_size = Journal._read(path)
+        self._file = open(path, "ab")
+        if valid_size is None:
+            self._file.write(Journal.MAGIC)
+        else:
+            # Drop the partially written record of the previous run (if any)
+            self._file.truncate(valid_size)
+        self._sync()
+        if self.records:
+            logging.info("CONTROLLER: Journal \"%s\" has %d completed task(s)"
+                         % (path, len(self.records)))
+
+    def completed_task_ids(self):
+        """
+        :return: IDs of the tasks recorded in the journal when it was opened.
+        :rtype: set
+        """
+        return set(task_id for task_id, _, _ in self.records)
+
+    def replay(self, solver, sink=None):
+        """
+        Passes every result recorded when the journal was opened to the solver.
+        The records are released afterward.
+
+        :param solver: Task object whose process_results() is called.
+        :type solver: AbstractTask
+
+        :param sink: If not None, the results are also written to this sink.
+        :type sink: ResultSink
+        """
+        for _, worker_rank, result in self.records:
+            solver.process_results(worker_rank, result)
+            if sink is not None:
+                sink.write(worker_rank, result)
+        self.records = []
+
+    def append(self, task_id, worker_rank, result):
+        """
+        Records the result of a task.  The record is on disk once the next batch
+        is synced.
+
+        :param task_id: ID of the task.
+        :type task_id: int
+
+        :param worker_rank: Rank of the worker that executed the task.
+        :type worker_rank: int
+
+        :param result: Result returned by the worker.  It must be pickleable.
+        """
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(Journal.RECORD_HEADER.pack(task_id, worker_rank, len(data),
+                                                    zlib.crc32(data)))
+        self._file.write(data)
+        self._n_unsynced += 1
+        if (self._n_unsynced >= self.sync_records
+                or time.time() - self._last_sync >= self.sync_seconds):
+            self._sync()
+
+    def close(self):
+        """
+        Syncs any remaining records and closes the journal.
+        """
+        if self._file.closed:
+            return
+        self._sync()
+        self._file.close()
+
+    def _sync(self):
+        """
+        Flushes the buffered records to disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._n_unsynced = 0
+        self._last_sync = time.time()
+
+    @staticmethod
+    def _read(path):
+        """
+        Reads the complete records of an existing journal.
+
+        :param path: Path to the journal file.
+        :type path: str
+
+        :return: (task ID, worker rank, result) of each record and the size of
+                 the valid part of the file.  The size is None if the file does
+                 not exist or is empty.
+        :rtype: Tuple(List[Tuple(int, int, object)], int)
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return [], None
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(Journal.MAGIC):
+            raise ValueError("\"%s\" is not a Hummingbird journal" % path)
+
+        records = []
+        offset = len(Journal.MAGIC)
+        header_size = Journal.RECORD_HEADER.size
+        while offset + header_size <= len(data):
+            task_id, worker_rank, n_bytes, crc = \
+                Journal.RECORD_HEADER.unpack_from(data, offset)
+            start = offset + header_size
+            payload = data[start:start + n_bytes]
+            if len(payload) < n_bytes or zlib.crc32(payload) != crc:
+                logging.warning("CONTROLLER: Dropping the incomplete last record "
+                                "of journal \"%s\"" % path)
+                break
+            records.append((task_id, worker_rank, pickle.loads(payload)))
+            offset = start + n_bytes
+        return records, offset
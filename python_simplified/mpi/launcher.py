@@ -0,0 +1,203 @@
+"""
+Starts a script on every rank with the Python modules of its directory served
+from memory.  Rank 0 reads and compiles every module under the script's
+directory (including the script) and broadcasts them, so the other ranks
+import them without touching the (shared) filesystem.  This speeds up the
+startup of short jobs with many ranks.
+
+Use it in place of "python script.py":
+
+    mpirun python3 -m mpi.launcher run_on_hummingbird.py [arguments]
+
+Modules of other directories are broadcast too (and added to sys.path) with
+"--path <directory>" before the script.
+"""
+import argparse
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import sys
+import types
+
+from mpi4py import MPI
+
+
+class BroadcastFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """
+    Imports modules from code objects received from rank 0.
+    """
+
+    def __init__(self, modules):
+        """
+        :param modules: Maps each module name to its path, whether it is a
+                        package and its marshalled code.
+        :type modules: dict
+        """
+        self.modules = modules
+
+    def find_spec(self, fullname, path=None, target=None):
+        entry = self.modules.get(fullname)
+        if entry is None:
+            return None
+        path, is_package, _ = entry
+        spec = importlib.machinery.ModuleSpec(fullname, self, origin=path,
+                                              is_package=is_package)
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = [os.path.dirname(path)]
+        return spec
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        _, _, code = self.modules[module.__spec__.name]
+        exec(marshal.loads(code), module.__dict__)
+
+
+class Launcher(object):
+    """
+    Broadcasts and runs a script.  See the module's documentation.
+    """
+
+    """
+    Largest total size in bytes of the modules that are broadcast.  Beyond it,
+    the remaining modules are imported from the filesystem as usual.
+    """
+    MAX_BYTES = 64 * 1024 * 1024
+    SKIPPED_DIRECTORIES = ("__pycache__",)
+
+    @staticmethod
+    def collect_modules(directory):
+        """
+        Compiles the modules and packages under a directory.
+
+        :param directory: Directory whose modules are importable (i.e., it is on
+                          sys.path).
+        :type directory: str
+
+        :return: Maps each module name to its path, whether it is a package and
+                 its marshalled code.
+        :rtype: dict
+        """
+        modules = dict()
+        n_bytes = 0
+        for root, dirs, files in os.walk(directory):
+            relative = os.path.relpath(root, directory)
+            parts = [] if relative == os.curdir else relative.split(os.sep)
+            # Only descend into packages
+            dirs[:] = [d for d in dirs if d.isidentifier()
+                       and d not in Launcher.SKIPPED_DIRECTORIES
+                       and os.path.isfile(os.path.join(root, d, "__init__.py"))]
+            for name in sorted(files):
+                stem, extension = os.path.splitext(name)
+                if extension != ".py" or not stem.isidentifier():
+                    continue
+                path = os.path.join(root, name)
+                code = Launcher._read_code(path)
+                if code is None:
+                    continue
+                n_bytes += len(code)
+                if n_bytes > Launcher.MAX_BYTES:
+                    return modules
+                is_package = stem == "__init__"
+                module_name = ".".join(parts if is_package else parts + [stem])
+                if module_name:
+                    modules[module_name] = (path, is_package, code)
+        return modules
+
+    @staticmethod
+    def _read_code(path):
+        """
+        :param path: Path of a module's source.
+        :type path: str
+
+        :return: Marshalled code of the module, taken from its cached bytecode
+                 if it is up to date, or None if it does not compile.
+        :rtype: bytes
+        """
+        stat = os.stat(path)
+        try:
+            with open(importlib.util.cache_from_source(path), "rb") as f:
+                data = f.read()
+            # Header: magic number, flags, source mtime and source size
+            if (data[:4] == importlib.util.MAGIC_NUMBER
+                    and int.from_bytes(data[4:8], "little") == 0
+                    and int.from_bytes(data[8:12], "little") == int(stat.st_mtime) & 0xFFFFFFFF
+                    and int.from_bytes(data[12:16], "little") == stat.st_size & 0xFFFFFFFF):
+                return data[16:]
+        except (OSError, NotImplementedError):
+            pass
+        with open(path, "rb") as f:
+            source = f.read()
+        try:
+            return marshal.dumps(compile(source, path, "exec", dont_inherit=True))
+        except SyntaxError:
+            # Left for the regular import to report
+            return None
+
+    @staticmethod
+    def run(script, args, directories=(), comm=None):
+        """
+        Broadcasts the modules next to a script and runs the script as
+        "__main__" on every rank.
+
+        :param script: Path to the script.
+        :type script: str
+
+        :param args: Arguments passed to the script in sys.argv.
+        :type args: List[str]
+
+        :param directories: Other directories whose modules are broadcast.  They
+                            are added to sys.path after the script's directory.
+        :type directories: List[str]
+
+        :param comm: Communicator of every rank.  MPI.COMM_WORLD by default.
+        """
+        if comm is None:
+            comm = MPI.COMM_WORLD
+        script = os.path.abspath(script)
+        directories = [os.path.dirname(script)] + [os.path.abspath(d)
+                                                   for d in directories]
+        payload = None
+        if comm.Get_rank() == 0:
+            modules = dict()
+            # Earlier directories take precedence as they do on sys.path
+            for directory in reversed(directories):
+                modules.update(Launcher.collect_modules(directory))
+            payload = (importlib.util.MAGIC_NUMBER, modules)
+        magic, modules = comm.bcast(payload, root=0)
+
+        sys.argv = [script] + list(args)
+        sys.path[0:0] = directories
+        # Code objects only load on the same Python version
+        if magic != importlib.util.MAGIC_NUMBER:
+            modules = dict()
+        script_name = os.path.splitext(os.path.basename(script))[0]
+        entry = modules.pop(script_name, None)
+        sys.meta_path.insert(0, BroadcastFinder(modules))
+
+        main = types.ModuleType("__main__")
+        main.__file__ = script
+        main.__builtins__ = __builtins__
+        sys.modules["__main__"] = main
+        if entry is not None:
+            code = marshal.loads(entry[2])
+        else:
+            with open(script, "rb") as f:
+                code = compile(f.read(), script, "exec", dont_inherit=True)
+        exec(code, main.__dict__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m mpi.launcher",
+                                     description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", action="append", default=[],
+                        help="Other directory whose modules are broadcast.")
+    parser.add_argument("script", help="Script to run on every rank.")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER,
+                        help="Arguments of the script.")
+    arguments = parser.parse_args()
+    Launcher.run(arguments.script, arguments.arguments, arguments.path)
@@ -0,0 +1,276 @@
+import logging
+import multiprocessing
+import operator
+import os
+import pickle
+import queue
+
+from mpi.abstract_classes import AbstractWorker
+from mpi.hb_framework import HummingbirdFramework
+from mpi.transport import Transport
+
+
+class LocalRequest(object):
+    """
+    Request of a send over a LocalComm.  Local sends complete immediately.
+    """
+
+    def Wait(self):
+        pass
+
+    def Test(self):
+        return True
+
+
+class LocalStatus(object):
+    """
+    Stand-in for MPI.Status that LocalComm fills with the source and tag of a
+    received message.
+    """
+
+    def __init__(self):
+        self.source = LocalComm.ANY_SOURCE
+        self.tag = LocalComm.ANY_TAG
+
+    def Get_source(self):
+        return self.source
+
+    def Set_source(self, source):
+        self.source = source
+
+    def Get_tag(self):
+        return self.tag
+
+    def Set_tag(self, tag):
+        self.tag = tag
+
+
+class LocalComm(object):
+    """
+    Stand-in for the subset of an MPI communicator that the framework uses
+    (point-to-point messages only) between the processes of a single machine.
+    Each rank has an inbox queue that every other rank puts its messages in.
+    """
+
+    """
+    Source that matches a message from any rank, like MPI.ANY_SOURCE.
+    """
+    ANY_SOURCE = -1
+    """
+    Tag that matches a message with any tag, like MPI.ANY_TAG.
+    """
+    ANY_TAG = -1
+    """
+    Tag of the messages of reduce(), distinct from the framework's messages.
+    """
+    REDUCE_TAG = 100
+
+    def __init__(self, rank, size, inboxes, processes=None):
+        """
+        :param rank: Rank of this process.
+        :type rank: int
+
+        :param size: Number of ranks.
+        :type size: int
+
+        :param inboxes: Queue of received messages of each rank.
+        :type inboxes: List[multiprocessing.Queue]
+
+        :param processes: Processes of the other ranks.  Only given on the rank
+                          that started them, so Abort() can stop them.
+        :type processes: List[multiprocessing.Process]
+        """
+        self._rank = rank
+        self._size = size
+        self._inboxes = inboxes
+        self._processes = processes if processes is not None else []
+        # Messages taken from the inbox that did not match a receive yet
+        self._pending = []
+
+    def Get_rank(self):
+        return self._rank
+
+    def Get_size(self):
+        return self._size
+
+    def send(self, obj, dest, tag=0):
+        """
+        Sends an object.  It is pickled before returning so the caller may
+        modify it at once, just as with MPI.
+        """
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        self._inboxes[dest].put((self._rank, tag, data))
+
+    def isend(self, obj, dest, tag=0):
+        self.send(obj, dest, tag)
+        return LocalRequest()
+
+    def recv(self, buf=None, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        Blocks until a matching message arrives.  Messages from a sender are
+        received in the order they were sent.
+        """
+        while True:
+            message = self._match(source, tag, status, remove=True)
+            if message is not None:
+                return pickle.loads(message[2])
+            self._pending.append(self._inboxes[self._rank].get())
+
+    def Iprobe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        :return: True if a matching message is waiting to be received.
+        :rtype: bool
+        """
+        self._drain()
+        return self._match(source, tag, status, remove=False) is not None
+
+    def reduce(self, sendobj, op=operator.add, root=0):
+        """
+        Combines an object of every rank onto \\p root along a binomial tree, so
+        each rank handles at most log2(size) messages.  Must be called by every
+        rank.
+
+        :return: On \\p root, the combination in rank order.  None elsewhere.
+        """
+        relative = (self._rank - root) % self._size
+        mask = 1
+        while mask < self._size:
+            if relative & mask:
+                self.send(sendobj, (relative - mask + root) % self._size,
+                          LocalComm.REDUCE_TAG)
+                return None
+            if relative | mask < self._size:
+                received = self.recv(source=(relative + mask + root) % self._size,
+                                     tag=LocalComm.REDUCE_TAG)
+                sendobj = op(sendobj, received)
+            mask <<= 1
+        return sendobj
+
+    def Abort(self, errorcode=0):
+        """
+        Stops the processes of the other ranks and then this process.
+        """
+        for process in self._processes:
+            process.kill()
+        os._exit(errorcode)
+
+    def _drain(self):
+        """
+        Moves every message already in the inbox to the pending list.
+        """
+        inbox = self._inboxes[self._rank]
+        while True:
+            try:
+                self._pending.append(inbox.get_nowait())
+            except queue.Empty:
+                return
+
+    def _match(self, source, tag, status, remove):
+        """
+        :return: Oldest pending message matching the source and tag or None.
+        :rtype: Tuple(int, int, bytes)
+        """
+        for i, message in enumerate(self._pending):
+            if ((source == LocalComm.ANY_SOURCE or message[0] == source)
+                    and (tag == LocalComm.ANY_TAG or message[1] == tag)):
+                if remove:
+                    del self._pending[i]
+                if status is not None:
+                    status.Set_source(message[0])
+                    status.Set_tag(message[1])
+                return message
+        return None
+
+
+class LocalBackend(object):
+    """
+    Runs the controller and its workers as processes of one machine, without
+    MPI (e.g., on a laptop or in a CI job).  The controller runs in the calling
+    process.  The framework only imports mpi4py on the MPI path, so mpi4py need
+    not be installed.
+    """
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def run(TaskClass, WorkerClass, n_workers=None):
+        """
+        Starts the workers and runs the controller until every task completes.
+
+        :param TaskClass: Defines the task sent to the workers.
+        :type TaskClass: class
+
+        :param WorkerClass: Class that defines how the workers execute the
+                            passed task.
+        :type WorkerClass: class
+
+        :param n_workers: Number of worker processes.  If None, one fewer than
+                          the number of CPUs (and at least one).
+        :type n_workers: int
+        """
+        if n_workers is None:
+            n_workers = max(1, (os.cpu_count() or 2) - 1)
+        # Forking after MPI was initialized is unsafe so the workers are then
+        # started from scratch.  This requires the script's entry point to be
+        # guarded by 'if __name__ == "__main__":'.
+        MPI = Transport.mpi_module()
+        if MPI is not None and MPI.Is_initialized():
+            context = multiprocessing.get_context("spawn")
+            os.environ[HummingbirdFramework.BACKEND_ENV_VAR] = \
+                HummingbirdFramework.LOCAL_BACKEND
+        else:
+            context = multiprocessing.get_context("fork")
+
+        # Loaded once here.  Forked workers share its pages copy-on-write.
+        shared_data = dict()
+        if WorkerClass.load_shared_data is not AbstractWorker.load_shared_data:
+            logging.info("Loading shared data for %d local worker(s)" % n_workers)
+            shared_data = WorkerClass.load_shared_data()
+
+        size = n_workers + 1
+        inboxes = [context.Queue() for _ in range(size)]
+        processes = [context.Process(target=LocalBackend._run_worker,
+                                     args=(WorkerClass, rank, size, inboxes,
+                                           shared_data, TaskClass.reduce_op),
+                                     name="hummingbird-worker-%d" % rank)
+                     for rank in range(1, size)]
+        for process in processes:
+            process.start()
+
+        logging.info("************* HUMMINGBIRD LOCAL HOST CREATED *************")
+        comm = LocalComm(HummingbirdFramework.MASTER_RANK, size, inboxes, processes)
+        try:
+            HummingbirdFramework._run_controller(comm, TaskClass)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                LocalBackend._stop(processes)
+            raise
+        except BaseException:
+            LocalBackend._stop(processes)
+            raise
+        finally:
+            for process in processes:
+                process.join()
+
+    # noinspection PyPep8Naming
+    @staticmethod
+    def _run_worker(WorkerClass, rank, size, inboxes, shared_data, reduce_op):
+        """
+        Body of each worker process.
+        """
+        HummingbirdFramework._reset_logger(rank)
+        comm = LocalComm(rank, size, inboxes)
+        try:
+            HummingbirdFramework._run_worker(WorkerClass, comm, rank,
+                                             (shared_data, None), reduce_op)
+        finally:
+            # Worker processes skip the exit handlers
+            HummingbirdFramework._stop_logger()
+
+    @staticmethod
+    def _stop(processes):
+        """
+        Terminates the workers after the controller failed.
+        """
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+
+class MemoCache(object):
+    """
+    Content-addressed on-disk store of task results shared across runs.  A
+    result is keyed by a hash of the pickled task and a code version supplied by
+    the user, so changing the version invalidates every earlier result.
+
+    Each result is its own file, written to a temporary file and renamed into
+    place, so concurrent jobs (even on a shared filesystem) never see a partial
+    result.  A file that cannot be read is treated as a miss.
+
+    Tasks with equal values must pickle to the same bytes (e.g., dictionaries
+    built with their keys in the same order) to share a result.
+    """
+
+    """
+    Pickle protocol used to hash the tasks.  It is fixed so keys do not change
+    with the Python version.
+    """
+    KEY_PROTOCOL = 4
+    EXTENSION = ".pkl"
+
+    def __init__(self, directory, code_version="", max_bytes=None,
+                 max_age_seconds=None):
+        """
+        :param directory: Directory of the store.  It is created if needed.
+        :type directory: str
+
+        :param code_version: Version of the code that computes the results.
+        :type code_version: str
+
+        :param max_bytes: If not None, evict() removes the least recently used
+                          results until the store is no larger than this.
+        :type max_bytes: int
+
+        :param max_age_seconds: If not None, evict() removes the results not used
+                                for this many seconds.
+        :type max_age_seconds: float
+        """
+        self.directory = directory
+        self.code_version = code_version
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, task):
+        """
+        :param task: Task returned by the generator.  It must be pickleable.
+
+        :return: Key of the task's result.
+        :rtype: str
+        """
+        digest = hashlib.sha256(self.code_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(pickle.dumps(task, protocol=MemoCache.KEY_PROTOCOL))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        :param key: Key built by key().
+        :type key: str
+
+        :return: True and the stored result on a hit.  Otherwise, False and None.
+        :rtype: Tuple(bool, object)
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return False, None
+        except Exception:
+            logging.warning("CONTROLLER: Ignoring unreadable memoized result \"%s\""
+                            % path)
+            self.misses += 1
+            return False, None
+        # The modification time tracks the last use for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return True, result
+
+    def store(self, key, result):
+        """
+        Saves a result.  Concurrent writers of the same key are harmless since
+        the last rename wins and both results are equal.
+
+        :param key: Key built by key().
+        :type key: str
+
+        :param result: Result to store.  It must be pickleable.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def evict(self):
+        """
+        Removes results older than max_age_seconds and then the least recently
+        used results until the store fits in max_bytes.
+
+        :return: Number of results removed.
+        :rtype: int
+        """
+        if self.max_bytes is None and self.max_age_seconds is None:
+            return 0
+        entries = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(MemoCache.EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        n_removed = 0
+        for mtime, size, path in entries:
+            too_old = (self.max_age_seconds is not None
+                       and now - mtime > self.max_age_seconds)
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_old and not too_big:
+                break
+            try:
+                os.remove(path)
+                n_removed += 1
+            except FileNotFoundError:
+                # Already removed by a concurrent job
+                pass
+            total -= size
+        if n_removed:
+            logging.info("CONTROLLER: Evicted %d memoized result(s)" % n_removed)
+        return n_removed
+
+    def _path(self, key):
+        """
+        :return: Path of a key's file.  Files are spread across 256 directories.
+        :rtype: str
+        """
+        return os.path.join(self.directory, key[:2], key + MemoCache.EXTENSION)
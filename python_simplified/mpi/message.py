@@ -5,33 +5,49 @@ class ControllerToWorkerMessage(object):
     generated tasks are PICKLEABLE although it does not explicitly check.
     """
 
-    TASK_KEY = "task"
+    TASKS_KEY = "tasks"
+    TASK_IDS_KEY = "task_ids"
     SHOULD_EXIT_KEY = "should_exit"
+    REVOKE_KEY = "revoke"
+    KEYS = (SHOULD_EXIT_KEY, TASKS_KEY, TASK_IDS_KEY, REVOKE_KEY)
 
     @staticmethod
-    def build(terminate_worker, generated_task):
+    def build(terminate_worker, generated_tasks, task_ids, revoke=False):
         """
         Creates a message in the format of a Python dictionary.  The Python fields
         are:
           * should_exit - bool - Indicates whether the worker should terminate.
-          * task - This is
+          * tasks - List of tasks (a chunk) the worker should execute in order.
+          * task_ids - List of the controller assigned ID of each task.
+          * revoke - bool - If True, the message has no tasks and instead asks the
+                     worker to return the chunk with these task IDs unexecuted if
+                     it has not started it yet.
 
         :param terminate_worker: True if the slave/worker should be terminated.
         :type terminate_worker: bool
 
-        :param generated_task: Tasks generated by the AbstractTask() class.
+        :param generated_tasks: Tasks generated by the AbstractTask() class.
+        :type generated_tasks: List
+
+        :param task_ids: Non-negative integer ID of each task.
+        :type task_ids: List[int]
+
+        :param revoke: True if the chunk \\p task_ids should be revoked.
+        :type revoke: bool
 
         :return: Message to be transmitted
         :rtype: dict
         """
         message = dict()
         message[ControllerToWorkerMessage.SHOULD_EXIT_KEY] = terminate_worker
-        message[ControllerToWorkerMessage.TASK_KEY] = generated_task
+        message[ControllerToWorkerMessage.TASKS_KEY] = generated_tasks
+        message[ControllerToWorkerMessage.TASK_IDS_KEY] = task_ids
+        message[ControllerToWorkerMessage.REVOKE_KEY] = revoke
         return message
 
     @staticmethod
     def exit_message():
-        return ControllerToWorkerMessage.build(True, "")
+        return ControllerToWorkerMessage.build(True, [], [])
 
     @staticmethod
     def extract_should_exit(msg):
@@ -48,13 +64,216 @@ class ControllerToWorkerMessage(object):
         return msg[ControllerToWorkerMessage.SHOULD_EXIT_KEY]
 
     @staticmethod
-    def extract_generated_task(msg):
+    def extract_revoke(msg):
+        """
+        :param msg: Message sent to a worker.
+        :type msg: dict
+
+        :return: True if the message revokes a chunk sent earlier.
+        :rtype: bool
+        """
+        return msg[ControllerToWorkerMessage.REVOKE_KEY]
+
+    @staticmethod
+    def extract_generated_tasks(msg):
         """
-        Extracts the AbstractTask() sent from the controller to a worker.
+        Extracts the chunk of AbstractTask() tasks sent from the controller to a
+        worker.
 
         :param msg: Message sent to a worker.
         :type msg: dict
 
-        :return: Task generated.
+        :return: Tasks generated.
+        :rtype: List
+        """
+        return msg[ControllerToWorkerMessage.TASKS_KEY]
+
+    @staticmethod
+    def extract_task_ids(msg):
+        """
+        :param msg: Message sent to a worker.
+        :type msg: dict
+
+        :return: ID of each task in the message.
+        :rtype: List[int]
+        """
+        return msg[ControllerToWorkerMessage.TASK_IDS_KEY]
+
+
+class WorkerToControllerMessage(object):
+    """
+    Class defines the message a worker returns to the controller after it
+    executes a chunk of tasks.  The results must be PICKLEABLE.
+    """
+
+    TASK_IDS_KEY = "task_ids"
+    RESULTS_KEY = "results"
+    ELAPSED_KEY = "elapsed"
+    WORKER_RANKS_KEY = "worker_ranks"
+    REVOKED_KEY = "revoked_task_ids"
+    TIMINGS_KEY = "timings"
+
+    @staticmethod
+    def build(task_ids, results, elapsed, worker_ranks=None,
+              revoked_task_ids=None, timings=None):
+        """
+        Creates a message in the format of a Python dictionary.  The Python fields
+        are:
+          * task_ids - List of the IDs of the tasks in the chunk.
+          * results - List of the results of each task in the chunk in order.
+          * elapsed - float - Seconds the worker spent executing the chunk.
+          * worker_ranks - List of the MPI.COMM_WORLD rank that executed each
+                           task or None if the sender executed all of them.
+          * revoked_task_ids - List of the IDs of a revoked chunk's tasks, which
+                               were not executed, or None.
+          * timings - dict - If the framework's telemetry is enabled, the times
+                      the worker received the chunk ("received") and sent its
+                      results ("sent") and the times between which each task ran
+                      ("marks", one more than the number of tasks).  Otherwise,
+                      None.
+
+        :param task_ids: IDs of the executed tasks as sent by the controller.
+        :type task_ids: List[int]
+
+        :param results: Results returned by AbstractWorker.execute_task().
+        :type results: List
+
+        :param elapsed: Time in seconds spent executing the tasks.
+        :type elapsed: float
+
+        :param worker_ranks: Set by a sub-controller to the rank of the worker
+                             that executed each task.
+        :type worker_ranks: List[int]
+
+        :param revoked_task_ids: Tasks returned unexecuted because the controller
+                                 revoked their chunk.
+        :type revoked_task_ids: List[int]
+
+        :param timings: Timestamps of the chunk on the worker.
+        :type timings: dict
+
+        :return: Message to be transmitted
+        :rtype: dict
+        """
+        message = dict()
+        message[WorkerToControllerMessage.TASK_IDS_KEY] = task_ids
+        message[WorkerToControllerMessage.RESULTS_KEY] = results
+        message[WorkerToControllerMessage.ELAPSED_KEY] = elapsed
+        message[WorkerToControllerMessage.WORKER_RANKS_KEY] = worker_ranks
+        message[WorkerToControllerMessage.REVOKED_KEY] = revoked_task_ids
+        message[WorkerToControllerMessage.TIMINGS_KEY] = timings
+        return message
+
+    @staticmethod
+    def extract_task_ids(msg):
+        """
+        :param msg: Message transmitted from a worker.
+        :type msg: dict
+
+        :return: IDs of the tasks in the chunk.
+        :rtype: List[int]
+        """
+        return msg[WorkerToControllerMessage.TASK_IDS_KEY]
+
+    @staticmethod
+    def extract_results(msg):
+        """
+        :param msg: Message transmitted from a worker.
+        :type msg: dict
+
+        :return: Results of each task in the chunk.
+        :rtype: List
+        """
+        return msg[WorkerToControllerMessage.RESULTS_KEY]
+
+    @staticmethod
+    def extract_elapsed(msg):
+        """
+        :param msg: Message transmitted from a worker.
+        :type msg: dict
+
+        :return: Seconds the worker spent executing the chunk.
+        :rtype: float
+        """
+        return msg[WorkerToControllerMessage.ELAPSED_KEY]
+
+    @staticmethod
+    def extract_worker_ranks(msg):
+        """
+        :param msg: Message transmitted from a worker or sub-controller.
+        :type msg: dict
+
+        :return: MPI.COMM_WORLD rank that executed each task or None if the
+                 sender executed them all.
+        :rtype: List[int]
+        """
+        return msg[WorkerToControllerMessage.WORKER_RANKS_KEY]
+
+    @staticmethod
+    def extract_revoked_task_ids(msg):
+        """
+        :param msg: Message transmitted from a worker.
+        :type msg: dict
+
+        :return: IDs of the tasks of a revoked chunk or None.
+        :rtype: List[int]
         """
-        return msg[ControllerToWorkerMessage.TASK_KEY]
+        return msg[WorkerToControllerMessage.REVOKED_KEY]
+
+    @staticmethod
+    def extract_timings(msg):
+        """
+        :param msg: Message transmitted from a worker.
+        :type msg: dict
+
+        :return: Timestamps of the chunk on the worker or None.
+        :rtype: dict
+        """
+        return msg[WorkerToControllerMessage.TIMINGS_KEY]
+
+
+class TaskError(object):
+    """
+    Result of a task that raised an exception or whose worker stopped responding.
+    Failed tasks are retried on other workers.  Once the retries are exhausted,
+    the error is passed to AbstractTask.process_error() instead of a result.
+    """
+
+    """
+    Error type of tasks whose worker missed the task deadline or its heartbeats.
+    """
+    WORKER_FAILURE = "WorkerFailure"
+
+    def __init__(self, task, error_type, message, traceback_text=None,
+                 worker_rank=None, hostname=None):
+        """
+        :param task: Task that failed.
+
+        :param error_type: Name of the exception class or TaskError.WORKER_FAILURE.
+        :type error_type: str
+
+        :param message: Error message.
+        :type message: str
+
+        :param traceback_text: Formatted traceback of the exception (if any).
+        :type traceback_text: str
+
+        :param worker_rank: Rank of the worker where the task failed.
+        :type worker_rank: int
+
+        :param hostname: Host of the worker where the task failed.
+        :type hostname: str
+        """
+        self.task = task
+        self.error_type = error_type
+        self.message = message
+        self.traceback_text = traceback_text
+        self.worker_rank = worker_rank
+        self.hostname = hostname
+        # Number of times the task was executed before giving up
+        self.attempts = 1
+
+    def __repr__(self):
+        return ("TaskError(task=%r, error_type=%r, message=%r, worker_rank=%r, "
+                "attempts=%d)" % (self.task, self.error_type, self.message,
+                                  self.worker_rank, self.attempts))
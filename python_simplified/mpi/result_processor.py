@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+import time
+
+from mpi.message import TaskError
+
+
+class ResultProcessor(object):
+    """
+    Passes results to AbstractTask.process_results() (and failed tasks to
+    process_error()).  Outside the inline mode, the calls run on background
+    threads so the controller refills a worker the moment it reports back, no
+    matter how slow the result handling is.  A bounded queue applies
+    backpressure if the handling cannot keep up.
+    """
+
+    """
+    process_results() runs on the controller's thread.
+    """
+    INLINE = "inline"
+    """
+    process_results() runs on one background thread in the order the results
+    arrive, just as in the inline mode.
+    """
+    ORDERED = "ordered"
+    """
+    process_results() runs concurrently on a pool of background threads so it
+    must be thread-safe.  The results are handled in no particular order.
+    """
+    UNORDERED = "unordered"
+
+    _STOP = object()
+
+    def __init__(self, solver, mode=INLINE, n_threads=4, max_pending=10000,
+                 telemetry=None):
+        """
+        :param solver: Task object whose process_results() is called.
+        :type solver: AbstractTask
+
+        :param mode: ResultProcessor.INLINE, ORDERED, or UNORDERED.
+        :type mode: str
+
+        :param n_threads: Number of threads in the unordered mode.
+        :type n_threads: int
+
+        :param max_pending: Maximum number of results waiting to be processed.
+        :type max_pending: int
+
+        :param telemetry: If not None, records how long each call takes.
+        :type telemetry: Telemetry
+        """
+        if mode not in (ResultProcessor.INLINE, ResultProcessor.ORDERED,
+                        ResultProcessor.UNORDERED):
+            raise ValueError("Unknown result processing mode \"%s\"" % mode)
+        self.solver = solver
+        self.mode = mode
+        self.telemetry = telemetry
+        self._error = None
+        self._threads = []
+        if mode == ResultProcessor.INLINE:
+            return
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        if mode == ResultProcessor.UNORDERED:
+            n_threads = max(1, n_threads)
+        else:
+            n_threads = 1
+        for _ in range(n_threads):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, worker_id, results, task_id=None):
+        """
+        Processes a result now (inline mode) or queues it for the background
+        threads.  Blocks while the queue is full.
+
+        :param worker_id: Identification number (rank) of the worker who generated
+                          the results
+        :type worker_id: int
+
+        :param results: Results from the worker or the TaskError of a task that
+                        failed.
+
+        :param task_id: ID of the task, used by the telemetry.
+        :type task_id: int
+        """
+        if self.mode == ResultProcessor.INLINE:
+            self._process(worker_id, results, task_id)
+            return
+        self._raise_error()
+        self._queue.put((worker_id, results, task_id))
+
+    def close(self):
+        """
+        Waits until every queued result has been processed.
+        """
+        for _ in self._threads:
+            self._queue.put(ResultProcessor._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._raise_error()
+
+    def _process(self, worker_id, results, task_id=None):
+        """
+        Calls the solver's handler for one result.
+        """
+        start = time.time()
+        if isinstance(results, TaskError):
+            self.solver.process_error(worker_id, results)
+        else:
+            self.solver.process_results(worker_id, results)
+        if self.telemetry is not None and task_id is not None:
+            self.telemetry.record_processing(task_id, start, time.time())
+
+    def _run(self):
+        """
+        Body of each background thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is ResultProcessor._STOP:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._process(*item)
+            except Exception as e:
+                logging.exception("CONTROLLER: process_results raised an exception")
+                self._error = e
+
+    def _raise_error(self):
+        """
+        Re-raises an error of a background thread in the controller's thread.
+        """
+        if self._error is not None:
+            raise RuntimeError("Processing the results failed: %r" % self._error)
@@ -0,0 +1,321 @@
+import abc
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ResultSink(object):
+    """
+    Abstract class that writes results to storage incrementally so the
+    controller does not have to keep every result in memory.
+
+    Results are handed to a background writer thread through a bounded queue.
+    If the writer falls behind, write() blocks until there is room so the
+    controller's memory stays flat regardless of the number of tasks.  The
+    writer thread groups the results into batches before writing them.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    """
+    Column holding the rank of the worker that produced each result.
+    """
+    WORKER_ID_COLUMN = "worker_id"
+    """
+    Column holding a result that is not a dictionary.
+    """
+    RESULT_COLUMN = "result"
+
+    _STOP = object()
+
+    def __init__(self, max_pending=10000, batch_size=1000, flush_seconds=5.):
+        """
+        :param max_pending: Maximum number of results waiting for the writer.
+        :type max_pending: int
+
+        :param batch_size: Maximum number of results written in each batch (e.g.,
+                           a Parquet row group).
+        :type batch_size: int
+
+        :param flush_seconds: A partial batch is written once no new result has
+                              arrived for this many seconds.
+        :type flush_seconds: float
+        """
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, worker_id, results):
+        """
+        Queues a result for the writer thread.  Blocks while the queue is full.
+
+        :param worker_id: Identification number (rank) of the worker who generated
+                          the results
+        :type worker_id: int
+
+        :param results: Results from the worker.  A dictionary is written as one
+                        row with a column per key.
+        """
+        self._raise_error()
+        self._queue.put(ResultSink._to_row(worker_id, results))
+
+    def close(self):
+        """
+        Writes every queued result and closes the output.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(ResultSink._STOP)
+        self._thread.join()
+        self._close_output()
+        self._raise_error()
+
+    @abc.abstractmethod
+    def _write_batch(self, rows):
+        """
+        Writes a batch of rows.  Only called from the writer thread.
+
+        :param rows: Rows built from the results.
+        :type rows: List[dict]
+        """
+        pass
+
+    @abc.abstractmethod
+    def _close_output(self):
+        """
+        Flushes and closes the output after the writer thread has stopped.
+        """
+        pass
+
+    def _run(self):
+        """
+        Body of the writer thread.
+        """
+        batch = []
+        while True:
+            try:
+                row = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                row = None
+            stop = row is ResultSink._STOP
+            if row is not None and not stop:
+                batch.append(row)
+                if len(batch) < self.batch_size:
+                    continue
+            if batch and self._error is None:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    logging.exception("CONTROLLER: Result sink failed to write")
+                    self._error = e
+            batch = []
+            if stop:
+                return
+
+    def _raise_error(self):
+        """
+        Re-raises an error of the writer thread in the caller's thread.
+        """
+        if self._error is not None:
+            raise IOError("Result sink failed: %s" % self._error)
+
+    @staticmethod
+    def _to_row(worker_id, results):
+        """
+        :return: Row holding the worker's ID and its results.
+        :rtype: dict
+        """
+        row = {ResultSink.WORKER_ID_COLUMN: worker_id}
+        if isinstance(results, dict):
+            row.update(results)
+        else:
+            row[ResultSink.RESULT_COLUMN] = results
+        return row
+
+
+class ShardedSink(ResultSink):
+    """
+    Abstract sink that splits the results across numbered files ("shards") with
+    a maximum number of rows each.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    EXTENSION = ""
+
+    def __init__(self, directory, prefix="results", rows_per_shard=100000,
+                 overwrite=False, **kwargs):
+        """
+        :param directory: Directory of the shards.  It is created if needed.
+        :type directory: str
+
+        :param prefix: Shards are named "<prefix>-<number><extension>".
+        :type prefix: str
+
+        :param rows_per_shard: Maximum number of rows in each shard.
+        :type rows_per_shard: int
+
+        :param overwrite: If True, existing shards with the same prefix are
+                          deleted.  Otherwise, they raise an error.  Use True
+                          when resuming from a journal since the journaled
+                          results are written again.
+        :type overwrite: bool
+
+        :param kwargs: Passed to ResultSink.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.rows_per_shard = rows_per_shard
+        os.makedirs(directory, exist_ok=True)
+        existing = glob.glob(os.path.join(glob.escape(directory),
+                                          "%s-[0-9]*%s" % (glob.escape(prefix),
+                                                           self.EXTENSION)))
+        if existing and not overwrite:
+            raise FileExistsError("Result shards \"%s-*%s\" already exist in \"%s\""
+                                  % (prefix, self.EXTENSION, directory))
+        for path in existing:
+            os.remove(path)
+
+        self.n_shards = 0
+        self._rows_in_shard = 0
+        self._shard_open = False
+        ResultSink.__init__(self, **kwargs)
+
+    def _write_batch(self, rows):
+        start = 0
+        while start < len(rows):
+            if not self._shard_open or self._rows_in_shard >= self.rows_per_shard:
+                if self._shard_open:
+                    self._close_shard()
+                path = os.path.join(self.directory, "%s-%05d%s"
+                                    % (self.prefix, self.n_shards, self.EXTENSION))
+                self._open_shard(path)
+                self._shard_open = True
+                self._rows_in_shard = 0
+                self.n_shards += 1
+            end = min(len(rows), start + self.rows_per_shard - self._rows_in_shard)
+            self._write_rows(rows[start:end])
+            self._rows_in_shard += end - start
+            start = end
+
+    def _close_output(self):
+        if self._shard_open:
+            self._close_shard()
+            self._shard_open = False
+
+    @abc.abstractmethod
+    def _open_shard(self, path):
+        """
+        :param path: Path of the new shard.
+        :type path: str
+        """
+        pass
+
+    @abc.abstractmethod
+    def _write_rows(self, rows):
+        """
+        Appends rows to the open shard.
+
+        :param rows: Rows to write.
+        :type rows: List[dict]
+        """
+        pass
+
+    @abc.abstractmethod
+    def _close_shard(self):
+        """
+        Closes the open shard.
+        """
+        pass
+
+
+class JsonlSink(ShardedSink):
+    """
+    Writes each result as one JSON line.  Values that JSON cannot represent are
+    written as strings.
+    """
+    EXTENSION = ".jsonl"
+
+    def __init__(self, directory, prefix="results", rows_per_shard=100000,
+                 overwrite=False, compress=False, **kwargs):
+        """
+        :param compress: If True, shards are gzip compressed.
+        :type compress: bool
+
+        See ShardedSink for the other parameters.
+        """
+        self.compress = compress
+        if compress:
+            self.EXTENSION = ".jsonl.gz"
+        self._file = None
+        ShardedSink.__init__(self, directory, prefix, rows_per_shard, overwrite,
+                             **kwargs)
+
+    def _open_shard(self, path):
+        if self.compress:
+            self._file = gzip.open(path, "wt", compresslevel=1)
+        else:
+            self._file = open(path, "w")
+
+    def _write_rows(self, rows):
+        self._file.write("".join(json.dumps(row, default=str) + "\n" for row in rows))
+        self._file.flush()
+
+    def _close_shard(self):
+        self._file.close()
+        self._file = None
+
+
+class ParquetSink(ShardedSink):
+    """
+    Writes the results as Parquet files with one row group per batch.  The
+    results must be dictionaries with the same keys and the column types are
+    inferred from the first batch.  Requires the pyarrow package.
+    """
+    EXTENSION = ".parquet"
+
+    def __init__(self, directory, prefix="results", rows_per_shard=1000000,
+                 overwrite=False, compression="snappy", **kwargs):
+        """
+        :param compression: Parquet compression codec.
+        :type compression: str
+
+        See ShardedSink for the other parameters.
+        """
+        if pyarrow is None:
+            raise ValueError("ParquetSink requires the pyarrow package")
+        self.compression = compression
+        self._schema = None
+        self._writer = None
+        ShardedSink.__init__(self, directory, prefix, rows_per_shard, overwrite,
+                             **kwargs)
+
+    def _open_shard(self, path):
+        self._path = path
+
+    def _write_rows(self, rows):
+        table = pyarrow.Table.from_pylist(rows, schema=self._schema)
+        if self._schema is None:
+            self._schema = table.schema
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(
+                self._path, self._schema, compression=self.compression)
+        self._writer.write_table(table)
+
+    def _close_shard(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+
+class SampledLog(object):
+    """
+    Logs a frequent message (e.g., one per task) at a bounded rate.  Only every
+    Nth message is logged and at most a given number per second.  The next
+    logged message reports how many were suppressed.
+
+    Messages are formatted by the logging module only if they are logged, so
+    expensive arguments (e.g., the tasks) cost nothing when the level is
+    disabled or the message is skipped.
+    """
+
+    def __init__(self, every=1, max_per_second=None, level=logging.INFO):
+        """
+        :param every: Log one of every this many messages.
+        :type every: int
+
+        :param max_per_second: If not None, maximum number of messages logged in
+                               any one second.
+        :type max_per_second: int
+
+        :param level: Level of the messages.
+        :type level: int
+        """
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.every = every
+        self.max_per_second = max_per_second
+        self.level = level
+        self._lock = threading.Lock()
+        self._n_messages = 0
+        self._n_suppressed = 0
+        self._window_start = 0.
+        self._n_in_window = 0
+
+    def log(self, msg, *args):
+        """
+        :param msg: Format string of the message.
+        :type msg: str
+
+        :param args: Arguments merged into \\p msg with the % operator.
+        """
+        if not logging.getLogger().isEnabledFor(self.level):
+            return
+        with self._lock:
+            self._n_messages += 1
+            if not self._sample():
+                self._n_suppressed += 1
+                return
+            n_suppressed = self._n_suppressed
+            self._n_suppressed = 0
+        if n_suppressed:
+            msg += " (%d similar message(s) suppressed)"
+            args += (n_suppressed,)
+        logging.log(self.level, msg, *args)
+
+    def _sample(self):
+        """
+        :return: True if the current message should be logged.
+        :rtype: bool
+        """
+        if (self._n_messages - 1) % self.every:
+            return False
+        if self.max_per_second is None:
+            return True
+        now = time.monotonic()
+        if now - self._window_start >= 1.:
+            self._window_start = now
+            self._n_in_window = 0
+        if self._n_in_window >= self.max_per_second:
+            return False
+        self._n_in_window += 1
+        return True
@@ -0,0 +1,104 @@
+from mpi4py import MPI
+
+
+class SharedData(object):
+    """
+    Places large read-only inputs in an MPI shared-memory window once per node.
+    One rank on each node (the leader) loads the data and copies it into the
+    window.  Every rank on the node then gets a zero-copy, read-only view of it
+    instead of each worker receiving its own pickled copy.
+    """
+
+    """
+    Byte alignment of each buffer in the shared window.
+    """
+    ALIGNMENT = 64
+
+    @staticmethod
+    def node_comm(comm):
+        """
+        Splits a communicator into the ranks that share a node.  This is a
+        collective operation over \\p comm.
+
+        :param comm: Communicator to split.
+
+        :return: Communicator of the ranks on this rank's node.
+        """
+        return comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.Get_rank())
+
+    @staticmethod
+    def create(node_comm, data=None):
+        """
+        Shares the leader's data with every rank on the node.  This is a
+        collective operation over \\p node_comm.
+
+        :param node_comm: Communicator of the ranks on one node.  Its rank zero is
+                          the leader.
+
+        :param data: Only used on the leader.  Maps a name to a contiguous buffer
+                     such as bytes or a NumPy array.  None shares nothing.
+        :type data: dict
+
+        :return: Maps each name to a read-only view in shared memory and the
+                 window backing the views (or None).  NumPy arrays are returned as
+                 NumPy arrays with the same dtype and shape and any other buffer
+                 as a memoryview.  The window must be kept alive while the views
+                 are in use.
+        :rtype: Tuple(dict, MPI.Win)
+        """
+        is_leader = node_comm.Get_rank() == 0
+        layout = SharedData._build_layout(data) if is_leader else None
+        layout = node_comm.bcast(layout, root=0)
+        if layout is None:
+            return dict(), None
+
+        n_bytes = sum(entry["nbytes"] for entry in layout.values())
+        n_bytes += SharedData.ALIGNMENT * len(layout)
+        win = MPI.Win.Allocate_shared(n_bytes if is_leader else 0, 1, comm=node_comm)
+        buf, _ = win.Shared_query(0)
+        mem = memoryview(buf).cast("B")
+
+        if is_leader:
+            for name, entry in layout.items():
+                src = memoryview(data[name]).cast("B")
+                mem[entry["offset"]:entry["offset"] + entry["nbytes"]] = src
+        # Everyone waits for the leader to finish writing
+        win.Fence()
+
+        views = dict()
+        readonly = mem.toreadonly()
+        for name, entry in layout.items():
+            view = readonly[entry["offset"]:entry["offset"] + entry["nbytes"]]
+            if entry["dtype"] is not None:
+                import numpy
+                view = numpy.frombuffer(view, dtype=entry["dtype"])
+                view = view.reshape(entry["shape"])
+            views[name] = view
+        return views, win
+
+    @staticmethod
+    def _build_layout(data):
+        """
+        Assigns each buffer an aligned offset in the window.
+
+        :param data: Maps a name to a contiguous buffer.
+        :type data: dict
+
+        :return: Maps each name to its offset, size, and NumPy dtype and shape (if
+                 any).  None if there is no data.
+        :rtype: dict
+        """
+        if data is None:
+            return None
+        layout = dict()
+        offset = 0
+        for name, value in data.items():
+            nbytes = memoryview(value).nbytes
+            dtype = getattr(value, "dtype", None)
+            layout[name] = {"offset": offset,
+                            "nbytes": nbytes,
+                            "dtype": dtype.str if dtype is not None else None,
+                            "shape": getattr(value, "shape", None)}
+            offset += nbytes
+            offset += -offset % SharedData.ALIGNMENT
+        return layout
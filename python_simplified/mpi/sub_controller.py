@@ -0,0 +1,150 @@
+import collections
+import logging
+import sys
+from mpi4py import MPI
+
+from mpi.message import ControllerToWorkerMessage, WorkerToControllerMessage
+from mpi.transport import Transport
+
+
+class _Block(object):
+    """
+    Bookkeeping for a block of tasks the sub-controller received from the root.
+    """
+    def __init__(self, task_ids):
+        self.task_ids = task_ids
+        self.remaining = len(task_ids)
+        self.results = dict()
+        self.worker_ranks = dict()
+        self.elapsed = 0.
+
+
+class SubController(object):
+    """
+    Middle tier of the hierarchical mode.  To the root controller, a
+    sub-controller looks like a worker that receives blocks of tasks.  It hands
+    the tasks in each block out to the workers in its group, then sends the
+    block's results up to the root in a single message.
+    """
+    def __init__(self, upper_transport, master_rank, controller, world_ranks):
+        """
+        :param upper_transport: Transport to the root controller.
+        :type upper_transport: Transport
+
+        :param master_rank: Rank of the root controller in the upper communicator.
+        :type master_rank: int
+
+        :param controller: Manages the workers in the sub-controller's group.
+        :type controller: Controller
+
+        :param world_ranks: Rank in MPI.COMM_WORLD of each rank in the group.
+        :type world_ranks: List[int]
+        """
+        self.upper_transport = upper_transport
+        self.master_rank = master_rank
+        self.controller = controller
+        self.world_ranks = world_ranks
+
+        self._block_of_task = dict()
+        # Requests of the sends to the root that have not completed yet
+        self._pending_sends = collections.deque()
+
+    def run(self):
+        """
+        Runs the sub-controller until the root sends the exit message.
+        """
+        master_rank = self.master_rank
+        controller = self.controller
+        local_transport = controller.transport
+        upper_transport = self.upper_transport
+        status = MPI.Status()
+        upstream_done = False
+        # Tasks only arrive from the root so there is no generator to pull from
+        controller.generator_exhausted = True
+
+        logging.info("SUB-CONTROLLER %d: Starting %d workers"
+                     % (self.world_ranks[0], controller.n_workers))
+        while True:
+            # Only pull the next block once the local queue is empty.  If workers
+            # are still busy, take a block only if the root already sent one.
+            if (not upstream_done and not controller.pending
+                    and (controller.all_workers_completed()
+                         or upper_transport.iprobe(master_rank))):
+                msg = upper_transport.recv(source=master_rank)
+                if ControllerToWorkerMessage.extract_should_exit(msg):
+                    upstream_done = True
+                else:
+                    self._add_block(msg)
+
+            while controller.pending and controller.have_available_workers_p():
+                controller.dispatch(controller.next_chunk())
+
+            if controller.all_workers_completed():
+                if upstream_done:
+                    while self._pending_sends:
+                        Transport.wait_all(self._pending_sends.popleft())
+                    controller.terminate_everything()
+                    logging.info("SUB-CONTROLLER %d: Exiting..."
+                                 % self.world_ranks[0])
+                    sys.exit(0)
+                # Nothing is running locally so wait for the root
+                continue
+
+            worker_msg = local_transport.recv(source=MPI.ANY_SOURCE, status=status)
+            self._record_results(status.Get_source(), worker_msg)
+
+    def _add_block(self, msg):
+        """
+        Queues the tasks of a block sent by the root.
+
+        :param msg: Message built by ControllerToWorkerMessage.build().
+        :type msg: dict
+        """
+        task_ids = ControllerToWorkerMessage.extract_task_ids(msg)
+        tasks = ControllerToWorkerMessage.extract_generated_tasks(msg)
+        block = _Block(task_ids)
+        for task_id in task_ids:
+            self._block_of_task[task_id] = block
+        self.controller.add_tasks(task_ids, tasks)
+
+    def _record_results(self, worker, worker_msg):
+        """
+        Stores the results of a chunk returned by a local worker.  Any block that
+        is now complete is sent to the root.
+
+        :param worker: Rank of the worker in the group's communicator.
+        :type worker: int
+
+        :param worker_msg: Message built by WorkerToControllerMessage.build().
+        :type worker_msg: dict
+        """
+        task_ids = WorkerToControllerMessage.extract_task_ids(worker_msg)
+        results = WorkerToControllerMessage.extract_results(worker_msg)
+        elapsed = WorkerToControllerMessage.extract_elapsed(worker_msg)
+        self.controller.complete_chunk(worker, task_ids, elapsed)
+
+        for task_id, result in zip(task_ids, results):
+            block = self._block_of_task.pop(task_id)
+            block.results[task_id] = result
+            block.worker_ranks[task_id] = self.world_ranks[worker]
+            block.elapsed += elapsed / len(results)
+            block.remaining -= 1
+            if block.remaining == 0:
+                self._send_block(block)
+
+    def _send_block(self, block):
+        """
+        Sends the results of a completed block to the root without waiting for
+        the root to receive them, since the root may be busy sending this
+        sub-controller its next block.
+
+        :param block: Block whose tasks all completed.
+        :type block: _Block
+        """
+        message = WorkerToControllerMessage.build(
+            block.task_ids, [block.results[t] for t in block.task_ids],
+            block.elapsed, [block.worker_ranks[t] for t in block.task_ids])
+        self._pending_sends.append(
+            self.upper_transport.isend(message, dest=self.master_rank))
+        while self._pending_sends and Transport.test_all(self._pending_sends[0]):
+            self._pending_sends.popleft()
@@ -0,0 +1,108 @@
+import itertools
+from collections import OrderedDict
+
+
+class TaskSource(object):
+    """
+    Helpers for streaming tasks to the controller.  The controller pulls a task
+    only when a worker has a free slot for it so a source is never materialized
+    in memory.  AbstractTask.task_source() may return any of:
+
+      * A generator or other iterable (e.g., a ParameterGrid or an open file).
+      * An async generator or other async iterable.
+    """
+
+    @staticmethod
+    def iterate(source):
+        """
+        Wraps a task source in a synchronous iterator.
+
+        :param source: Iterable or async iterable of tasks.
+
+        :return: Iterator over the tasks.
+        """
+        if hasattr(source, "__aiter__"):
+            # asyncio takes longer to import than the rest of the framework, so
+            # only async sources load it
+            import asyncio
+            return TaskSource._iterate_async(source, asyncio.new_event_loop())
+        return iter(source)
+
+    @staticmethod
+    def _iterate_async(source, loop):
+        """
+        Steps an async iterable with a private event loop, one task at a time.
+
+        :param source: Async iterable of tasks.
+
+        :param loop: Event loop owned (and closed) by the generator.
+        :type loop: asyncio.AbstractEventLoop
+
+        :return: Generator of the tasks.
+        """
+        iterator = source.__aiter__()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(iterator, "aclose"):
+                loop.run_until_complete(iterator.aclose())
+            loop.close()
+
+    @staticmethod
+    def file_lines(path, parse=None):
+        """
+        Streams a (possibly huge) text file one line at a time.
+
+        :param path: Path to the file.
+        :type path: str
+
+        :param parse: Converts each line (without its newline) into a task.  By
+                      default, the line itself is the task.
+        :type parse: callable
+
+        :return: Generator of the tasks.
+        """
+        with open(path) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                yield parse(line) if parse is not None else line
+
+
+class ParameterGrid(object):
+    """
+    Lazy Cartesian product of parameter values.  Each task is a dictionary that
+    maps every parameter name to one of its values.  Points are generated on
+    demand so a grid of 10^8 points takes no more memory than its axes.
+
+    Example:
+
+        ParameterGrid(alpha=[0.1, 0.2], seed=range(1000000))
+    """
+
+    def __init__(self, *axes, **named_axes):
+        """
+        :param axes: OrderedDicts (or lists of (name, values) pairs) of axes.
+                     Useful when the axis names are not valid keywords.
+
+        :param named_axes: Maps each parameter name to its values.  The values
+                           must be re-iterable (e.g., a list or range).
+        """
+        self.axes = OrderedDict()
+        for axis in axes:
+            self.axes.update(axis)
+        self.axes.update(named_axes)
+
+    def __iter__(self):
+        names = list(self.axes.keys())
+        for values in itertools.product(*self.axes.values()):
+            yield dict(zip(names, values))
+
+    def __len__(self):
+        n_points = 1
+        for values in self.axes.values():
+            n_points *= len(values)
+        return n_points
@@ -0,0 +1,351 @@
+import csv
+import json
+import logging
+import threading
+import time
+
+
+class _TaskRecord(object):
+    """
+    Timestamps of one execution of a task.  Retried and speculative copies of a
+    task each get their own record.
+    """
+    __slots__ = ("task_id", "worker", "dispatch_start", "dispatch_end",
+                 "received", "unpickled", "started", "finished", "sent",
+                 "returned", "results_unpickled", "process_start", "process_end",
+                 "accepted")
+
+    def __init__(self, task_id, worker, dispatch_start, dispatch_end):
+        self.task_id = task_id
+        self.worker = worker
+        self.dispatch_start = dispatch_start
+        self.dispatch_end = dispatch_end
+        self.received = None
+        self.unpickled = None
+        self.started = None
+        self.finished = None
+        self.sent = None
+        self.returned = None
+        self.results_unpickled = None
+        self.process_start = None
+        self.process_end = None
+        self.accepted = False
+
+
+class Telemetry(object):
+    """
+    Collects the timeline of a run on the controller.  Each task's record holds
+    when it was sent (dispatch), reached its worker, was unpickled, waited in
+    the worker's queue, ran execute_task(), travelled back, had its result
+    unpickled, and ran process_results().  The
+    worker timestamps arrive with the results (see
+    WorkerToControllerMessage.TIMINGS_KEY).  Cross-rank intervals assume the
+    nodes' clocks are synchronized.
+
+    At the end of the run, write() saves:
+
+      * <prefix>.csv - One row per execution of a task.
+      * <prefix>.json - Chrome trace of the run.  Open it in Perfetto
+                        (ui.perfetto.dev) or chrome://tracing.
+    """
+
+    CSV_FIELDS = _TaskRecord.__slots__
+    """
+    Intervals summarized at the end of the run as (name, start field, end field).
+    "deliver" includes the time a prefetched chunk waits until its worker takes
+    it and "return" includes pickling the results.  The unpickling times are
+    only measured by the MPI transports.  The local backend counts them in
+    "deliver" and "return".
+    """
+    PHASES = (("dispatch", "dispatch_start", "dispatch_end"),
+              ("deliver", "dispatch_end", "received"),
+              ("unpickle", "received", "unpickled"),
+              ("queued", "unpickled", "started"),
+              ("execute", "started", "finished"),
+              ("return", "sent", "returned"),
+              ("unpickle_results", "returned", "results_unpickled"),
+              ("process", "process_start", "process_end"))
+    CONTROLLER_PID = 0
+
+    def __init__(self, prefix, n_workers):
+        """
+        :param prefix: Path prefix of the output files.
+        :type prefix: str
+
+        :param n_workers: Number of workers of the controller.
+        :type n_workers: int
+        """
+        self.prefix = prefix
+        self.n_workers = n_workers
+        self.start_time = time.time()
+        self.records = []
+        # Record of each task running on each worker keyed by (task ID, worker)
+        self._open = dict()
+        # Accepted record of each task whose result is being processed
+        self._accepted = dict()
+        self._lock = threading.Lock()
+        # (time, number of busy workers) at every change
+        self.busy_samples = [(self.start_time, 0)]
+        self.busy_worker_seconds = 0.
+        self.n_dispatches = 0
+
+    def record_dispatch(self, worker, task_ids, start, end):
+        """
+        :param worker: Worker the chunk was sent to.
+        :type worker: int
+
+        :param task_ids: IDs of the chunk's tasks.
+        :type task_ids: List[int]
+
+        :param start: Time the send started.
+        :type start: float
+
+        :param end: Time the send returned.
+        :type end: float
+        """
+        self.n_dispatches += 1
+        for task_id in task_ids:
+            record = _TaskRecord(task_id, worker, start, end)
+            self.records.append(record)
+            self._open[(task_id, worker)] = record
+
+    def record_results(self, worker, task_ids, accepted, timings, returned,
+                       results_unpickled, revoked_task_ids=None):
+        """
+        :param worker: Worker that returned the chunk.
+        :type worker: int
+
+        :param task_ids: IDs of the executed tasks.
+        :type task_ids: List[int]
+
+        :param accepted: Whether each task's result is processed.
+        :type accepted: List[bool]
+
+        :param timings: Worker timestamps of the chunk or None.
+        :type timings: dict
+
+        :param returned: Time the controller received the chunk's bytes.
+        :type returned: float
+
+        :param results_unpickled: Time the controller finished unpickling them.
+        :type results_unpickled: float
+
+        :param revoked_task_ids: IDs of a revoked chunk's tasks.
+        :type revoked_task_ids: List[int]
+        """
+        for task_id in revoked_task_ids or ():
+            record = self._open.pop((task_id, worker), None)
+            if record is not None:
+                self.records.remove(record)
+        marks = timings["marks"] if timings is not None else None
+        for i, (task_id, accept) in enumerate(zip(task_ids, accepted)):
+            record = self._open.pop((task_id, worker), None)
+            if record is None:
+                continue
+            record.returned = returned
+            record.results_unpickled = results_unpickled
+            record.accepted = accept
+            if marks is not None:
+                record.received = timings["received"]
+                record.unpickled = timings["unpickled"]
+                record.started = marks[i]
+                record.finished = marks[i + 1]
+                record.sent = timings["sent"]
+            if accept:
+                with self._lock:
+                    self._accepted[task_id] = record
+
+    def record_processing(self, task_id, start, end):
+        """
+        Called from the thread that ran process_results() for a task.
+
+        :param task_id: ID of the task.
+        :type task_id: int
+
+        :param start: Time process_results() was called.
+        :type start: float
+
+        :param end: Time process_results() returned.
+        :type end: float
+        """
+        with self._lock:
+            record = self._accepted.pop(task_id, None)
+        if record is not None:
+            record.process_start = start
+            record.process_end = end
+
+    def record_busy_workers(self, n_busy):
+        """
+        :param n_busy: Number of workers with at least one outstanding chunk.
+        :type n_busy: int
+        """
+        now = time.time()
+        last_time, last_busy = self.busy_samples[-1]
+        if n_busy == last_busy:
+            return
+        self.busy_worker_seconds += last_busy * (now - last_time)
+        self.busy_samples.append((now, n_busy))
+
+    def counters(self, transport=None):
+        """
+        :param transport: If specified, its message counters are included.
+        :type transport: Transport
+
+        :return: Summary counters of the run so far.
+        :rtype: dict
+        """
+        now = time.time()
+        wall = now - self.start_time
+        last_time, last_busy = self.busy_samples[-1]
+        busy = self.busy_worker_seconds + last_busy * (now - last_time)
+        completed = sum(1 for r in self.records if r.accepted)
+        counters = dict()
+        counters["wall_seconds"] = wall
+        counters["tasks_completed"] = completed
+        counters["tasks_per_second"] = completed / wall if wall > 0 else 0.
+        counters["task_executions"] = len(self.records)
+        counters["chunks_dispatched"] = self.n_dispatches
+        counters["busy_worker_seconds"] = busy
+        counters["idle_worker_seconds"] = max(0., self.n_workers * wall - busy)
+        for name, start_field, end_field in Telemetry.PHASES:
+            counters[name + "_seconds"] = self._phase_seconds(start_field, end_field)
+        if transport is not None:
+            counters["messages_sent"] = transport.messages_sent
+            counters["messages_received"] = transport.messages_received
+            counters["bytes_sent"] = transport.bytes_sent
+            counters["bytes_received"] = transport.bytes_received
+        return counters
+
+    def write(self, transport=None):
+        """
+        Writes the CSV records and the Chrome trace and logs the counters.
+
+        :param transport: If specified, its message counters are included.
+        :type transport: Transport
+
+        :return: Summary counters of the run.
+        :rtype: dict
+        """
+        counters = self.counters(transport)
+        logging.info("CONTROLLER: Telemetry %s" % json.dumps(counters, sort_keys=True))
+
+        with open(self.prefix + ".csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(Telemetry.CSV_FIELDS)
+            for record in self.records:
+                writer.writerow([self._csv_value(getattr(record, field))
+                                 for field in Telemetry.CSV_FIELDS])
+
+        with open(self.prefix + ".json", "w") as f:
+            json.dump({"traceEvents": self._trace_events(),
+                       "displayTimeUnit": "ms",
+                       "otherData": counters}, f)
+        logging.info("CONTROLLER: Wrote the timeline to \"%s.json\" and \"%s.csv\""
+                     % (self.prefix, self.prefix))
+        return counters
+
+    def _phase_seconds(self, start_field, end_field):
+        """
+        :return: Total seconds between two timestamps over every chunk (dispatch,
+                 deliver, unpickle, queued, return and unpickle_results) or task
+                 (execute and process).
+        :rtype: float
+        """
+        total = 0.
+        seen = set()
+        per_chunk = start_field in ("dispatch_start", "dispatch_end", "received",
+                                    "unpickled", "sent", "returned")
+        for record in self.records:
+            start = getattr(record, start_field)
+            end = getattr(record, end_field)
+            if start is None or end is None:
+                continue
+            if per_chunk:
+                # Every task of a chunk shares these timestamps
+                chunk = (record.worker, record.dispatch_start, start_field)
+                if chunk in seen:
+                    continue
+                seen.add(chunk)
+            total += end - start
+        return total
+
+    def _csv_value(self, value):
+        """
+        :return: Timestamps as seconds since the start of the run.
+        """
+        if isinstance(value, float):
+            return "%.6f" % (value - self.start_time)
+        if value is None:
+            return ""
+        return value
+
+    def _trace_events(self):
+        """
+        :return: Chrome trace events.  Each rank is a process and overlapping
+                 intervals on a rank are spread over lanes (threads).
+        :rtype: List[dict]
+        """
+        events = []
+        lanes = dict()
+        # Thread ID of each (pid, category, lane)
+        tids = dict()
+
+        def add(name, pid, category, start, end, args=None):
+            if start is None or end is None:
+                return
+            ends = lanes.setdefault((pid, category), [])
+            for lane, lane_end in enumerate(ends):
+                if lane_end <= start:
+                    ends[lane] = end
+                    break
+            else:
+                lane = len(ends)
+                ends.append(end)
+            thread = (pid, category, lane)
+            if thread not in tids:
+                tids[thread] = len(tids)
+                events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                               "tid": tids[thread],
+                               "args": {"name": "%s %d" % (category, lane)}})
+            event = {"name": name, "cat": category, "ph": "X", "pid": pid,
+                     "tid": tids[thread],
+                     "ts": (start - self.start_time) * 1e6,
+                     "dur": max(0., end - start) * 1e6}
+            if args is not None:
+                event["args"] = args
+            events.append(event)
+
+        chunks = set()
+        for record in self.records:
+            args = {"task_id": record.task_id, "accepted": record.accepted}
+            chunk = (record.worker, record.dispatch_start)
+            if chunk not in chunks:
+                chunks.add(chunk)
+                add("dispatch", Telemetry.CONTROLLER_PID, "dispatch",
+                    record.dispatch_start, record.dispatch_end,
+                    {"worker": record.worker})
+                add("unpickle", record.worker, "unpickle", record.received,
+                    record.unpickled)
+                add("queued", record.worker, "queue", record.unpickled,
+                    record.started)
+                add("return", record.worker, "return", record.sent,
+                    record.returned)
+                add("unpickle results", Telemetry.CONTROLLER_PID, "unpickle",
+                    record.returned, record.results_unpickled,
+                    {"worker": record.worker})
+            add("task %d" % record.task_id, record.worker, "execute",
+                record.started, record.finished, args)
+            add("process_results", Telemetry.CONTROLLER_PID, "process",
+                record.process_start, record.process_end, args)
+
+        for t, n_busy in self.busy_samples:
+            events.append({"name": "busy workers", "ph": "C",
+                           "pid": Telemetry.CONTROLLER_PID,
+                           "ts": (t - self.start_time) * 1e6,
+                           "args": {"busy": n_busy}})
+        pids = {Telemetry.CONTROLLER_PID} | {r.worker for r in self.records}
+        for pid in sorted(pids):
+            name = "controller" if pid == Telemetry.CONTROLLER_PID else "worker %d" % pid
+            events.append({"name": "process_name", "ph": "M", "pid": pid,
+                           "args": {"name": name}})
+        return events
@@ -0,0 +1,315 @@
+import sys
+import time
+
+from mpi.codec import PickleCodec
+
+# mpi4py is imported where MPI is used so that the local backend (see
+# mpi.local_backend) runs without it
+
+
+class Transport(object):
+    """
+    Moves messages between the controller and the workers.
+
+    By default, messages are pickled by mpi4py's lowercase send/recv.  If a
+    codec is specified, it serializes each message to bytes that are sent with
+    the buffer-based Send/Recv.  If a zero copy threshold is set, every contiguous
+    buffer (e.g., a NumPy array or bytearray) at least that large is sent
+    out-of-band after the message.  The receiver allocates each buffer once and
+    the unpickled object is a view over it, so large payloads are never copied
+    into or out of a pickle stream.
+
+    The transport counts the messages it sends and receives.  Their sizes are
+    counted when the transport serializes them itself (a codec, the zero copy
+    path or count_bytes).  Then recv() also notes when the last message's
+    bytes arrived and when they were deserialized (see receive_times).
+    """
+    MESSAGE_TAG = 0
+    BUFFER_TAG = 1
+    HEARTBEAT_TAG = 2
+
+    def __init__(self, comm, zero_copy_threshold=None, codec=None,
+                 count_bytes=False):
+        """
+        :param comm: MPI communicator used for all messages or the local
+                     backend's LocalComm.
+
+        :param zero_copy_threshold: Minimum size in bytes of a buffer sent
+                                    out-of-band.  None disables the zero copy path.
+        :type zero_copy_threshold: int
+
+        :param codec: Serializes the messages.  None uses mpi4py's pickling
+                      unless the zero copy path is enabled.
+        :type codec: AbstractCodec
+
+        :param count_bytes: If True, messages pickled by mpi4py are pickled and
+                            unpickled by the transport instead so their size
+                            and unpickling time are known.
+        :type count_bytes: bool
+        """
+        self.comm = comm
+        if Transport.is_mpi_comm(comm):
+            from mpi4py import MPI
+            self.any_source = MPI.ANY_SOURCE
+            self._status_class = MPI.Status
+        else:
+            from mpi.local_backend import LocalComm, LocalStatus
+            self.any_source = LocalComm.ANY_SOURCE
+            self._status_class = LocalStatus
+        self.zero_copy_threshold = zero_copy_threshold
+        self._use_mpi4py_pickle = codec is None and zero_copy_threshold is None
+        self.codec = codec if codec is not None else PickleCodec()
+        self.count_bytes = count_bytes
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # (bytes received, deserialized) times of the last message if counted
+        self.receive_times = None
+
+    def send(self, obj, dest):
+        """
+        Sends an object and blocks until its buffers can be reused.
+
+        :param obj: Pickleable object to transmit.
+        :param dest: Rank of the receiver.
+        :type dest: int
+        """
+        self.messages_sent += 1
+        if self._use_mpi4py_pickle and not self.count_bytes:
+            self.comm.send(obj, dest=dest, tag=Transport.MESSAGE_TAG)
+            return
+        from mpi4py import MPI
+        if self._use_mpi4py_pickle:
+            data = MPI.pickle.dumps(obj)
+            self.bytes_sent += len(data)
+            self.comm.Send([data, MPI.BYTE], dest=dest, tag=Transport.MESSAGE_TAG)
+            return
+        data, buffers = self._dumps(obj)
+        self.comm.Send([data, MPI.BYTE], dest=dest, tag=Transport.MESSAGE_TAG)
+        for buf in buffers:
+            self.comm.Send([buf, MPI.BYTE], dest=dest, tag=Transport.BUFFER_TAG)
+
+    def isend(self, obj, dest):
+        """
+        Sends an object without blocking.
+
+        :param obj: Pickleable object to transmit.  Its buffers must not be
+                    modified until the requests complete.
+        :param dest: Rank of the receiver.
+        :type dest: int
+
+        :return: Requests that must all complete before the send is finished.
+        :rtype: List[MPI.Request]
+        """
+        self.messages_sent += 1
+        if self._use_mpi4py_pickle and not self.count_bytes:
+            return [self.comm.isend(obj, dest=dest, tag=Transport.MESSAGE_TAG)]
+        from mpi4py import MPI
+        if self._use_mpi4py_pickle:
+            data = MPI.pickle.dumps(obj)
+            self.bytes_sent += len(data)
+            return [self.comm.Isend([data, MPI.BYTE], dest=dest,
+                                    tag=Transport.MESSAGE_TAG)]
+        data, buffers = self._dumps(obj)
+        requests = [self.comm.Isend([data, MPI.BYTE], dest=dest,
+                                    tag=Transport.MESSAGE_TAG)]
+        for buf in buffers:
+            requests.append(self.comm.Isend([buf, MPI.BYTE], dest=dest,
+                                            tag=Transport.BUFFER_TAG))
+        return requests
+
+    def recv(self, source=None, status=None):
+        """
+        Blocks until an object arrives.
+
+        :param source: Rank to receive from.  None receives from any rank.
+        :type source: int
+
+        :param status: If specified, filled with the status of the message.
+        :type status: MPI.Status
+
+        :return: Object that was transmitted.
+        """
+        self.messages_received += 1
+        if source is None:
+            source = self.any_source
+        if self._use_mpi4py_pickle and not self.count_bytes:
+            return self.comm.recv(source=source, tag=Transport.MESSAGE_TAG,
+                                  status=status)
+        if status is None:
+            status = self.new_status()
+        data = self._recv_bytes(source, Transport.MESSAGE_TAG, status)
+        received_at = time.time()
+        if self._use_mpi4py_pickle:
+            from mpi4py import MPI
+            obj = MPI.pickle.loads(data)
+        else:
+            obj = self.codec.loads(data, buffers=self._buffer_stream(status.Get_source()))
+        if self.count_bytes:
+            self.receive_times = (received_at, time.time())
+        return obj
+
+    def iprobe(self, source=None):
+        """
+        Checks without blocking whether a message is waiting to be received.
+
+        :param source: Rank to check for a message from.  None checks for a
+                       message from any rank.
+        :type source: int
+
+        :return: True if recv() would not block.
+        :rtype: bool
+        """
+        return self.comm.Iprobe(source=self.any_source if source is None else source,
+                                tag=Transport.MESSAGE_TAG)
+
+    def new_status(self):
+        """
+        :return: Empty status to pass to recv().
+        :rtype: MPI.Status
+        """
+        return self._status_class()
+
+    def send_heartbeat(self, dest):
+        """
+        Sends an empty heartbeat message.  Heartbeats use their own tag so they
+        never match recv().
+
+        :param dest: Rank of the receiver.
+        :type dest: int
+        """
+        self.comm.send(None, dest=dest, tag=Transport.HEARTBEAT_TAG)
+
+    def recv_heartbeats(self):
+        """
+        Receives every heartbeat that already arrived without blocking.
+
+        :return: Rank of the sender of each heartbeat.
+        :rtype: List[int]
+        """
+        senders = []
+        status = self.new_status()
+        while self.comm.Iprobe(source=self.any_source, tag=Transport.HEARTBEAT_TAG,
+                               status=status):
+            sender = status.Get_source()
+            self.comm.recv(source=sender, tag=Transport.HEARTBEAT_TAG)
+            senders.append(sender)
+        return senders
+
+    @staticmethod
+    def wait_all(requests):
+        """
+        Blocks until every request returned by isend() completes.
+
+        :param requests: Requests of any number of sends.
+        :type requests: List[MPI.Request]
+        """
+        MPI = Transport.mpi_module()
+        if MPI is not None and all(isinstance(r, MPI.Request) for r in requests):
+            MPI.Request.Waitall(requests)
+            return
+        for request in requests:
+            request.Wait()
+
+    @staticmethod
+    def test_all(requests):
+        """
+        Checks without blocking whether every request returned by isend()
+        completed.
+
+        :param requests: Requests of any number of sends.
+        :type requests: List[MPI.Request]
+
+        :return: True if every send is finished.
+        :rtype: bool
+        """
+        MPI = Transport.mpi_module()
+        if MPI is not None and all(isinstance(r, MPI.Request) for r in requests):
+            return MPI.Request.Testall(requests)
+        return all(request.Test() for request in requests)
+
+    @staticmethod
+    def mpi_module():
+        """
+        :return: mpi4py's MPI module or None if it was never imported, e.g.,
+                 with the local backend.  Then no MPI object can exist.
+        """
+        return sys.modules.get("mpi4py.MPI")
+
+    @staticmethod
+    def is_mpi_comm(comm):
+        """
+        :param comm: MPI communicator or the local backend's LocalComm.
+
+        :return: True if \\p comm is an MPI communicator.
+        :rtype: bool
+        """
+        MPI = Transport.mpi_module()
+        return MPI is not None and isinstance(comm, MPI.Comm)
+
+    def _dumps(self, obj):
+        """
+        Serializes an object and splits off its large buffers.
+
+        :param obj: Pickleable object.
+
+        :return: Serialized message and the raw out-of-band buffers in order.
+        :rtype: Tuple(bytes, List[memoryview])
+        """
+        buffers = []
+        if self.zero_copy_threshold is None:
+            data = self.codec.dumps(obj)
+            self.bytes_sent += len(data)
+            return data, buffers
+
+        def keep_in_band(pickle_buffer):
+            try:
+                raw = pickle_buffer.raw()
+            except BufferError:
+                # Non-contiguous buffers cannot be sent as a single block
+                return True
+            if raw.nbytes < self.zero_copy_threshold:
+                return True
+            buffers.append(raw)
+            return False
+
+        data = self.codec.dumps(obj, buffer_callback=keep_in_band)
+        self.bytes_sent += len(data) + sum(buf.nbytes for buf in buffers)
+        return data, buffers
+
+    def _buffer_stream(self, source):
+        """
+        Generator of the out-of-band buffers that follow a message.  Unpickling
+        pulls each buffer from the sender only when it reaches it in the stream.
+
+        :param source: Rank that sent the message.
+        :type source: int
+        """
+        while True:
+            yield self._recv_bytes(source, Transport.BUFFER_TAG)
+
+    def _recv_bytes(self, source, tag, status=None):
+        """
+        Receives a raw message into a newly allocated buffer of the right size.
+
+        :param source: Rank to receive from.
+        :type source: int
+
+        :param tag: Tag of the message.
+        :type tag: int
+
+        :param status: If specified, filled with the status of the message.
+        :type status: MPI.Status
+
+        :return: Contents of the message.
+        :rtype: bytearray
+        """
+        from mpi4py import MPI
+        if status is None:
+            status = MPI.Status()
+        self.comm.Probe(source=source, tag=tag, status=status)
+        buf = bytearray(status.Get_count(MPI.BYTE))
+        self.bytes_received += len(buf)
+        self.comm.Recv([buf, MPI.BYTE], source=status.Get_source(), tag=tag)
+        return buf
@@ -0,0 +1,107 @@
+import logging
+import sys
+from collections import OrderedDict
+
+
+class WorkerCache(object):
+    """
+    Keyed least-recently-used cache that lives on a worker for the whole run.
+    Tasks use it to keep expensive state (e.g., a model loaded from disk) between
+    tasks.  If AbstractTask.cache_key() returns the same key, the controller
+    routes tasks to the worker that already holds the key.
+    """
+
+    def __init__(self, max_entries=4, max_bytes=None, size_of=None):
+        """
+        :param max_entries: Maximum number of cached values.
+        :type max_entries: int
+
+        :param max_bytes: If not None, maximum total size of the cached values.
+                          A single value larger than this is still cached alone.
+        :type max_bytes: int
+
+        :param size_of: Returns a value's size in bytes.  By default, a value's
+                        "nbytes" attribute (e.g., NumPy arrays) is used if it has
+                        one and sys.getsizeof() otherwise.
+        :type size_of: callable
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of if size_of is not None else WorkerCache._default_size
+        self._values = OrderedDict()
+        self._sizes = dict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """
+        Returns the cached value of a key, loading it first if needed.
+
+        :param key: Hashable key of the value.
+
+        :param loader: Called without arguments to create the value on a miss.
+        :type loader: callable
+
+        :return: Value of the key.
+        """
+        if key in self._values:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+        self.misses += 1
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Caches a value and evicts the least recently used values over the limits.
+
+        :param key: Hashable key of the value.
+        :param value: Value to cache.
+        """
+        if key in self._values:
+            self._evict(key)
+        size = self.size_of(value)
+        self._values[key] = value
+        self._sizes[key] = size
+        self.n_bytes += size
+        while len(self._values) > 1 and (
+                len(self._values) > self.max_entries
+                or (self.max_bytes is not None and self.n_bytes > self.max_bytes)):
+            oldest = next(iter(self._values))
+            logging.debug("Worker cache: Evicting %r" % (oldest,))
+            self._evict(oldest)
+
+    def clear(self):
+        """
+        Removes every cached value.
+        """
+        self._values.clear()
+        self._sizes.clear()
+        self.n_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def _evict(self, key):
+        """
+        :param key: Key of the value to remove.
+        """
+        del self._values[key]
+        self.n_bytes -= self._sizes.pop(key)
+
+    @staticmethod
+    def _default_size(value):
+        """
+        :return: Estimated size of the value in bytes.
+        :rtype: int
+        """
+        n_bytes = getattr(value, "nbytes", None)
+        return n_bytes if isinstance(n_bytes, int) else sys.getsizeof(value)
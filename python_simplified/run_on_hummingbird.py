@@ -10,6 +10,10 @@ class Task(AbstractTask):
     Class that defines tasks to be performed by workers and then processes the results
     generated by those workers.
     """
+    # If the results only need to be summed (or otherwise combined), let each worker
+    # combine its own and receive the total in "process_reduced_results" instead.
+    # reduce_op = MPI.SUM  # Requires "from mpi4py import MPI"
+
     def __init__(self):
         AbstractTask.__init__(self)
         #
@@ -25,6 +29,10 @@ class Task(AbstractTask):
         The tasks generated must be PICKLABLE.  If it is not pickable reliably, then the
         program will crash.
 
+        Tasks are pulled lazily so the generator may enumerate far more tasks than
+        fit in memory.  To generate the tasks from the object's state, override
+        "task_source" instead (see mpi/task_source.py).
+
         :return: A single task to be sent to the worker.
         """
         #
@@ -53,7 +61,7 @@ class Task(AbstractTask):
 class Worker(AbstractWorker):
     """
     The worker class is what performs the tasks sent from the master.  The parameter,
-    \p msg, will be a Python dictionary.  The worker's results are sent back in the 
+    \\p msg, will be a Python dictionary.  The worker's results are sent back in the 
     form of a dictionary.
     """
     def execute_task(self, task_msg):
@@ -91,6 +99,32 @@ if __name__ == '__main__':
     # If you do not specify values for these parameters below, then the default values will be used.
     # HummingbirdFramework.log_file = "hb_logs.txt"
     # HummingbirdFramework.log_level = logging.INFO
+    # HummingbirdFramework.log_per_rank = True  # One log file per rank instead of one shared file
+    # HummingbirdFramework.log_async = True  # Write the logs from a background thread
+    # HummingbirdFramework.log_task_every = 100  # Log only every 100th per-task message
+    # HummingbirdFramework.chunk_size = 16  # Tasks sent per message
+    # HummingbirdFramework.target_chunk_seconds = 0.5  # Adapt the chunk size to the task duration
+    # HummingbirdFramework.prefetch_depth = 2  # Chunks queued on each worker
+    # HummingbirdFramework.send_window = 2  # Results a worker may send without blocking
+    # HummingbirdFramework.zero_copy_threshold = 65536  # Send NumPy arrays >= 64KB without copies
+    # HummingbirdFramework.codec = CompressedCodec(BinaryCodec())  # See mpi/codec.py
+    # HummingbirdFramework.group_size = HummingbirdFramework.GROUP_BY_NODE  # One sub-controller per node
+    # HummingbirdFramework.scheduler = Controller.GUIDED  # Chunks shrink toward the end of the run
+    # HummingbirdFramework.steal_work = True  # Move queued chunks from busy to idle workers
+    # HummingbirdFramework.speculate = True  # Rerun straggler tasks on idle workers
+    # HummingbirdFramework.journal_file = "hb_journal.bin"  # Resume a killed job without redoing tasks
+    # HummingbirdFramework.task_timeout = 600  # Requeue the tasks of workers that hang
+    # HummingbirdFramework.heartbeat_seconds = 10  # Requeue the tasks of unresponsive workers
+    # HummingbirdFramework.result_sink = functools.partial(JsonlSink, "results")  # See mpi/result_sink.py
+    # HummingbirdFramework.process_results_mode = ResultProcessor.ORDERED  # Run process_results off the dispatch thread
+    # HummingbirdFramework.worker_cache_entries = 2  # Values kept by AbstractWorker.cached()
+    # HummingbirdFramework.memo_dir = "hb_memo"  # Reuse the results of identical tasks across runs
+    # HummingbirdFramework.memo_code_version = "1"  # Change to invalidate the stored results
+    # HummingbirdFramework.worker_concurrency = 32  # Chunks each worker runs at once (one worker per node)
+    # HummingbirdFramework.local_workers = 4  # Worker processes when run without MPI (HB_BACKEND=local)
+    # HummingbirdFramework.trace_prefix = "hb_trace"  # Write a timeline (hb_trace.json for Perfetto) and counters
+    # HummingbirdFramework.broadcast_config = True  # Validate the settings on the master and copy them to every rank
+    # For faster startup on many nodes, launch with "mpirun python3 -m mpi.launcher run_on_hummingbird.py"
 
     # Nothing should be placed after the run.
     # The run method manages both workers and the controller automatically.